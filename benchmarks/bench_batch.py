@@ -0,0 +1,86 @@
+"""
+Batch benchmark: building many small projects with one premd build
+process per project, and with a single premd batch process, with a
+stub standing in for pandoc. Checks that both build the same files.
+
+    python benchmarks/bench_batch.py [--projects N] [--jobs N]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+
+import synthetic
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    "stub_pandoc.py")
+TARGETS = ["book.html", "book.epub"]
+
+
+def make_projects(directory, projects):
+    for index in range(projects):
+        project = os.path.join(directory, "project{:04}".format(index))
+        synthetic.generate_book(project, files=5, lines=50, seed=index)
+        with open(os.path.join(project, "premd.yml"), "w") as stream:
+            json.dump({ # JSON is YAML too
+                "command": STUB, "root": "book.txt", "targets": TARGETS
+            }, stream)
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+    )
+
+
+def outputs(projects):
+    built = set()
+    for project in projects:
+        for target in TARGETS:
+            with open(os.path.join(project, target), "rb") as stream:
+                built.add((os.path.basename(project), target, stream.read()))
+    return built
+
+
+def premd(arguments, cwd = None):
+    subprocess.run(
+        [sys.executable, "-m", "premd"] + arguments, cwd=cwd, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        projects = make_projects(directory, args.projects)
+
+        start = time.perf_counter()
+        for project in projects:
+            premd(["build", "--force"], cwd=project)
+        results["build"] = time.perf_counter() - start
+        built = outputs(projects)
+
+        start = time.perf_counter()
+        premd(["batch", "--force", "--jobs", str(args.jobs)] + projects)
+        results["batch"] = time.perf_counter() - start
+        if outputs(projects) != built:
+            print("The variants build different files!", file=sys.stderr)
+            sys.exit(1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, seconds in results.items():
+            print("{:12} {:8.3f}s".format(name, seconds))
+
+
+if __name__ == "__main__":
+    main()
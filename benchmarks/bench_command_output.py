@@ -0,0 +1,136 @@
+"""
+Command output benchmark: writing the processed document to a
+command's stdin through its text stream, and as bytes passed on
+from the memory-mapped input files, with cat standing in for pandoc.
+Reports the elapsed time and the CPU time of this process, since
+cat competes for the CPU, and checks that the command is sent the
+same bytes either way. With --no-trailing-space, the book is written
+without the trailing space premd removes, as most editors save it, so
+more of the prose is passed on as it is.
+
+    python benchmarks/bench_command_output.py [--no-trailing-space]
+                                              [book shape options]
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import resource
+import tempfile
+import argparse
+
+import synthetic
+
+from premd import flatten
+from premd import command
+from premd import configuration
+from premd.__main__ import output_processed
+
+
+def text_output(infile, cmd, run_plugins):
+    output_processed(infile, cmd.stdin, run_plugins, fast=True)
+
+
+def bytes_output(infile, cmd, run_plugins):
+    cmd.write_chunks(flatten.flatten_bytes(infile, run_plugins))
+
+
+PATHS = {
+    "text": text_output,
+    "bytes": bytes_output,
+}
+
+
+def cat_config():
+    config = configuration.Configurations()
+    config.data.update({
+        # cat, writing to the file given with -o
+        "command": "sh",
+        "arguments": ['-c cat>"$2" sh'],
+        "shared": {},
+    })
+    return config
+
+
+def run(config, path, infile, target, run_plugins):
+    with command.RunCommand(config, target) as cmd:
+        path(infile, cmd, run_plugins)
+    if cmd.returncode != 0:
+        print("cat failed!", file=sys.stderr)
+        sys.exit(1)
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def best_times(config, path, infile, run_plugins, repeat):
+    best, best_cpu = float("inf"), float("inf")
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), cpu_time()
+        run(config, path, infile, os.devnull, run_plugins)
+        best = min(best, time.perf_counter() - start)
+        best_cpu = min(best_cpu, cpu_time() - start_cpu)
+    return {"elapsed": best, "cpu": best_cpu}
+
+
+def strip_trailing_space(directory):
+    for filename in glob.glob(os.path.join(directory, "**", "*.txt"),
+                              recursive=True):
+        with open(filename) as stream:
+            lines = [line.rstrip() for line in stream]
+        with open(filename, "w") as stream:
+            stream.writelines(line + "\n" for line in lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    synthetic.add_arguments(parser)
+    parser.set_defaults(files=200, lines=1000, depth=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-trailing-space", action="store_true",
+                        help="remove the trailing space from the book")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+
+    config = cat_config()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        infile = synthetic.generate_book(
+            os.path.join(directory, "book"), **synthetic.book_options(args)
+        )
+        if args.no_trailing_space:
+            strip_trailing_space(directory)
+        outputs = set()
+        for name, path in PATHS.items():
+            outname = os.path.join(directory, name + ".out")
+            run(config, path, infile, outname, False)
+            with open(outname, "rb") as stream:
+                outputs.add(stream.read())
+        if len(outputs) != 1:
+            print("The paths send different bytes!", file=sys.stderr)
+            sys.exit(1)
+
+        for name, path in PATHS.items():
+            # the first target runs the plugins, the others do not
+            for run_plugins in (True, False):
+                key = name + ("_plugins" if run_plugins else "")
+                results[key] = best_times(
+                    config, path, infile, run_plugins, args.repeat
+                )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, times in results.items():
+            print("{:14} {:8.3f}s  cpu {:8.3f}s".format(
+                name, times["elapsed"], times["cpu"]
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Memory benchmark: the peak resident set size of premd summarize on
+synthetic books of growing size, with the summaries kept in memory
+and with --low-memory. Checks that both give the same summaries.
+
+    python benchmarks/bench_memory.py [--sizes 100,1000,4000] [--lines N]
+"""
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import argparse
+import subprocess
+
+SYNTHETIC = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "synthetic.py")
+
+
+def peak_rss(arguments, outfile):
+    """Run premd with :arguments, writing to :outfile, and return the
+    peak resident set size of the process in MiB."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "premd"] + arguments,
+        stdout=outfile, stderr=subprocess.DEVNULL
+    )
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        print("premd failed on", arguments, file=sys.stderr)
+        sys.exit(1)
+    if sys.platform == "darwin":
+        return usage.ru_maxrss / 2**20 # bytes
+    return usage.ru_maxrss / 2**10 # kilobytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="100,1000,4000",
+                        help="the number of files in each book")
+    parser.add_argument("--lines", type=int, default=200,
+                        help="lines per file")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for files in [int(size) for size in args.sizes.split(",")]:
+            # generated in a process of its own, since the premd
+            # processes we fork would otherwise start out as big as
+            # this one
+            book = subprocess.run(
+                [sys.executable, SYNTHETIC, os.path.join(directory, str(files)),
+                 "--files", str(files), "--lines", str(args.lines),
+                 "--depth", "3", "--header-density", "0.05",
+                 "--todo-density", "0.05"],
+                stdout=subprocess.PIPE, text=True, check=True
+            ).stdout.strip()
+            summaries = set()
+            for variant, extra in (("memory", []),
+                                   ("low_memory", ["--low-memory"])):
+                output = os.path.join(directory, "summary.txt")
+                with open(output, "w") as outfile:
+                    results["{}/{}".format(files, variant)] = peak_rss(
+                        ["summarize", book, "--no-cache"] + extra, outfile
+                    )
+                with open(output, "rb") as stream:
+                    # only the digest, so we stay small for the next fork
+                    summaries.add(hashlib.sha256(stream.read()).digest())
+            if len(summaries) != 1:
+                print("The variants summarize differently!", file=sys.stderr)
+                sys.exit(1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, mib in results.items():
+            print("{:18} {:8.1f} MiB".format(name, mib))
+
+
+if __name__ == "__main__":
+    main()
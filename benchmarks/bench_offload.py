@@ -0,0 +1,119 @@
+"""
+Offloading benchmark: writing the processed document while a
+CPU-heavy observer plugin, standing in for a spell checker, runs in
+this process, and while it runs in a worker process. Reports when the
+output was closed, which is when a converter reading it would see its
+end, and when the plugin was done, and checks that the plugin collects
+the same either way.
+
+    python benchmarks/bench_offload.py [--work N] [--fast]
+                                       [book shape options]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+
+import synthetic
+
+from premd import plugin
+from premd import offload
+from premd.plugin import plugins
+from premd.__main__ import output_processed
+
+
+class Checker(plugin.ObserverPlugin, plugin.MergeableSummaryPlugin):
+    """Heavy checking of each line"""
+    offloadable = True
+    work = 200 # rounds of busy work per word
+
+    def __init__(self):
+        self.score = 0
+
+    def observe_line(self, filename, lineno, line):
+        for word in line.split():
+            score = len(word)
+            for _ in range(self.work):
+                score = (score * 31 + len(word)) % 1000003
+            self.score += score
+
+    def partial_state(self):
+        return self.score
+
+    def merge_state(self, state):
+        self.score += state
+
+    def summarize(self, outfile):
+        print(self.score, file=outfile)
+
+
+class TimedOutput(io.StringIO):
+    """Remembers when the output was closed."""
+    def close(self):
+        self.closed_at = time.perf_counter()
+        super().close()
+
+
+def run(infile, offloading, fast):
+    offload.enable(offloading)
+    plugins.reset()
+    outfile = TimedOutput()
+    start = time.perf_counter()
+    output_processed(infile, outfile, fast=fast)
+    outfile.close() # as RunCommand closes the command's stdin
+    offload.collect()
+    done = time.perf_counter()
+    return {
+        "output": outfile.closed_at - start,
+        "plugin_done": done - start,
+        "score": plugins.summary_plugins["checker"].score,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    synthetic.add_arguments(parser)
+    parser.set_defaults(files=50, lines=400, depth=2)
+    parser.add_argument("--work", type=int, default=Checker.work,
+                        help="rounds of busy work per word")
+    parser.add_argument("--fast", action="store_true",
+                        help="output through the memory-mapped fast path")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+    Checker.work = args.work
+
+    # the checker is the only plugin, as if it were installed
+    plugins._plugin_classes = {"checker": Checker}
+    plugins._instantiate_plugins()
+    plugins._collect_plugins()
+
+    with tempfile.TemporaryDirectory() as directory:
+        infile = synthetic.generate_book(
+            os.path.join(directory, "book"), **synthetic.book_options(args)
+        )
+        results = {
+            "inline": run(infile, False, args.fast),
+            "offloaded": run(infile, True, args.fast),
+        }
+
+    if results["inline"]["score"] != results["offloaded"]["score"]:
+        print("The plugin collects differently when offloaded!",
+              file=sys.stderr)
+        sys.exit(1)
+    results["cpus"] = os.cpu_count()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name in ("inline", "offloaded"):
+            print("{:10} output {:8.3f}s  plugin done {:8.3f}s".format(
+                name, results[name]["output"], results[name]["plugin_done"]
+            ))
+
+
+if __name__ == "__main__":
+    main()
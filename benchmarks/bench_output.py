@@ -0,0 +1,92 @@
+"""
+Output throughput benchmark: writing the processed document one
+print() per line, with the chunked writes of PrintScanner, and with
+the memory-mapped scanning of flatten_chunks.
+
+    python benchmarks/bench_output.py [--files N] [--lines N] ...
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+
+import synthetic
+
+from premd import flatten
+from premd.__main__ import PrintScanner, scan
+
+
+def per_line_output(infile, outfile):
+    for line in flatten.flatten(infile, run_plugins=False):
+        print(line, file=outfile)
+
+
+def chunked_output(infile, outfile):
+    scan(PrintScanner(outfile, flatten.flatten(infile, run_plugins=False)))
+
+
+def mmap_output(infile, outfile):
+    outfile.writelines(flatten.flatten_chunks(infile, run_plugins=False))
+
+
+PATHS = {
+    "print": per_line_output,
+    "chunked": chunked_output,
+    "mmap": mmap_output,
+}
+
+
+def best_time(path, infile, outname, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        with open(outname, "w") as outfile:
+            start = time.perf_counter()
+            path(infile, outfile)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    synthetic.add_arguments(parser)
+    parser.set_defaults(files=200, lines=1000, depth=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        infile = synthetic.generate_book(
+            os.path.join(directory, "book"), **synthetic.book_options(args)
+        )
+        outputs = {}
+        results = {}
+        for name, path in PATHS.items():
+            outname = os.path.join(directory, name + ".md")
+            results[name] = best_time(path, infile, outname, args.repeat)
+            with open(outname) as stream:
+                outputs[name] = stream.read()
+
+    if len(set(outputs.values())) != 1:
+        print("The output paths produce different output!", file=sys.stderr)
+        sys.exit(1)
+
+    total_lines = outputs["print"].count("\n")
+    report = {
+        name: {"seconds": seconds, "lines_per_second": total_lines / seconds}
+        for name, seconds in results.items()
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name, result in report.items():
+            print("{:10} {:8.3f}s {:12.0f} lines/s".format(
+                name, result["seconds"], result["lines_per_second"]
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Parallel parsing benchmark: flattening a synthetic 1,000-file book
+serially and with the include graph parsed in process pools of
+different sizes. Checks that every variant produces the same output.
+
+    python benchmarks/bench_parse.py [--jobs 1 2 4 8] [--files N] ...
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+
+import synthetic
+
+from premd import flatten
+
+
+def best_time(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function()
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    synthetic.add_arguments(parser)
+    parser.set_defaults(files=1000, lines=200, depth=4)
+    parser.add_argument("--jobs", type=int, nargs="*", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        infile = synthetic.generate_book(
+            os.path.join(directory, "book"), **synthetic.book_options(args)
+        )
+        variants = {"serial": lambda: list(flatten.flatten(infile))}
+        for jobs in args.jobs:
+            variants["parallel-{}".format(jobs)] = \
+                lambda jobs=jobs: list(flatten.flatten_parallel(infile, jobs))
+
+        results = {}
+        outputs = set()
+        for name, function in variants.items():
+            seconds, output = best_time(function, args.repeat)
+            results[name] = seconds
+            outputs.add("\n".join(output))
+
+    if len(outputs) != 1:
+        print("The variants produce different output!", file=sys.stderr)
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, seconds in results.items():
+            print("{:12} {:8.3f}s".format(name, seconds))
+
+
+if __name__ == "__main__":
+    main()
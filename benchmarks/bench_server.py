@@ -0,0 +1,95 @@
+"""
+Converter server benchmark: building many small documents by starting
+a command per target, and by posting them to a converter server, with
+stubs standing in for pandoc and pandoc-server. Checks that both
+produce the same output.
+
+    python benchmarks/bench_server.py [--documents N] [--jobs N]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import argparse
+
+from premd import command
+from premd import configuration
+from premd import server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STUB = os.path.join(HERE, "stub_pandoc.py")
+STUB_SERVER = os.path.join(HERE, "stub_pandoc_server.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_all(config, directory, documents, jobs):
+    targets = [
+        os.path.join(directory, "doc{:04}.html".format(index))
+        for index in range(documents)
+    ]
+    text = "# A small document\n\nWith a line of text.\n"
+    start = time.perf_counter()
+    results = command.run_targets(config, targets, [text], jobs)
+    seconds = time.perf_counter() - start
+    if any(result.returncode != 0 for result in results):
+        print("Some builds failed!", file=sys.stderr)
+        sys.exit(1)
+    outputs = set()
+    for target in targets:
+        with open(target, "rb") as stream:
+            outputs.add(stream.read())
+    return seconds, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+
+    port = free_port()
+    commands = configuration.Configurations()
+    commands.data.update({"command": STUB, "arguments": []})
+    servers = configuration.Configurations()
+    servers.data.update({"server": {
+        "url": "http://127.0.0.1:{}/".format(port),
+        "command": "{} {} --port {}".format(sys.executable, STUB_SERVER, port)
+    }})
+
+    results = {}
+    outputs = set()
+    with tempfile.TemporaryDirectory() as directory:
+        results["command"], output = build_all(
+            commands, directory, args.documents, args.jobs
+        )
+        outputs |= output
+        with server.ConverterServers() as converter_servers:
+            converter_servers.start(servers)
+            results["server"], output = build_all(
+                servers, directory, args.documents, args.jobs
+            )
+            outputs |= output
+
+    if len(outputs) != 1:
+        print("The variants produce different output!", file=sys.stderr)
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, seconds in results.items():
+            print("{:12} {:8.3f}s".format(name, seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Startup benchmark: how long does it take before premd can start
+working? Measures importing the command line module, running
+``premd --help`` and resolving a project's command lines with and
+without the compiled configuration cache in fresh interpreters,
+relative to the bare interpreter start, and fails if importing or
+``--help`` exceeds a budget.
+
+    python benchmarks/bench_startup.py [--budget SECONDS] [--repeat N]
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import time
+import argparse
+import statistics
+import subprocess
+
+CASES = {
+    "interpreter": [sys.executable, "-c", "pass"],
+    "import": [sys.executable, "-c", "import premd.__main__"],
+    "help": [sys.executable, "-m", "premd", "--help"],
+}
+
+CONFIG = """
+command: pandoc
+shared:
+  arguments: [--standalone, --toc -f markdown+smart]
+filetypes:
+  pdf: {arguments: [--template=x.tex]}
+  epub: {arguments: [--mathml -t epub3]}
+targets:
+  book.html: {arguments: [--self-contained]}
+"""
+RESOLVE = """
+from premd import configuration, command
+configs = configuration.Configurations()
+configs.push_config(".")
+for target in ["book.pdf", "book.html", "book.epub", "book.docx"]:
+    command.command_line(configs, target)
+"""
+
+
+def time_config(repeat):
+    """Resolving command lines with and without the cached configuration."""
+    cmdline = [sys.executable, "-c", RESOLVE]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "premd.yml"), "w") as stream:
+            stream.write(CONFIG)
+        os.chdir(directory)
+        try:
+            cached = time_command(cmdline, repeat)
+            uncached = time_command(
+                cmdline, repeat,
+                lambda: shutil.rmtree(".premd-cache", ignore_errors=True)
+            )
+        finally:
+            os.chdir(cwd)
+    return {"config": cached, "config-uncached": uncached}
+
+
+def time_command(cmdline, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        subprocess.run(cmdline, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--budget", type=float, default=0.25,
+        help="allowed seconds on top of the bare interpreter start"
+    )
+    parser.add_argument("--repeat", type=int, default=11)
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {
+        name: time_command(cmdline, args.repeat)
+        for name, cmdline in CASES.items()
+    }
+    results.update(time_config(args.repeat))
+    overhead = max(results["import"], results["help"]) - results["interpreter"]
+    results["overhead"] = overhead
+    results["budget"] = args.budget
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, seconds in results.items():
+            print("{:16} {:8.3f}s".format(name, seconds))
+
+    if overhead > args.budget:
+        print("Startup overhead exceeds the budget of {:.3f}s".format(
+            args.budget), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
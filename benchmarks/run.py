@@ -0,0 +1,257 @@
+"""
+The premd benchmark suite. Generates a synthetic book and times the
+hot paths: flattening, as text and as bytes for commands, with and
+without a source map, looking up output lines in it, indexing,
+outputting and analysing the document, saving it as an artifact and
+analysing that, dispatching tags, each built-in plugin, and resolving
+and running target commands (with a stub standing in for pandoc).
+Results are written as JSON, and can be compared against an earlier
+run to catch regressions.
+
+    python benchmarks/run.py [--output results.json]
+                             [--baseline old.json [--tolerance 0.2]]
+                             [book shape options]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+
+import synthetic
+
+from premd import flatten
+from premd import artifact
+from premd import sourcemap
+from premd import graph
+from premd import command
+from premd import configuration
+from premd.plugin import plugins
+from premd.plugins.wc import WC
+from premd.plugins.fixme import FIXME
+from premd.__main__ import output_processed, analyse_processed
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    "stub_pandoc.py")
+TARGETS = ["book.pdf", "book.html", "book.epub", "book.docx"]
+
+
+def best_time(function, repeat, setup=None):
+    best = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def plugin_events(infile):
+    """The blocks of lines and the tag events of the book, as the
+    plugins see them."""
+    parsed = {}
+    todo = [infile]
+    while todo:
+        filename = todo.pop()
+        if filename not in parsed:
+            parsed[filename] = flatten.parse_file(filename)
+            todo.extend(
+                token[2] for token in parsed[filename].tokens
+                if token[0] == flatten._INCLUDE
+            )
+    blocks = []
+    tags = []
+    for filename, parsed_file in parsed.items():
+        for token in parsed_file.tokens:
+            if token[0] == flatten._LINE:
+                blocks.append((filename, token[1], token[2]))
+            elif token[0] == flatten._TAG:
+                tags.append((filename,) + token[1:])
+    return blocks, tags
+
+
+def bench_wc(blocks):
+    plugin = WC()
+    for event in blocks:
+        plugin.observe_lines(*event)
+    plugin.summarize(io.StringIO())
+
+
+def bench_fixme(tags):
+    plugin = FIXME()
+    for event in tags:
+        plugin.handle_tag(*event)
+    plugin.summarize(io.StringIO())
+
+
+def bench_tag_dispatch(tags):
+    # every tag line of the book, and as many comments with a tag no
+    # plugin handles, as flatten sends them to the plugins
+    observers = flatten._Observers(offloading=False)
+    for filename, lineno, tag, rest in tags:
+        observers.comment(filename, lineno, "%% {}: {}".format(tag, rest))
+        observers.comment(filename, lineno, "%% note: {}".format(rest))
+
+
+def save_artifact(infile, filename):
+    recorder = artifact.Recorder(flatten._Observers())
+    analyse_processed(infile, fast=True, observers=recorder)
+    recorder.finish()
+    recorder.save(filename, infile)
+
+
+def bench_locate(source_map, lookups=10000):
+    step = max(1, len(source_map) // lookups)
+    for line in range(0, len(source_map), step):
+        source_map.locate(line)
+
+
+def bench_config():
+    config = configuration.Configurations()
+    config.data.update({
+        "command": STUB,
+        "arguments": [],
+        "shared": {"arguments": ["--standalone", "--toc -f markdown+smart"]},
+        "filetypes": {
+            "pdf": {"arguments": ["--template=x.tex"]},
+            "epub": {"arguments": ["--mathml -t epub3"]},
+        },
+        "targets": {"book.html": {"arguments": ["--self-contained"]}},
+    })
+    return config
+
+
+def bench_config_resolution(targets):
+    """Resolve the command lines of :targets with a configuration that
+    has nothing read or compiled yet, as a new premd process would."""
+    config = bench_config()
+    for target in targets:
+        command.RunCommand(config, target)
+
+
+def bench_run_commands(config, targets, text):
+    for target in targets:
+        with command.RunCommand(config, target) as cmd:
+            cmd.stdin.write(text)
+
+
+def run_suite(infile, outdir, repeat):
+    results = {}
+    blocks, tags = plugin_events(infile)
+    config = bench_config()
+    targets = [os.path.join(outdir, target) for target in TARGETS]
+    text = "".join(line + "\n" for line in flatten.flatten(infile, False))
+
+    results["flatten"] = best_time(
+        lambda: list(flatten.flatten(infile, False)), repeat
+    )
+    results["flatten_bytes"] = best_time(
+        lambda: list(flatten.flatten_bytes(infile, False)), repeat
+    )
+    results["flatten_source_map"] = best_time(
+        lambda: list(flatten.flatten(
+            infile, False, source_map=sourcemap.SourceMap()
+        )), repeat
+    )
+    source_map = sourcemap.SourceMap()
+    list(flatten.flatten(infile, False, source_map=source_map))
+    results["locate"] = best_time(lambda: bench_locate(source_map), repeat)
+    results["include_graph"] = best_time(
+        lambda: graph.build_graph(infile).dependencies(), repeat
+    )
+    results["flatten_plugins"] = best_time(
+        lambda: list(flatten.flatten(infile)), repeat, plugins.reset
+    )
+    results["output_processed"] = best_time(
+        lambda: output_processed(infile, io.StringIO()), repeat,
+        plugins.reset
+    )
+    results["analyse_processed"] = best_time(
+        lambda: analyse_processed(infile), repeat, plugins.reset
+    )
+    artifact_file = os.path.join(outdir, "book.flat.gz")
+    results["save_artifact"] = best_time(
+        lambda: save_artifact(infile, artifact_file), repeat, plugins.reset
+    )
+    results["analyse_artifact"] = best_time(
+        lambda: analyse_processed(artifact_file), repeat, plugins.reset
+    )
+    plugins.reset()
+    results["plugin_wc"] = best_time(lambda: bench_wc(blocks), repeat)
+    results["plugin_fixme"] = best_time(lambda: bench_fixme(tags), repeat)
+    results["tag_dispatch"] = best_time(
+        lambda: bench_tag_dispatch(tags), repeat, plugins.reset
+    )
+    results["config_resolution"] = best_time(
+        lambda: bench_config_resolution(targets), repeat,
+        configuration._config_files.clear
+    )
+    results["run_commands"] = best_time(
+        lambda: bench_run_commands(config, targets, text), repeat
+    )
+    results["run_commands_async"] = best_time(
+        lambda: command.run_targets(config, targets, [text]), repeat
+    )
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    return {
+        name: (baseline[name], seconds)
+        for name, seconds in results.items()
+        if name in baseline and seconds > baseline[name] * (1 + tolerance)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    synthetic.add_arguments(parser)
+    parser.set_defaults(files=100, lines=500, depth=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--baseline",
+                        help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown relative to the baseline")
+    args = parser.parse_args()
+
+    book = synthetic.book_options(args)
+    with tempfile.TemporaryDirectory() as directory:
+        infile = synthetic.generate_book(
+            os.path.join(directory, "book"), **book
+        )
+        outdir = os.path.join(directory, "out")
+        os.makedirs(outdir)
+        results = run_suite(infile, outdir, args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "book": book,
+        "results": results,
+    }
+    dump = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as stream:
+            print(dump, file=stream)
+    else:
+        print(dump)
+
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)["results"]
+        slower = regressions(results, baseline, args.tolerance)
+        for name, (before, after) in slower.items():
+            print("Regression in {}: {:.4f}s -> {:.4f}s".format(
+                name, before, after), file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
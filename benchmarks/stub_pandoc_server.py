@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+A stand-in for pandoc-server: answers every POST with the "text" it
+was sent, in the JSON form pandoc-server uses when asked for JSON.
+Lets benchmarks and tests use premd's converter server support
+without pandoc.
+
+    python benchmarks/stub_pandoc_server.py [--port 3030]
+"""
+
+import json
+import argparse
+import http.server
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length))
+            text = request["text"]
+        except (ValueError, KeyError, TypeError):
+            self.send_error(400, "expected a JSON object with a text")
+            return
+        reply = json.dumps({
+            "output": text, "base64": False, "messages": []
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass # quiet, like pandoc-server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=3030)
+    args = parser.parse_args()
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", args.port),
+                                             StubHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Generating synthetic books for benchmarking.
+
+The book has a root file, ``book.txt``, and ``files`` chapter files
+included through relative ``/`` include lines. Chapters are nested
+``depth`` levels deep, each level in a sub-directory of the one above,
+so include and figure paths get rewritten the way they would in a
+real project.
+"""
+
+import os
+import random
+import argparse
+
+WORDS = (
+    "the of and to in is that for it as was with be by on not he this "
+    "are or his from at which but have an they you were her she there "
+    "markdown chapter section figure table pandoc include document text "
+    "preprocessor output summary word count comment review draft"
+).split()
+
+
+def _line(rng, words_per_line):
+    words = rng.choices(WORDS, k=rng.randint(1, 2 * words_per_line))
+    line = " ".join(words).capitalize() + "."
+    if rng.random() < 0.05:
+        line += "  " # trailing white space that premd strips
+    return line
+
+
+def _content(rng, lines, header_density, todo_density, figure_density,
+             words_per_line):
+    content = []
+    for _ in range(lines):
+        roll = rng.random()
+        if roll < header_density:
+            level = rng.randint(1, 3)
+            content.append("#" * level + " " + _line(rng, 3).rstrip(" ."))
+        elif roll < header_density + todo_density:
+            tag = rng.choice(["TODO", "FIXME", "todo", "Fixme"])
+            content.append("%% {}: {}".format(tag, _line(rng, 4)))
+        elif roll < header_density + todo_density + figure_density:
+            content.append("![{}](figures/fig{}.png){{#fig:{}}}".format(
+                _line(rng, 3), rng.randint(0, 9), rng.randint(0, 10**6)
+            ))
+        elif rng.random() < 0.1:
+            content.append("")
+        else:
+            content.append(_line(rng, words_per_line))
+    return content
+
+
+def generate_book(directory, files=10, lines=100, depth=1,
+                  header_density=0.02, todo_density=0.01,
+                  figure_density=0.005, words_per_line=8, seed=0):
+    """Write a synthetic book to :directory and return the path
+    of its root file."""
+    rng = random.Random(seed)
+    depth = max(1, depth)
+
+    def file_dir(level):
+        return os.path.join(directory, "chapters", *["sub"] * (level - 1))
+
+    def file_name(i):
+        return "file{:05}.txt".format(i)
+
+    # File i lives at level 1 + i % depth and is included by file i - 1
+    # if that is on the level above, otherwise by the root file.
+    contents = {}
+    includes = {None: []}
+    for i in range(files):
+        level = 1 + i % depth
+        parent = i - 1 if level > 1 else None
+        includes.setdefault(parent, []).append(
+            "/" + ("sub/" if level > 1 else "chapters/") + file_name(i)
+        )
+        includes.setdefault(i, [])
+        contents[i] = (level, _content(
+            rng, lines, header_density, todo_density,
+            figure_density, words_per_line
+        ))
+
+    def with_includes(content, include_lines):
+        content = list(content)
+        for include in include_lines:
+            content.insert(rng.randint(0, len(content)), include)
+        return content
+
+    os.makedirs(directory, exist_ok=True)
+    root = os.path.join(directory, "book.txt")
+    with open(root, "w") as stream:
+        header = ["---", 'title: "Synthetic book"', "---", ""]
+        for line in header + includes[None]:
+            print(line, file=stream)
+
+    for i, (level, content) in contents.items():
+        os.makedirs(file_dir(level), exist_ok=True)
+        with open(os.path.join(file_dir(level), file_name(i)), "w") as stream:
+            for line in with_includes(content, includes[i]):
+                print(line, file=stream)
+
+    return root
+
+
+def add_arguments(parser):
+    """Add the book shape options to an argument :parser."""
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--lines", type=int, default=100,
+                        help="lines per file")
+    parser.add_argument("--depth", type=int, default=1,
+                        help="nesting depth of includes")
+    parser.add_argument("--header-density", type=float, default=0.02)
+    parser.add_argument("--todo-density", type=float, default=0.01)
+    parser.add_argument("--figure-density", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def book_options(args):
+    """The generate_book keyword arguments from parsed :args."""
+    return dict(
+        files=args.files, lines=args.lines, depth=args.depth,
+        header_density=args.header_density,
+        todo_density=args.todo_density,
+        figure_density=args.figure_density,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic book.")
+    parser.add_argument("directory")
+    add_arguments(parser)
+    args = parser.parse_args()
+    print(generate_book(args.directory, **book_options(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,30 @@
 """running the premd script..."""
 
 import sys
+import io
+import time
+import glob
 import os.path
 import argparse
+import contextlib
 
 import colorama
 from termcolor import colored
 
 from . import configuration
+from . import artifact
+from . import offload
 from . import command
 from . import flatten
+from . import graph
+from . import figures
+from . import summary
+from . import sourcemap
+from . import manifest
+from . import cache
+from . import timing
+from . import records
+from . import watch
 from .plugin import plugins
 
 
@@ -26,6 +41,11 @@ def _report_error(msg):
     print(output_msg, file=sys.stderr)
 
 
+def _report_warning(msg):
+    output_msg = colored("Warning", "yellow", attrs=["bold"]) + ": " + msg
+    print(output_msg, file=sys.stderr)
+
+
 def _error(msg):
     _report_error(msg)
     sys.exit(1)
@@ -40,17 +60,17 @@ def _collect_commands():
     return commands
 
 
-def _get_input_file(args):
+def _get_input_file(args, configs):
     if args.infile:
         root_dir = os.path.dirname(args.infile)
-        CONFIGS.push_config(root_dir)
+        configs.push_config(root_dir)
         infile = args.infile
     else:
         # if we do not have an infile then get it from configuration file
         root_dir = os.getcwd()
-        CONFIGS.push_config(root_dir)
+        configs.push_config(root_dir)
         try:
-            infile = CONFIGS["root"]
+            infile = configs["root"]
         except KeyError:
             _error("""An input file should either be specified in the
 configuration file or be provided on the commandline.""")
@@ -61,6 +81,36 @@ configuration file or be provided on the commandline.""")
     return infile
 
 
+def _check_target(target):
+    try:
+        open(target, "w")
+    except IOError as ex:
+        strerror = ex.args[1]
+        _error("Couldn't open file {outfile}\n{ex}".format(
+            outfile=target, ex=strerror
+        ))
+
+
+def _report_results(results):
+    for result in results:
+        if result.returncode == 0:
+            status = colored("ok", "green")
+        elif result.returncode is None:
+            status = colored("timed out", "red")
+        else:
+            status = colored(
+                "failed (exit status {})".format(result.returncode), "red"
+            )
+        print("{target}: {status} [{elapsed:.2f}s]".format(
+            target=result.target, status=status, elapsed=result.elapsed
+        ), file=sys.stderr)
+        # output captured from the command, if any
+        if result.stdout:
+            sys.stdout.write(result.stdout.decode(errors="replace"))
+        if result.stderr:
+            sys.stderr.write(result.stderr.decode(errors="replace"))
+
+
 # FIXME make this something you can plug in id:1
 #
 # ----
@@ -81,17 +131,32 @@ class Scanner:
 
 class PrintScanner(Scanner):
     """Class for scanning through a file while printing 
-to an output file
+to an output file. Lines are collected and written in chunks
+of :chunk_size lines rather than one at a time.
     """
 
-    def __init__(self, outfile, lines):
+    def __init__(self, outfile, lines, chunk_size = 4096):
         super().__init__(lines)
         self.outfile = outfile
+        self.chunk_size = chunk_size
+
+    def _write(self, chunk):
+        if chunk:
+            chunk.append("") # for the final newline
+            self.outfile.write("\n".join(chunk))
+            chunk.clear()
 
     def __iter__(self):
-        for line in self.lines:
-            print(line, file=self.outfile)
-            yield line
+        chunk = []
+        try:
+            for line in self.lines:
+                chunk.append(line)
+                if len(chunk) >= self.chunk_size:
+                    self._write(chunk)
+                yield line
+        finally:
+            # also write what we have if the scan stops with an error
+            self._write(chunk)
 
 
 def scan(scanner):
@@ -99,16 +164,123 @@ def scan(scanner):
         pass
 
 
-def output_processed(infilename, outfile, run_plugins = True):
+def _artifact_lines(infilename, run_plugins, dependencies, observers,
+                    source_map):
+    for block in artifact.flatten_artifact(
+            infilename, run_plugins, dependencies, observers, source_map,
+            warn=_report_warning):
+        yield from block
+
+
+def _flattened(infilename, run_plugins, dependencies,
+               parse_jobs = None, use_cache = False, observers = None,
+               source_map = None):
+    if artifact.is_artifact(infilename):
+        return _artifact_lines(
+            infilename, run_plugins, dependencies, observers, source_map
+        )
+    parse_cache = None
+    if use_cache:
+        parse_cache = cache.ParseCache()
+    if parse_jobs is not None:
+        return flatten.flatten_parallel(
+            infilename, parse_jobs, run_plugins, dependencies, parse_cache,
+            observers, source_map
+        )
+    if parse_cache is not None:
+        return flatten.flatten_parsed(
+            infilename, parse_cache, run_plugins, dependencies=dependencies,
+            observers=observers, source_map=source_map
+        )
+    return flatten.flatten(
+        infilename, run_plugins, dependencies=dependencies,
+        observers=observers, source_map=source_map
+    )
+
+
+def _fast(infilename, fast):
+    # an artifact is read in one go, whichever way we asked for
+    return fast and not artifact.is_artifact(infilename)
+
+
+def output_processed(infilename, outfile, run_plugins = True,
+                     dependencies = None, fast = False, observers = None,
+                     **options):
+    if _fast(infilename, fast):
+        outfile.writelines(flatten.flatten_chunks(
+            infilename, run_plugins, dependencies=dependencies,
+            observers=observers
+        ))
+        return
     scanner = PrintScanner(
         outfile,
-        flatten.flatten(infilename, run_plugins)
+        _flattened(
+            infilename, run_plugins, dependencies, observers=observers,
+            **options
+        )
     )
     scan(scanner)
 
 
-def analyse_processed(infilename):
-    scanner = Scanner(flatten.flatten(infilename))
+def command_processed(infilename, cmd, run_plugins = True,
+                      dependencies = None, fast = False, observers = None,
+                      **options):
+    """Write the processed input to the RunCommand :cmd. With :fast,
+    as bytes straight from the mapped input files."""
+    if _fast(infilename, fast):
+        cmd.write_chunks(flatten.flatten_bytes(
+            infilename, run_plugins, dependencies=dependencies,
+            observers=observers
+        ))
+        return
+    output_processed(
+        infilename, cmd.stdin, run_plugins, dependencies, fast, observers,
+        **options
+    )
+
+
+def buffer_processed(infilename, run_plugins = True, dependencies = None,
+                     **options):
+    buffer = io.StringIO()
+    output_processed(infilename, buffer, run_plugins, dependencies, **options)
+    return buffer.getvalue()
+
+
+def chunks_processed(infilename, run_plugins = True, dependencies = None,
+                     fast = False, chunk_size = 4096, **options):
+    """The processed input as text chunks of :chunk_size lines."""
+    if _fast(infilename, fast):
+        yield from flatten.flatten_chunks(
+            infilename, run_plugins, dependencies=dependencies
+        )
+        return
+    chunk = []
+    for line in _flattened(infilename, run_plugins, dependencies, **options):
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            chunk.append("") # for the final newline
+            yield "\n".join(chunk)
+            chunk = []
+    if chunk:
+        chunk.append("")
+        yield "\n".join(chunk)
+
+
+def analyse_processed(infilename, run_plugins = True, dependencies = None,
+                      fast = False, observers = None, source_map = None,
+                      **options):
+    if _fast(infilename, fast):
+        scan(flatten.flatten_chunks(
+            infilename, run_plugins, dependencies=dependencies,
+            observers=observers, source_map=source_map
+        ))
+        return
+    scanner = Scanner(
+        _flattened(
+            infilename, run_plugins, dependencies, observers=observers,
+            source_map=source_map, **options
+        )
+    )
     scan(scanner)
 
 
@@ -149,20 +321,153 @@ def summarize_command(args):
         metavar='summarizer',
         choices=plugins.summary_plugins
     )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, metavar="N",
+        help="""analyse the files the input file includes in N
+parallel processes"""
+    )
+
+    parser.add_argument(
+        "--low-memory", action="store_true",
+        help="""keep what the summarizers collect in a temporary
+database instead of in memory, for very large documents; parsed files
+are not cached"""
+    )
+
+    _add_input_arguments(parser)
+    _add_profile_argument(parser)
 
     args = parser.parse_args(args)
-    infile = _get_input_file(args)
-    
-    analyse_processed(infile)
+    _check_input_arguments(args)
+    infile = _get_input_file(args, CONFIGS)
+    if args.jobs is not None and args.jobs < 1:
+        _error("The number of jobs must be positive.")
+    if args.low_memory:
+        if args.parse_jobs is not None:
+            _error("--parse-jobs keeps all parsed files in memory; "
+                   "it cannot be used with --low-memory.")
+        args.cache = False # the cache keeps what it reads in memory
+        records.enable()
+        plugins.reset()
+
+    with _profiled(args):
+        # an artifact is a single file, with nothing to shard
+        parallel = args.jobs is not None and not artifact.is_artifact(infile)
+        if parallel and summary.shardable():
+            summary.analyse_sharded(
+                infile, args.jobs, fast=args.fast, use_cache=args.cache
+            )
+        else:
+            if parallel:
+                _report_warning("""Some plugins cannot summarize in parallel;
+analysing the document in one process.""")
+            analyse_processed(infile, **_input_options(args))
+        offload.collect()
+
+        for name in args.include:
+            plugin = plugins.summary_plugins[name]
+            header = plugin.__class__.__doc__
+            print(colored(header, attrs=["bold"]), file=args.outfile)
+            print(colored('=' * len(header), attrs=["bold"]),
+                  file=args.outfile)
+
+            plugin.summarize(args.outfile)
+            print(file=args.outfile)
+
+
+def deps_command(args):
+    """List the files targets depend on"""
 
-    for name in args.include:
-        plugin = plugins.summary_plugins[name]
-        header = plugin.__class__.__doc__
-        print(colored(header, attrs=["bold"]), file=args.outfile)
-        print(colored('=' * len(header), attrs=["bold"]), file=args.outfile)
+    parser = argparse.ArgumentParser(
+        formatter_class=MixedFormatter,
+        usage="%(prog)s deps [-h] [infile] [-o targets] [--format FORMAT]",
+        description=deps_command.__doc__
+    )
+    parser.add_argument(
+        'infile', type=str, nargs='?'
+    )
+    parser.add_argument(
+        "-o", "--targets",
+        metavar="target",
+        type=str, nargs="*"
+    )
+    parser.add_argument(
+        "--format", choices=["make", "json"], default="make",
+        help="a Makefile rule, which ninja also reads, or JSON"
+    )
+    parser.add_argument(
+        "--phony", action="store_true",
+        help="add an empty make rule for each dependency"
+    )
+    parser.add_argument(
+        "--output", type=argparse.FileType('w'), default=sys.stdout,
+        metavar="FILE",
+        help="write the dependencies to FILE"
+    )
+    args = parser.parse_args(args)
+    infile = _get_input_file(args, CONFIGS)
+
+    if args.targets is None:
+        try:
+            targets = list(CONFIGS["targets"])
+        except KeyError:
+            targets = []
+    else:
+        targets = args.targets
+    if not targets and args.format == "make":
+        _error("""Targets must be specified either in the configuration
+file or on the commandline.""")
+
+    try:
+        include_graph = graph.build_graph(infile)
+    except flatten.CircularInclusionError as ex:
+        _error(str(ex))
+
+    if args.format == "make":
+        graph.write_make(include_graph, targets, args.output, args.phony)
+    else:
+        graph.write_json(include_graph, targets, args.output)
+
+
+def locate_command(args):
+    """Find where lines of the output came from"""
+
+    parser = argparse.ArgumentParser(
+        formatter_class=MixedFormatter,
+        usage="%(prog)s locate [-h] [--infile INFILE] outline [outline ...]",
+        description=locate_command.__doc__
+    )
+    parser.add_argument(
+        "outlines", nargs="+", type=int, metavar="outline",
+        help="a line number in the output, counting from 1"
+    )
+    parser.add_argument(
+        "--infile", default=None,
+        help="the input file or artifact; the configured root if not given"
+    )
+    _add_input_arguments(parser)
+
+    args = parser.parse_args(args)
+    _check_input_arguments(args)
+    infile = _get_input_file(args, CONFIGS)
+    source_map = sourcemap.SourceMap()
+    analyse_processed(
+        infile, False, source_map=source_map, **_input_options(args)
+    )
 
-        plugin.summarize(args.outfile)
-        print(file=args.outfile)
+    missing = False
+    for outline in args.outlines:
+        try:
+            filename, lineno = source_map.locate(outline - 1)
+        except IndexError:
+            _report_error("The output has no line {} (it has {}).".format(
+                outline, len(source_map)
+            ))
+            missing = True
+            continue
+        print("{}: {}:{}".format(outline, filename, lineno + 1))
+    if missing:
+        sys.exit(1)
 
 
 def transform_command(args):
@@ -186,7 +491,8 @@ def transform_command(args):
     )
     parser.add_argument(
         'outfile', nargs='?', type=argparse.FileType('w'),
-        default=sys.stdout
+        default=None,
+        help="where the output goes; stdout unless we write an artifact"
     )
     parser.add_argument(
         '--info', nargs='*', default=[],
@@ -194,24 +500,110 @@ def transform_command(args):
         metavar='summarizer',
         choices=plugins.summary_plugins
     )
+    parser.add_argument(
+        "--artifact", default=None, metavar="FILE",
+        help="""save the processed document, where its lines came from
+and its tags to FILE, for the other commands to use as their input"""
+    )
+    _add_input_arguments(parser)
+    _add_profile_argument(parser)
 
     args = parser.parse_args(args)
-    infile = _get_input_file(args)
-    output_processed(infile, args.outfile)
+    _check_input_arguments(args)
+    infile = _get_input_file(args, CONFIGS)
+    outfile = args.outfile
+    if outfile is None and args.artifact is None:
+        outfile = sys.stdout
+    with _profiled(args):
+        if args.artifact is None:
+            output_processed(infile, outfile, **_input_options(args))
+        else:
+            recorder = artifact.Recorder(flatten._Observers())
+            try:
+                if outfile is None:
+                    analyse_processed(
+                        infile, observers=recorder, **_input_options(args)
+                    )
+                else:
+                    output_processed(
+                        infile, outfile, observers=recorder,
+                        **_input_options(args)
+                    )
+            except BaseException:
+                # the scan did not finish, so nothing is summarized
+                recorder.close()
+                raise
+            recorder.finish()
+            recorder.save(args.artifact, infile)
+        if outfile is not None and outfile is not sys.stdout:
+            outfile.close() # so a reader does not wait for the plugins
+        offload.collect()
+
+        for name in args.info:
+            plugin = plugins.summary_plugins[name]
+            header = plugin.__class__.__doc__
+            print(colored(header, attrs=["bold"]), file=sys.stderr)
+            print(colored('=' * len(header), attrs=["bold"]),
+                  file=sys.stderr)
+
+            plugin.summarize(sys.stderr)
+            print(file=sys.stderr)
+
+
+def _add_input_arguments(parser):
+    parser.add_argument(
+        "--fast", action="store_true",
+        help="""scan input files as memory-mapped bytes and pass
+prose through in bulk"""
+    )
+    parser.add_argument(
+        "--parse-jobs", type=int, default=None, metavar="N",
+        help="read and tokenize the input files in N parallel processes"
+    )
+    parser.add_argument(
+        "--no-cache", dest="cache", action="store_false",
+        help="do not reuse or save parsed input files"
+    )
 
-    for name in args.info:
-        plugin = plugins.summary_plugins[name]
-        header = plugin.__class__.__doc__
-        print(colored(header, attrs=["bold"]), file=sys.stderr)
-        print(colored('=' * len(header), attrs=["bold"]), file=sys.stderr)
 
-        plugin.summarize(sys.stderr)
-        print(file=sys.stderr)
+def _add_profile_argument(parser):
+    parser.add_argument(
+        "--profile", nargs="?", const="-", default=None, metavar="FILE",
+        help="""report time spent reading files, in plugins and in
+commands; as a table on stderr, or as JSON to FILE if given"""
+    )
 
 
-def build_command(args):
-    """Build an output file"""
+@contextlib.contextmanager
+def _profiled(args):
+    """Profile the block if the command line asks for it."""
+    if args.profile is None:
+        yield
+        return
+    try:
+        with timing.profiling() as profile:
+            yield
+    finally:
+        if args.profile == "-":
+            profile.report(sys.stderr)
+        else:
+            with open(args.profile, "w") as outfile:
+                profile.dump(outfile)
+
+
+def _check_input_arguments(args):
+    if args.fast and args.parse_jobs is not None:
+        _error("--fast scans the input files in this process; "
+               "it cannot be used with --parse-jobs.")
+
+
+def _input_options(args):
+    return dict(
+        fast=args.fast, parse_jobs=args.parse_jobs, use_cache=args.cache
+    )
 
+
+def _build_parser(usage, description):
     summarizer_doc = "summarizers:\n{commands}".format(
         commands="\n".join(
             "  {name:10}:\t{doc}".format(name=name, doc=command.__doc__)
@@ -221,8 +613,8 @@ def build_command(args):
 
     parser = argparse.ArgumentParser(
         formatter_class=MixedFormatter,
-        usage="%(prog)s build [-h] [infile] [-o outfiles]",
-        description=transform_command.__doc__,
+        usage=usage,
+        description=description,
         epilog=summarizer_doc
     )
     parser.add_argument(
@@ -239,15 +631,38 @@ def build_command(args):
         metavar='summarizer',
         choices=plugins.summary_plugins
     )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="""process the input once and build up to this many
+targets concurrently"""
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None, metavar="SECONDS",
+        help="stop building a target after this many seconds"
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true",
+        help="rebuild targets even if they are up to date"
+    )
+    parser.add_argument(
+        "--figures", action="store_true",
+        help="""give each target figures prepared for it, such as
+downscaled copies for HTML and EPUB (needs Pillow)"""
+    )
+    _add_input_arguments(parser)
+    _add_profile_argument(parser)
+    return parser
 
-    args = parser.parse_args(args)
-    infile = _get_input_file(args)
+
+def _build_setup(args, configs):
+    _check_input_arguments(args)
+    infile = _get_input_file(args, configs)
     if args.info:
         info = args.info
     else:
         # if there are no info specified we get them from the configuration file
         try:
-            info = CONFIGS["info"]
+            info = configs["info"]
         except KeyError:
             info = []
 
@@ -255,7 +670,7 @@ def build_command(args):
     if args.targets is None:
         # Get targets from configurations
         try:
-            targets = CONFIGS["targets"]
+            targets = configs["targets"]
         except KeyError:
             _error("""Targets must be specified either in the configuration
 file or on the commandline.""")
@@ -265,29 +680,537 @@ file or on the commandline.""")
     if not targets:
         _error("No targets specified.")
 
-    run_plugins = True # used for only running plugins on first target
-    for target in targets:
-        try:
-            open(target, "w")
-        except IOError as ex:
-            strerror = ex.args[1]
-            _error("Couldn't open file {outfile}\n{ex}".format(
-                outfile=target, ex=strerror
-            ))
+    if args.jobs is not None and args.jobs < 1:
+        _error("The number of jobs must be positive.")
+    if args.timeout is not None and args.timeout <= 0:
+        _error("The timeout must be positive.")
+
+    return infile, targets, info
+
+
+def _figure_profiles(targets, args, configs):
+    """How figures are prepared for each of the :targets; None for
+    those that get them as they are."""
+    if not args.figures or not figures.available():
+        return dict.fromkeys(targets)
+    return {
+        target: figures.target_profile(configs, target) for target in targets
+    }
 
-        with command.RunCommand(CONFIGS, target) as cmd:
-            output_processed(infile, cmd.stdin, run_plugins)
 
-        run_plugins = False # don't run the plugins for remaining targets
+def _stale_targets(infile, targets, args, configs):
+    """The build manifest, the command line and figure profile for
+    each target, and the targets that need building, reporting those
+    that do not."""
 
+    # Skip the targets that were built from the current input
+    # with the current command line, configuration and figures.
+    build_manifest = manifest.BuildManifest(
+        os.path.dirname(os.path.abspath(infile))
+    )
+    cmdlines = {
+        target: command.RunCommand(configs, target).cmdline
+        for target in targets
+    }
+    configs.save() # the command lines, compiled once for next time
+    profiles = _figure_profiles(targets, args, configs)
+    stale = [
+        target for target in targets
+        if args.force or not build_manifest.is_current(
+            target, cmdlines[target], configs.data, profiles[target]
+        )
+    ]
+    for target in targets:
+        if target not in stale:
+            print("{target}: up to date".format(target=target),
+                  file=sys.stderr)
+    for target in stale:
+        _check_target(target)
+    return build_manifest, cmdlines, profiles, stale
+
+
+def _record_results(build_manifest, cmdlines, profiles, results,
+                    dependencies, configs):
+    for result in results:
+        if result.returncode == 0:
+            build_manifest.record(
+                result.target, cmdlines[result.target],
+                configs.data, dependencies, profiles[result.target]
+            )
+        else:
+            build_manifest.forget(result.target)
+    build_manifest.save()
+
+
+def _print_summaries(info, outfile = None):
+    if outfile is None:
+        outfile = sys.stderr
+    offload.collect()
     for name in info:
         plugin = plugins.summary_plugins[name]
         header = plugin.__class__.__doc__
-        print(colored(header, attrs=["bold"]), file=sys.stderr)
-        print(colored('=' * len(header), attrs=["bold"]), file=sys.stderr)
+        print(colored(header, attrs=["bold"]), file=outfile)
+        print(colored('=' * len(header), attrs=["bold"]), file=outfile)
+
+        plugin.summarize(outfile)
+        print(file=outfile)
+
+
+def _target_inputs(infile, targets, text, args, configs):
+    """The processed :text as input for each of the :targets, with
+    figures prepared for the target if :args asks for it."""
+    if not figures.available():
+        _report_warning("Pillow is not installed; figures are used as they are.")
+        texts = dict.fromkeys(targets, text)
+    else:
+        texts = figures.target_texts(
+            configs, targets, text,
+            os.path.dirname(os.path.abspath(infile)), args.jobs
+        )
+    return {target: [texts[target]] for target in targets}
+
+
+def _build(infile, targets, info, args, dependencies):
+    """Build the :targets that are not up to date, as the build
+    options in :args say, report on them and show the :info summaries.
+    The files the input depends on are added to :dependencies.
+    Returns the results of the targets built."""
+
+    build_manifest, cmdlines, profiles, stale = \
+        _stale_targets(infile, targets, args, CONFIGS)
+
+    if not stale:
+        results = []
+        analyse_processed(
+            infile, bool(info), dependencies, **_input_options(args)
+        )
+    elif args.figures:
+        text = buffer_processed(
+            infile, dependencies=dependencies, **_input_options(args)
+        )
+        inputs = _target_inputs(infile, stale, text, args, CONFIGS)
+        results = command.run_targets(
+            CONFIGS, stale, inputs, args.jobs, args.timeout
+        )
+    elif (args.jobs is not None or args.timeout is not None
+          or CONFIGS.get(("server", "url")) is not None):
+        # The input is processed as the commands read it, and the
+        # commands' output is collected while they run.
+        chunks = chunks_processed(
+            infile, dependencies=dependencies, **_input_options(args)
+        )
+        results = command.run_targets(
+            CONFIGS, stale, chunks, args.jobs, args.timeout
+        )
+    else:
+        run_plugins = True # used for only running plugins on first target
+        results = []
+        for target in stale:
+            start = time.perf_counter()
+            with command.RunCommand(CONFIGS, target) as cmd:
+                command_processed(
+                    infile, cmd, run_plugins, dependencies,
+                    **_input_options(args)
+                )
+            results.append(command.TargetResult(
+                target, cmd.returncode, time.perf_counter() - start
+            ))
+
+            run_plugins = False # don't run the plugins for remaining targets
+    _report_results(results)
+    _record_results(
+        build_manifest, cmdlines, profiles, results, dependencies, CONFIGS
+    )
+    _print_summaries(info)
+
+    return results
+
+
+def _add_server_argument(parser):
+    parser.add_argument(
+        "--server", nargs="?", const="", default=None, metavar="SOCKET",
+        help="let the premd serve process listening on SOCKET, or on its "
+             "default socket, do the build"
+    )
+
+
+def build_command(args):
+    """Build an output file"""
 
-        plugin.summarize(sys.stderr)
-        print(file=sys.stderr)
+    parser = _build_parser(
+        "%(prog)s build [-h] [infile] [-o outfiles]",
+        build_command.__doc__
+    )
+    _add_server_argument(parser)
+    build_args = args
+    args = parser.parse_args(args)
+
+    if args.server is not None:
+        from . import server # only needed here, and slow to import
+        socket_path = args.server or server.default_socket()
+        try:
+            reply = server.request(
+                socket_path, {"cwd": os.getcwd(), "args": build_args}
+            )
+        except (OSError, server.SocketOwnerError) as ex:
+            _error("Couldn't reach the server on {socket}\n{ex}".format(
+                socket=socket_path, ex=ex
+            ))
+        sys.stdout.write(reply["stdout"])
+        sys.stderr.write(reply["stderr"])
+        sys.exit(reply["status"])
+
+    infile, targets, info = _build_setup(args, CONFIGS)
+
+    with _profiled(args):
+        results = _build(infile, targets, info, args, set())
+    if any(result.returncode != 0 for result in results):
+        sys.exit(1)
+
+
+@contextlib.contextmanager
+def _captured(stdout, stderr):
+    with contextlib.redirect_stdout(stdout), \
+            contextlib.redirect_stderr(stderr):
+        yield
+
+
+@contextlib.contextmanager
+def _working_directory(directory):
+    """Run the block in :directory and go back where we were after."""
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+async def _serve_build(message, slots, input_slots):
+    """Handle a build request from premd build --server. Its commands
+    take turns in :slots, a semaphore shared by all builds, and the
+    build holds one of :input_slots, another, from before it processes
+    its input until its commands are done, so only that many processed
+    inputs are kept at a time. Returns the exit status, what the build
+    wrote to stdout and stderr, and how each target went."""
+    stdout, stderr = io.StringIO(), io.StringIO()
+    status = 0
+    results = []
+    cwd = message["cwd"]
+    configs = configuration.Configurations()
+
+    # Builds take turns processing their input: we do not give up
+    # the event loop until all of it is in the buffer, so nothing else
+    # uses the plugins or redirects output while we do. The paths in
+    # the input are relative to the client's directory, and so are
+    # those flatten writes, so we read it from there and go back
+    # before the commands run. Only the commands run concurrently,
+    # and then we must take our turn again to finish.
+    async with input_slots:
+        try:
+            with _captured(stdout, stderr), _working_directory(cwd):
+                plugins.reset()
+                parser = _build_parser("", "")
+                _add_server_argument(parser)
+                args = parser.parse_args(message["args"])
+                if args.jobs is not None or args.profile is not None:
+                    _error("""--jobs and --profile cannot be used with
+--server; the server shares its command slots between builds.""")
+                infile, targets, info = _build_setup(args, configs)
+                dependencies = set()
+
+                build_manifest, cmdlines, profiles, stale = \
+                    _stale_targets(infile, targets, args, configs)
+                if stale:
+                    text = buffer_processed(
+                        infile, dependencies=dependencies,
+                        **_input_options(args)
+                    )
+                    inputs = [text]
+                    if args.figures:
+                        inputs = _target_inputs(
+                            infile, stale, text, args, configs
+                        )
+                else:
+                    analyse_processed(
+                        infile, bool(info), dependencies,
+                        **_input_options(args)
+                    )
+                summaries = io.StringIO()
+                _print_summaries(info, summaries)
+
+            if stale:
+                results = await command.run_targets_async(
+                    configs, stale, inputs, timeout=args.timeout,
+                    cwd=cwd, slots=slots
+                )
+
+            with _captured(stdout, stderr), _working_directory(cwd):
+                _report_results(results)
+                _record_results(
+                    build_manifest, cmdlines, profiles, results, dependencies,
+                    configs
+                )
+                stderr.write(summaries.getvalue())
+            if any(result.returncode != 0 for result in results):
+                status = 1
+        except SystemExit as ex:
+            status = ex.code if isinstance(ex.code, int) else 1
+        except Exception as ex:
+            with _captured(stdout, stderr):
+                _report_error(str(ex))
+            status = 1
+    return {
+        "status": status,
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "targets": [
+            {
+                "target": result.target,
+                "returncode": result.returncode,
+                "elapsed": result.elapsed
+            }
+            for result in results
+        ]
+    }
+
+
+def serve_command(args):
+    """Serve builds for premd build --server"""
+    import asyncio
+    from . import server
+
+    parser = argparse.ArgumentParser(
+        formatter_class=MixedFormatter,
+        usage="%(prog)s serve [-h] [--socket SOCKET] [-j N]",
+        description=serve_command.__doc__
+    )
+    parser.add_argument(
+        "--socket", default=server.default_socket(),
+        help="the Unix socket to listen on"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1,
+        metavar="N",
+        help="run at most N commands at a time, over all builds"
+    )
+    args = parser.parse_args(args)
+    if args.jobs < 1:
+        _error("The number of jobs must be positive.")
+
+    # Converter servers named in the configuration where we start
+    # run for as long as we do.
+    CONFIGS.push_config(os.getcwd())
+    plugins.plugins # load them once, up front
+
+    async def serve():
+        slots = asyncio.Semaphore(args.jobs)
+        input_slots = asyncio.Semaphore(args.jobs)
+        build_server = server.BuildServer(
+            lambda message: _serve_build(message, slots, input_slots),
+            args.socket
+        )
+        await build_server.serve()
+
+    print("Serving builds on {}".format(args.socket), file=sys.stderr)
+    with server.ConverterServers() as converter_servers:
+        converter_servers.start(CONFIGS)
+        try:
+            asyncio.run(serve())
+        except (server.ServerInUseError, server.SocketOwnerError) as ex:
+            _error(str(ex))
+        except KeyboardInterrupt:
+            pass
+
+
+def _batch_projects(patterns):
+    """The project directories :patterns name, in order: directories,
+    or globs matching directories or their premd.yml files."""
+    projects = []
+    for pattern in patterns:
+        if any(c in pattern for c in "*?["):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        elif os.path.exists(pattern):
+            matches = [pattern]
+        else:
+            _error("No such project: {}".format(pattern))
+        for match in matches:
+            if os.path.basename(match) == configuration.PROJECT_CONFIG:
+                match = os.path.dirname(match) or "."
+            if not os.path.isdir(match):
+                continue
+            project = os.path.abspath(match)
+            if project not in projects:
+                projects.append(project)
+    return projects
+
+
+def batch_command(args):
+    """Build the targets of many projects"""
+    import json
+    import asyncio
+
+    parser = argparse.ArgumentParser(
+        formatter_class=MixedFormatter,
+        usage="%(prog)s batch [-h] [-j N] [--report FILE] project [project ...]",
+        description=batch_command.__doc__
+    )
+    parser.add_argument(
+        "projects", nargs="+", metavar="project",
+        help="""a project directory with a premd.yml naming its root
+and targets, or a glob matching such directories or their premd.yml"""
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1,
+        metavar="N",
+        help="run at most N commands at a time, over all projects"
+    )
+    parser.add_argument(
+        "--report", default=None, metavar="FILE",
+        help="write a JSON report of every project and target to FILE"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None, metavar="SECONDS",
+        help="stop building a target after this many seconds"
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true",
+        help="rebuild targets even if they are up to date"
+    )
+    parser.add_argument(
+        "--figures", action="store_true",
+        help="""give each target figures prepared for it, such as
+downscaled copies for HTML and EPUB (needs Pillow)"""
+    )
+    _add_input_arguments(parser)
+    args = parser.parse_args(args)
+    _check_input_arguments(args)
+    if args.jobs < 1:
+        _error("The number of jobs must be positive.")
+
+    projects = _batch_projects(args.projects)
+    if not projects:
+        _error("No projects found.")
+    report_file = args.report and os.path.abspath(args.report)
+
+    # what each project is built with, as premd build would take it
+    build_args = []
+    if args.timeout is not None:
+        build_args += ["--timeout", str(args.timeout)]
+    if args.force:
+        build_args.append("--force")
+    if args.figures:
+        build_args.append("--figures")
+    if args.fast:
+        build_args.append("--fast")
+    if args.parse_jobs is not None:
+        build_args += ["--parse-jobs", str(args.parse_jobs)]
+    if not args.cache:
+        build_args.append("--no-cache")
+
+    # The projects are built as premd serve builds them: one at a time
+    # processes its input, and at most as many as there are slots hold
+    # it, while the commands of all of them share the slots. The
+    # plugins and the global configuration files are only loaded once.
+    cwd = os.getcwd()
+    plugins.plugins
+
+    async def build(project, slots, input_slots):
+        reply = await _serve_build(
+            {"cwd": project, "args": build_args}, slots, input_slots
+        )
+        reply["project"] = os.path.relpath(project, cwd)
+        print(colored(reply["project"], attrs=["bold"]), file=sys.stderr)
+        sys.stdout.write(reply["stdout"])
+        sys.stderr.write(reply["stderr"])
+        return reply
+
+    async def build_all():
+        slots = asyncio.Semaphore(args.jobs)
+        input_slots = asyncio.Semaphore(args.jobs)
+        return await asyncio.gather(*[
+            build(project, slots, input_slots) for project in projects
+        ])
+
+    start = time.perf_counter()
+    replies = asyncio.run(build_all())
+    failed = [reply for reply in replies if reply["status"] != 0]
+
+    if report_file is not None:
+        report = {
+            "elapsed": time.perf_counter() - start,
+            "failed": len(failed),
+            "projects": [
+                {
+                    "project": reply["project"],
+                    "status": reply["status"],
+                    "targets": reply["targets"],
+                    "stdout": reply["stdout"],
+                    "stderr": reply["stderr"],
+                }
+                for reply in replies
+            ],
+        }
+        with open(report_file, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+            print(file=outfile)
+
+    print("Built {} projects: {} failed.".format(
+        len(replies), len(failed)
+    ), file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+def watch_command(args):
+    """Rebuild output files when their input changes"""
+
+    parser = _build_parser(
+        "%(prog)s watch [-h] [infile] [-o outfiles]",
+        watch_command.__doc__
+    )
+    args = parser.parse_args(args)
+    infile, targets, info = _build_setup(args, CONFIGS)
+
+    # The configuration and the plugins stay loaded between builds;
+    # we only need fresh plugin state for each new build.
+    watcher = watch.watcher()
+    watched = {infile}
+    try:
+        while True:
+            dependencies = set()
+            try:
+                with _profiled(args):
+                    _build(infile, targets, info, args, dependencies)
+            except SystemExit:
+                # _error has reported it already
+                pass
+            except (flatten.CircularInclusionError, artifact.ArtifactError,
+                    offload.OffloadError) as ex:
+                _report_error(str(ex))
+            except (OSError, UnicodeDecodeError) as ex:
+                _report_error("Build failed: {}".format(ex))
+            else:
+                watched = dependencies
+            if watched is not dependencies:
+                # a failed build may not have seen every file, so we
+                # keep watching those of the last build that worked
+                offload.discard()
+                dependencies |= watched
+            args.force = False # only force the first build
+
+            watcher.watch(dependencies)
+            print(colored("Watching {} files for changes...".format(
+                len(dependencies)
+            ), attrs=["dark"]), file=sys.stderr)
+            changed = watcher.wait()
+            print("Changed: {}".format(", ".join(sorted(changed))),
+                  file=sys.stderr)
+            plugins.reset()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
 
 
 # Main app
@@ -323,7 +1246,10 @@ def main():
         parser.print_help()
         sys.exit(1)
 
-    commands[args.command](sys.argv[2:])
+    try:
+        commands[args.command](sys.argv[2:])
+    except (artifact.ArtifactError, offload.OffloadError) as ex:
+        _error(str(ex))
 
 
 # Run this in case the module is called as a program...
@@ -0,0 +1,192 @@
+"""
+Flattened documents saved as artifacts: the processed text, where
+each of its lines came from, and the tags the plugins saw, in a
+gzipped JSON file. premd transform --artifact writes one, and the
+other commands accept it in place of the input file, so the document
+is read with one load instead of flattened again.
+"""
+
+import os
+import gzip
+import json
+import collections
+
+from . import flatten
+
+FORMAT = "premd-artifact"
+VERSION = 1
+
+# The events we record, in the order the plugins saw them
+_LINES, _TAG = range(2)
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def is_artifact(filename):
+    """Is :filename an artifact rather than a document?"""
+    try:
+        with open(filename, "rb") as stream:
+            return stream.read(2) == _GZIP_MAGIC
+    except OSError:
+        return False
+
+
+class Recorder:
+    """Records a flattening for an artifact. Used in place of the
+    observers, it sends every event on to :observers and records the
+    lines, the files they came from, and the tags."""
+
+    def __init__(self, observers):
+        self._observers = observers
+        self._files = {}
+        self._stamps = []
+        self.output_lines = []
+        self.events = []
+
+    def _file(self, filename):
+        if filename not in self._files:
+            # stamped as it is read, so changes after that show
+            self._files[filename] = len(self._files)
+            self._stamps.append(_stamp(os.path.abspath(filename)))
+        return self._files[filename]
+
+    def _add_lines(self, filename, lineno, lines):
+        file = self._file(filename)
+        last = self.events[-1] if self.events else None
+        if (last is not None and last[0] == _LINES and last[1] == file
+                and last[2] + last[3] == lineno):
+            last[3] += len(lines)
+        else:
+            self.events.append([_LINES, file, lineno, len(lines)])
+        self.output_lines.extend(lines)
+
+    def line(self, filename, lineno, line):
+        self._observers.line(filename, lineno, line)
+        self._add_lines(filename, lineno, [line])
+
+    def lines(self, filename, lineno, lines):
+        self._observers.lines(filename, lineno, lines)
+        self._add_lines(filename, lineno, lines)
+
+    def _add_tag(self, filename, lineno, tag, rest):
+        self.events.append([_TAG, self._file(filename), lineno, tag, rest])
+
+    def comment(self, filename, lineno, line):
+        self._observers.comment(filename, lineno, line)
+        # we keep every tag, for whatever plugins read the artifact
+        self._add_tag(filename, lineno, *flatten._parse_tag(line))
+
+    def tag(self, filename, lineno, tag, rest):
+        self._observers.tag(filename, lineno, tag, rest)
+        self._add_tag(filename, lineno, tag, rest)
+
+    def flush(self):
+        self._observers.flush()
+
+    def finish(self):
+        self._observers.finish()
+
+    def close(self):
+        """Stop the observers when the flattening did not finish."""
+        self._observers.close()
+
+    def save(self, filename, root):
+        """Write what we recorded from flattening :root to the
+        artifact :filename."""
+        artifact = {
+            "format": FORMAT,
+            "version": VERSION,
+            "root": root,
+            "files": list(self._files),
+            "stamps": self._stamps,
+            "text": "\n".join(self.output_lines),
+            "events": self.events,
+        }
+        with gzip.open(filename, "wt", encoding="utf-8",
+                       compresslevel=6) as stream:
+            json.dump(artifact, stream, separators=(",", ":"))
+
+
+def _stamp(path):
+    """:path with its modification time and size, or None for those
+    if it is gone."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, stat.st_mtime_ns, stat.st_size]
+
+
+Artifact = collections.namedtuple(
+    "Artifact", ["root", "files", "lines", "events", "stamps"]
+)
+
+
+def load(filename):
+    """Read the artifact :filename. Raises an ArtifactError if it is
+    not an artifact this version of premd can read."""
+    try:
+        with gzip.open(filename, "rt", encoding="utf-8") as stream:
+            artifact = json.load(stream)
+        valid = (artifact["format"] == FORMAT
+                 and artifact["version"] == VERSION)
+    except (OSError, ValueError, KeyError, TypeError):
+        valid = False
+    if not valid:
+        raise ArtifactError(
+            "{} is not an artifact this premd can read.".format(filename)
+        )
+    lines = artifact["text"].split("\n") if artifact["events"] else []
+    return Artifact(
+        artifact["root"], artifact["files"], lines, artifact["events"],
+        artifact.get("stamps", []) # not in the first artifacts
+    )
+
+
+def changed_files(loaded):
+    """The files the :loaded artifact was made from that changed, or
+    are gone, since they were read for it."""
+    return [
+        filename
+        for filename, stamp in zip(loaded.files, loaded.stamps)
+        if _stamp(stamp[0]) != stamp
+    ]
+
+
+def flatten_artifact(filename, run_plugins = True, dependencies = None,
+                     observers = None, source_map = None, warn = None):
+    """The same as flatten, for the document saved in the artifact
+    :filename, but yielding lists of consecutive lines from the same
+    file. The plugins see the recorded events, in the same order.
+    What is built from an artifact only depends on the artifact, so
+    that is all we add to :dependencies. If files it was made from
+    changed since, we tell :warn, if given, which they are."""
+    artifact = load(filename)
+    if dependencies is not None:
+        dependencies.add(filename)
+    changed = changed_files(artifact)
+    if changed and warn is not None:
+        warn("{} is older than the files it was made from; changed "
+             "since: {}".format(filename, ", ".join(changed)))
+
+    files = artifact.files
+    lines = artifact.lines
+    position = 0
+    with flatten._observing(run_plugins, observers) as observers:
+        for event in artifact.events:
+            if event[0] == _LINES:
+                _, file, lineno, count = event
+                block = lines[position:position + count]
+                position += count
+                if observers is not None:
+                    observers.lines(files[file], lineno, block)
+                if source_map is not None:
+                    source_map.add(files[file], lineno, count)
+                yield block
+            elif observers is not None: # _TAG
+                _, file, lineno, tag, rest = event
+                observers.tag(files[file], lineno, tag, rest)
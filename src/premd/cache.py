@@ -0,0 +1,129 @@
+"""
+Caching parsed files between runs, so files that have not changed
+are not read and tokenized again. The cache is kept in the user's
+cache directory rather than next to the files.
+"""
+
+import os
+import json
+import hashlib
+import collections
+
+from . import flatten
+from . import manifest
+
+
+# Entries read or written by this process, by entry file, so a
+# long-running process does not load them from disk again. They are
+# checked against the files just like the entries on disk. Only the
+# MAX_ENTRIES most recently used are kept; the others are on disk.
+MAX_ENTRIES = 1024
+_entries = collections.OrderedDict()
+
+
+def _remember(entry_file, entry):
+    _entries[entry_file] = entry
+    _entries.move_to_end(entry_file)
+    while len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
+
+
+def cache_directory():
+    """Where parsed files are kept: premd/parsed in $XDG_CACHE_HOME."""
+    cache_home = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    return os.path.join(cache_home, "premd", "parsed")
+
+
+def _decode_entry(entry):
+    """The entry as JSON gave it back, with its ParsedFile restored."""
+    filename, tokens, dependencies, include_lines = entry["parsed"]
+    entry["parsed"] = flatten.ParsedFile(
+        filename, [tuple(token) for token in tokens], dependencies,
+        [tuple(include_line) for include_line in include_lines]
+    )
+    return entry
+
+
+class ParseCache:
+    """Parsed files stored as JSON in :directory, by default the
+    user's cache directory. An entry is used when the file's
+    modification time and size are unchanged, or, failing that, when
+    its content hash is."""
+
+    def __init__(self, directory = None):
+        if directory is None:
+            directory = cache_directory()
+        self.directory = directory
+        self._cwd = os.getcwd()
+
+    def _entry_file(self, filename):
+        # Include paths in the tokens are relative to the directory
+        # we run in, so that is part of the key, which makes it the
+        # absolute path of a relative :filename.
+        key = os.path.join(self._cwd, filename)
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest + ".json")
+
+    def _read_entry(self, filename):
+        entry_file = self._entry_file(filename)
+        if entry_file in _entries:
+            _entries.move_to_end(entry_file)
+            return _entries[entry_file]
+        try:
+            with open(entry_file) as stream:
+                entry = _decode_entry(json.load(stream))
+        except (OSError, ValueError, TypeError, KeyError):
+            return None # missing, unreadable, or from another version
+        _remember(entry_file, entry)
+        return entry
+
+    def _write_entry(self, filename, entry):
+        entry_file = self._entry_file(filename)
+        _remember(entry_file, entry)
+        tmp_file = "{}.{}.tmp".format(entry_file, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_file, "w") as stream:
+                json.dump(entry, stream)
+            os.replace(tmp_file, entry_file)
+        except OSError:
+            pass # we can live without a cache
+
+    def get(self, filename):
+        """The cached ParsedFile for :filename, or None if we have
+        nothing we can use."""
+        entry = self._read_entry(filename)
+        if entry is None or entry["filename"] != filename:
+            return None
+        stat = os.stat(filename)
+        if (entry["mtime"], entry["size"]) != (stat.st_mtime_ns, stat.st_size):
+            if manifest.file_hash(filename) != entry["hash"]:
+                return None
+            # touched but not changed
+            entry["mtime"], entry["size"] = stat.st_mtime_ns, stat.st_size
+            self._write_entry(filename, entry)
+        parsed_file = entry["parsed"]
+        if not flatten.includes_unchanged(parsed_file):
+            return None
+        return parsed_file
+
+    def put(self, parsed_file):
+        filename = parsed_file.filename
+        stat = os.stat(filename)
+        self._write_entry(filename, {
+            "filename": filename,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": manifest.file_hash(filename),
+            "parsed": parsed_file,
+        })
+
+    def __getitem__(self, filename):
+        """Get the parsed :filename, from the cache if we can."""
+        parsed_file = self.get(filename)
+        if parsed_file is None:
+            parsed_file = flatten.parse_file(filename)
+            self.put(parsed_file)
+        return parsed_file
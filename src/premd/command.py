@@ -1,8 +1,15 @@
 
 from . import utils
+from . import timing
 import copy
 import os.path
 import io
+import time
+import json
+import base64
+import signal
+import locale
+import collections.abc
 from subprocess import Popen, PIPE
 
 
@@ -16,62 +23,444 @@ def _get_filetype_dict(target):
 class NoCommandException(Exception):
 	pass
 
-class RunCommand:
-		
-	def __init__(self, config, target):
-		"""Class for building commandlines for building a target."""
+def _resolve_command_line(config, target):
 
-		# build the conf from most general to most specific
-		# we know that at least command and arguments will always be there
-		root = { 
-			"command": config["command"],
-			"arguments": list(config["arguments"]) # make sure it is a copy
-		}
-		filetype = _get_filetype_dict(target)
-		if filetype is None:
-			filetype_dict = {}
-		else:
-			filetype_dict = copy.deepcopy(config.get(('filetypes', filetype), {}))
-		target_dict = copy.deepcopy(config.get(('targets', target), {}))
-		
-		conf = root
-		utils.merge_dicts(conf, filetype_dict)
-		utils.merge_dicts(conf, target_dict)
-		
-		# if there is a shared dict, update accordingly
-		if "shared" in config:
-			# shared can override command but arguments are added
-			shared = config["shared"]
-			if "command" in shared:
-				conf["command"] = shared["command"]
-			if "arguments" in shared:
-				conf["arguments"].extend(shared["arguments"])
+	# build the conf from most general to most specific
+	# we know that at least command and arguments will always be there
+	root = { 
+		"command": config["command"],
+		"arguments": list(config["arguments"]) # make sure it is a copy
+	}
+	filetype = _get_filetype_dict(target)
+	if filetype is None:
+		filetype_dict = {}
+	else:
+		filetype_dict = copy.deepcopy(config.get(('filetypes', filetype), {}))
+	target_dict = copy.deepcopy(config.get(('targets', target), {}))
+	
+	conf = root
+	utils.merge_dicts(conf, filetype_dict)
+	utils.merge_dicts(conf, target_dict)
+	
+	# if there is a shared dict, update accordingly
+	if "shared" in config:
+		# shared can override command but arguments are added
+		shared = config["shared"]
+		if "command" in shared:
+			conf["command"] = shared["command"]
+		if "arguments" in shared:
+			conf["arguments"].extend(shared["arguments"])
 
-		# if the arguments contain spaces we need to split them for subprocess
-		args = []
-		for arg in conf["arguments"]:
-			args.extend(arg.split())
-		conf["arguments"] = args
+	# if the arguments contain spaces we need to split them for subprocess
+	args = []
+	for arg in conf["arguments"]:
+		args.extend(arg.split())
+	conf["arguments"] = args
 
-		# finally, add the output file
-		conf["arguments"].extend(['-o', target])
+	# finally, add the output file
+	conf["arguments"].extend(['-o', target])
 
-		if conf["command"] is None:
-			raise NoCommandException
+	if conf["command"] is None:
+		raise NoCommandException
 
-		self._cmdline = [conf["command"]] + conf["arguments"]
+	return tuple([conf["command"]] + conf["arguments"])
+
+def command_line(config, target):
+	"""The command line for building :target as :config says. It is
+	only worked out once and kept with the compiled configurations."""
+	return list(config.compiled(
+		("command_line", target),
+		lambda: _resolve_command_line(config, target)
+	))
+
+# Mapped ranges smaller than this are copied into the pipe's buffer
+# rather than sent by the kernel, which takes a system call each.
+SENDFILE_MIN = 1 << 16
+
+def _send_range(pipe, chunk):
+	"""Send the range :chunk of a memory-mapped file to :pipe, by
+	the kernel if we can."""
+	start, end = chunk.start, chunk.end
+	if end - start >= SENDFILE_MIN and hasattr(os, "sendfile"):
+		pipe.flush()
+		try:
+			while start < end:
+				start += os.sendfile(
+					pipe.fileno(), chunk.fileno, start, end - start
+				)
+			return
+		except BrokenPipeError:
+			# the command stopped reading, which copying cannot fix
+			raise
+		except OSError:
+			pass # not from this file; copy what is left
+	with memoryview(chunk.buffer) as view:
+		pipe.write(view[start:end])
+
+class RunCommand:
+		
+	def __init__(self, config, target):
+		"""Class for building commandlines for building a target."""
+		self._cmdline = command_line(config, target)
+		self._target = target
 
 	def __enter__(self):
 		self._process = Popen(self._cmdline, stdin = PIPE)
 		self._stdin = io.TextIOWrapper(self._process.stdin)
+		if timing.current is not None:
+			self._stdin = timing.TimedWriter(
+				self._target, self._stdin, timing.current
+			)
 		return self
 
 	def __exit__(self, *foo):
-		self._stdin.close()
-		self._process.wait()
+		try:
+			self._stdin.close()
+		except BrokenPipeError:
+			# the command stopped reading; its exit status tells us why
+			pass
+		start = time.perf_counter()
+		self._returncode = self._process.wait()
+		if timing.current is not None:
+			timing.current.add_command_wait(
+				self._target, time.perf_counter() - start
+			)
+
+	def write_chunks(self, chunks):
+		"""Write :chunks, bytes or the MappedRanges of flatten_bytes,
+		to the command, past the text stream of stdin."""
+		self._stdin.flush()
+		pipe = self._process.stdin
+		elapsed = 0
+		try:
+			for chunk in chunks:
+				start = time.perf_counter()
+				if isinstance(chunk, bytes):
+					pipe.write(chunk)
+				else:
+					_send_range(pipe, chunk)
+				elapsed += time.perf_counter() - start
+		except BrokenPipeError:
+			# the command stopped reading; its exit status tells us why
+			pass
+		if timing.current is not None:
+			timing.current.add_command_write(self._target, elapsed)
+
+	@property
+	def cmdline(self):
+		return list(self._cmdline)
 
 	@property
 	def stdin(self):
 		return self._stdin
-	
 
+	@property
+	def returncode(self):
+		return self._returncode
+
+
+TargetResult = collections.namedtuple(
+	"TargetResult", ["target", "returncode", "elapsed", "stdout", "stderr"],
+	defaults = (None, None) # output is only captured when run from asyncio
+)
+
+def _kill(process):
+	"""Kill :process and, where we can, the processes it started,
+	which would otherwise keep its output pipes open."""
+	if os.name == "posix":
+		try:
+			os.killpg(process.pid, signal.SIGKILL)
+		except ProcessLookupError:
+			pass
+	else:
+		process.kill()
+
+class AsyncRunCommand:
+
+	def __init__(self, config, target, timeout = None, cwd = None):
+		"""Runs the command for building a target from asyncio. The
+		input is written with backpressure while the command's stdout
+		and stderr are collected, so a command that stalls does not
+		hold up anything else. Commands running for more than :timeout
+		seconds are killed. The command runs in :cwd if given."""
+		self._cmdline = command_line(config, target)
+		self._target = target
+		self._timeout = timeout
+		self._cwd = cwd
+
+	@property
+	def cmdline(self):
+		return list(self._cmdline)
+
+	async def _write(self, stream, chunks):
+		encoding = locale.getpreferredencoding(False)
+		start = time.perf_counter()
+		try:
+			for chunk in chunks:
+				stream.write(chunk.encode(encoding))
+				await stream.drain()
+		except (BrokenPipeError, ConnectionResetError):
+			# the command stopped reading; its exit status tells us why
+			pass
+		finally:
+			stream.close()
+		if timing.current is not None:
+			timing.current.add_command_write(
+				self._target, time.perf_counter() - start
+			)
+
+	async def _communicate(self, process, chunks):
+		import asyncio
+		reads = [
+			asyncio.ensure_future(process.stdout.read()),
+			asyncio.ensure_future(process.stderr.read())
+		]
+		try:
+			await self._write(process.stdin, chunks)
+			stdout, stderr = await asyncio.gather(*reads)
+		finally:
+			for read in reads:
+				read.cancel()
+		start = time.perf_counter()
+		await process.wait()
+		if timing.current is not None:
+			timing.current.add_command_wait(
+				self._target, time.perf_counter() - start
+			)
+		return stdout, stderr
+
+	async def run(self, chunks):
+		"""Write the text :chunks to the command and wait for it.
+		Returns a TargetResult; the return code is None if the
+		command timed out."""
+		import asyncio
+		start = time.perf_counter()
+		process = await asyncio.create_subprocess_exec(
+			*self._cmdline, stdin = PIPE, stdout = PIPE, stderr = PIPE,
+			cwd = self._cwd,
+			# in its own process group, so we can kill what it started
+			start_new_session = os.name == "posix"
+		)
+		stdout = stderr = None
+		try:
+			stdout, stderr = await asyncio.wait_for(
+				self._communicate(process, chunks), self._timeout
+			)
+		except asyncio.TimeoutError:
+			pass
+		finally:
+			# also when we time out, fail or are cancelled
+			if process.returncode is None:
+				_kill(process)
+				await process.wait()
+		returncode = None if stdout is None else process.returncode
+		return TargetResult(
+			self._target, returncode, time.perf_counter() - start,
+			stdout, stderr
+		)
+
+
+class ServerConverter:
+
+	def __init__(self, config, target, timeout = None, cwd = None):
+		"""Builds a target by posting the text to a converter server,
+		such as pandoc-server, at the "url" in the "server"
+		configuration, instead of starting a command. The request
+		holds the text and the "options" from the "server"
+		configuration, updated with the "server_options" for the
+		target's filetype and for the target itself. The output
+		format defaults to the target's extension."""
+		self._url = config["server", "url"]
+		self._target = target
+		self._timeout = timeout
+		self._cwd = cwd
+
+		filetype = _get_filetype_dict(target)
+		self._options = {} if filetype is None else {"to": filetype}
+		utils.merge_dicts(self._options, copy.deepcopy(
+			config.get(("server", "options"), {})
+		))
+		utils.merge_dicts(self._options, copy.deepcopy(
+			config.get(("filetypes", filetype, "server_options"), {})
+		))
+		utils.merge_dicts(self._options, copy.deepcopy(
+			config.get(("targets", target, "server_options"), {})
+		))
+
+	def _post(self, text):
+		"""Returns the exit status, the output, and messages for stderr."""
+		import urllib.request # only needed here, and slow to import
+		import urllib.error
+		request = urllib.request.Request(
+			self._url,
+			data = json.dumps(dict(self._options, text = text)).encode(),
+			headers = {
+				"Content-Type": "application/json",
+				"Accept": "application/json"
+			}
+		)
+		try:
+			with urllib.request.urlopen(request) as response:
+				reply = json.load(response)
+		except urllib.error.HTTPError as ex:
+			return 1, None, ex.read()
+		except (OSError, ValueError) as ex:
+			return 1, None, "{}: {}\n".format(self._url, ex).encode()
+		output = reply["output"]
+		if reply.get("base64"):
+			output = base64.b64decode(output)
+		else:
+			output = output.encode()
+		messages = "".join(
+			"{}\n".format(message.get("message", message))
+			if isinstance(message, dict) else "{}\n".format(message)
+			for message in reply.get("messages", [])
+		)
+		return 0, output, messages.encode()
+
+	async def run(self, chunks):
+		"""Post the text :chunks and write the output to the target.
+		Returns a TargetResult; the return code is None if the
+		server did not answer in time."""
+		import asyncio
+		start = time.perf_counter()
+		text = "".join(chunks)
+		loop = asyncio.get_running_loop()
+		try:
+			returncode, output, stderr = await asyncio.wait_for(
+				loop.run_in_executor(None, self._post, text), self._timeout
+			)
+		except asyncio.TimeoutError:
+			returncode, output, stderr = None, None, None
+		if output is not None:
+			target = os.path.join(self._cwd or "", self._target)
+			with open(target, "wb") as outfile:
+				outfile.write(output)
+		if timing.current is not None:
+			timing.current.add_command_wait(
+				self._target, time.perf_counter() - start
+			)
+		return TargetResult(
+			self._target, returncode, time.perf_counter() - start,
+			None, stderr
+		)
+
+def converter(config, target, timeout = None, cwd = None):
+	"""What builds :target: a converter server if the configuration
+	names one, and otherwise the target's command."""
+	if config.get(("server", "url")) is not None:
+		return ServerConverter(config, target, timeout, cwd)
+	return AsyncRunCommand(config, target, timeout, cwd)
+
+
+class _SharedChunks:
+	"""Lets several targets read the same chunks while producing each
+	chunk only once, when the first target asks for it. Each target
+	reads through a reader of its own, and a chunk is dropped once
+	every reader has read it or been closed. Chunks are produced in
+	the task of the reader asking for them, holding up the event loop
+	meanwhile; producing them runs the plugins, which must not run in
+	other threads."""
+
+	def __init__(self, chunks):
+		self._chunks = iter(chunks)
+		self._produced = collections.deque()
+		self._first = 0 # the index of _produced[0]
+		self._readers = set()
+		self._error = None
+
+	def reader(self):
+		"""A reader starting at the first chunk. All readers must be
+		taken before reading starts, and closed when done."""
+		reader = _ChunkReader(self)
+		self._readers.add(reader)
+		return reader
+
+	def _read(self, reader):
+		while True:
+			index = reader.position - self._first
+			if index == len(self._produced):
+				if self._error is not None:
+					raise self._error
+				try:
+					self._produced.append(next(self._chunks))
+				except StopIteration:
+					return
+				except Exception as error:
+					self._error = error # for the other targets
+					raise
+			chunk = self._produced[index]
+			reader.position += 1
+			self._drop_read()
+			yield chunk
+
+	def _close(self, reader):
+		self._readers.discard(reader)
+		self._drop_read()
+
+	def _drop_read(self):
+		end = self._first + len(self._produced)
+		first = min((reader.position for reader in self._readers), default=end)
+		while self._first < first:
+			self._produced.popleft()
+			self._first += 1
+
+class _ChunkReader:
+	"""One target's way through _SharedChunks."""
+
+	def __init__(self, shared):
+		self._shared = shared
+		self.position = 0
+
+	def __iter__(self):
+		return self._shared._read(self)
+
+	def close(self):
+		self._shared._close(self)
+
+async def run_targets_async(config, targets, chunks, jobs = None,
+                            timeout = None, cwd = None, slots = None):
+	"""Build all :targets from the text :chunks, producing the chunks
+	as the commands read them, running at most :jobs commands
+	concurrently and giving each :timeout seconds. If :slots, a
+	semaphore, is given, it limits the commands instead of :jobs, so
+	several builds can share it. If :chunks is a mapping, it gives
+	each target its own chunks. Returns a TargetResult per target,
+	in the order the targets were given."""
+	import asyncio # slow to import, and only needed to run commands
+	if isinstance(chunks, collections.abc.Mapping):
+		readers = {
+			target: _SharedChunks(chunks[target]).reader()
+			for target in targets
+		}
+	else:
+		shared = _SharedChunks(chunks)
+		readers = {target: shared.reader() for target in targets}
+	if slots is None:
+		slots = asyncio.Semaphore(jobs or len(targets) or 1)
+
+	async def build(target):
+		try:
+			async with slots:
+				return await converter(config, target, timeout, cwd).run(
+					readers[target]
+				)
+		finally:
+			readers[target].close()
+
+	tasks = [build(target) for target in targets]
+	# Every target gets to clean up after itself before we raise
+	# the first error, if any.
+	results = await asyncio.gather(*tasks, return_exceptions = True)
+	for result in results:
+		if isinstance(result, BaseException):
+			raise result
+	return results
+
+def run_targets(config, targets, chunks, jobs = None, timeout = None):
+	"""Build all :targets from the text :chunks, as run_targets_async
+	does, from a new event loop."""
+	import asyncio
+	return asyncio.run(
+		run_targets_async(config, targets, chunks, jobs, timeout)
+	)
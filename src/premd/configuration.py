@@ -3,47 +3,181 @@ Code for handling configuration files
 """
 
 import os
-import yaml
-import pkg_resources
+import copy
+import json
 import collections
 import functools
 from . import utils
+from . import manifest
 
 GLOBAL_CONFIGS = [
-    pkg_resources.resource_filename("premd", "config.yml"),
+    os.path.join(os.path.dirname(__file__), "config.yml"),
     os.path.join(os.path.expanduser("~"), ".premd.yml")
 ]
+PROJECT_CONFIG = "premd.yml"
+COMPILED_FILE = "config.json"
+COMPILED_VERSION = 2
 
-def _read_config_file(filename):
+# The configuration files read so far, by absolute path, with what
+# identified them when we read them, so a long-running process only
+# reads a file again when it changes.
+_config_files = {}
+
+def _load_config_file(filename):
+    import yaml # slow to import, and not needed when the cache is used
     try:
         with open(filename, 'r') as config_file:
-            return yaml.load(config_file)
+            return yaml.safe_load(config_file) or {}
     except:
         return {}
 
+def _file_identity(filename):
+    """What tells us that :filename changed: its modification time,
+    size and inode. None if there is no such file."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
 
-class Configurations(collections.UserDict):
+def _read_config_file(filename):
+    # Relative names, such as premd.yml, name different files in
+    # different projects, and copied files may have the same time.
+    filename = os.path.abspath(filename)
+    identity = _file_identity(filename)
+    if identity is None:
+        return {}
+    loaded = _config_files.get(filename)
+    if loaded is None or loaded[0] != identity:
+        loaded = (identity, _load_config_file(filename))
+        _config_files[filename] = loaded
+    # merging hands out parts of the dict, so never share it
+    return copy.deepcopy(loaded[1])
+
+def _stamp(filename):
+    return [os.path.abspath(filename), _file_identity(filename)]
 
 
+class Configurations(collections.UserDict):
+    """The merged configuration files. Nothing is read before the
+    configurations are used. With a project configuration, the merged
+    configurations and everything compiled from them are cached next
+    to it, and used for as long as none of the files change. Once in
+    use, the configurations should be treated as frozen."""
+
     def __init__(self):
+        self._sources = list(GLOBAL_CONFIGS)
+        self._data = None
+        self._compiled_file = None
+        self._compiled = {}
+        self._unsaved = False
+
+    def _merge_sources(self):
         # At the *very* least we want a shared dict with a command
         # and a list of arguments. Now, these *should* be set
         # in the global configuration file, but just in case
         # we explicit start with that dict
-        self.data = {
+        data = {
             "command": None,
             "arguments": []
         }
-        for config_file in GLOBAL_CONFIGS:
-            self._add_config_file(config_file)
+        for config_file in self._sources:
+            utils.merge_dicts(data, _read_config_file(config_file))
+        return data
+
+    def _load(self):
+        # the files are stamped before they are read, so if they
+        # change while we read them the cache is stale next time
+        self._stamps = [_stamp(source) for source in self._sources]
+        if self._compiled_file is not None:
+            try:
+                with open(self._compiled_file) as stream:
+                    compiled = json.load(stream)
+                if (compiled["version"] == COMPILED_VERSION
+                        and compiled["stamps"] == self._stamps):
+                    self._compiled = {
+                        tuple(key): value for key, value in compiled["table"]
+                    }
+                    return compiled["data"]
+            except Exception: # missing, unreadable, or from another version
+                pass
+
+        data = self._merge_sources()
+        self._save(data)
+        return data
 
-    def _add_config_file(self, fname):
-        yaml_dict = _read_config_file(fname)
-        utils.merge_dicts(self.data, yaml_dict)
+    def _save(self, data = None):
+        if self._compiled_file is None:
+            return
+        tmp_file = "{}.{}.tmp".format(self._compiled_file, os.getpid())
+        if data is None:
+            data = self._data
+        try:
+            # JSON, so reading the cache never runs code from it
+            compiled = json.dumps({
+                "version": COMPILED_VERSION,
+                "stamps": self._stamps,
+                "data": data,
+                "table": [[list(key), value]
+                          for key, value in self._compiled.items()],
+            })
+        except (TypeError, ValueError):
+            return # not plain data, so we do without a cache
+        if json.loads(compiled)["data"] != data:
+            return # YAML that JSON cannot hold, such as numbers as keys
+        try:
+            os.makedirs(os.path.dirname(self._compiled_file), exist_ok=True)
+            with open(tmp_file, "w") as stream:
+                stream.write(compiled)
+            os.replace(tmp_file, self._compiled_file)
+        except OSError:
+            pass # we can live without a cache
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._load()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        # no longer what the files say, so nothing is cached
+        self._data = data
+        self._compiled_file = None
+        self._compiled = {}
 
     def push_config(self, root_dir):
-        project_config = os.path.join(root_dir, "premd.yml")
-        self._add_config_file(project_config)
+        project_config = os.path.abspath(
+            os.path.join(root_dir, PROJECT_CONFIG)
+        )
+        if self._data is not None:
+            # already in use, so we merge the file into what we have
+            utils.merge_dicts(self._data, _read_config_file(project_config))
+            self._compiled_file = None
+            self._compiled = {}
+            return
+        self._sources.append(project_config)
+        if os.path.isfile(project_config):
+            self._compiled_file = os.path.join(
+                manifest.cache_dir(root_dir), COMPILED_FILE
+            )
+
+    def compiled(self, key, compile):
+        """The value compile() gives for :key. It is only compiled
+        once, and with a project configuration it is cached with the
+        configurations, once they are saved, until the files change."""
+        self.data # loads the compiled values if they are cached
+        if key not in self._compiled:
+            self._compiled[key] = compile()
+            self._unsaved = True
+        return self._compiled[key]
+
+    def save(self):
+        """Cache the values compiled since the configurations were
+        loaded or last saved, all in one write."""
+        if self._unsaved:
+            self._unsaved = False
+            self._save()
 
     def __getitem__(self, path):
         try:
@@ -0,0 +1,177 @@
+"""
+Preparing figures for each target: downscaled and recompressed copies
+for targets that are read on screen, made in a process pool and cached
+by content, with the figure links in the text pointing at them. This
+needs Pillow; without it, the figures are used as they are.
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import importlib.util
+import concurrent.futures
+
+from . import command
+from . import manifest
+from . import utils
+
+FIGURES_DIR = "figures"
+
+# How figures are prepared for each filetype, unless the "figures"
+# configuration says otherwise. Filetypes not listed, and those set
+# to null, get the figures as they are.
+DEFAULT_PROFILES = {
+    "html": {"max_width": 1600, "optimize": True},
+    "epub": {"max_width": 1600, "optimize": True},
+}
+
+# Figure links as flatten leaves them, at the start of a line
+FIGURE_LINK_RE = re.compile(r"^(!\[[^\]]*\]\()([^\)]*)(\))", re.MULTILINE)
+
+_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif"}
+
+
+def available():
+    """Can we prepare figures, or is Pillow missing?"""
+    return importlib.util.find_spec("PIL") is not None
+
+
+def target_profile(config, target):
+    """How figures are prepared for :target, or None if it gets them
+    as they are. The "figures" configuration for the target's filetype
+    updates the default, and "figures" in the target's own
+    configuration updates that."""
+    filetype = command._get_filetype_dict(target)
+    profile = DEFAULT_PROFILES.get(filetype)
+    profile = {} if profile is None else dict(profile)
+    for path in (("figures", filetype), ("targets", target, "figures")):
+        try:
+            options = config[path]
+        except KeyError:
+            continue
+        if options is None:
+            profile = {} # figures as they are
+        else:
+            utils.merge_dicts(profile, options)
+    return profile or None
+
+
+def figure_links(text):
+    """The local figure files :text links to."""
+    return {
+        match.group(2) for match in FIGURE_LINK_RE.finditer(text)
+        if os.path.isfile(match.group(2))
+    }
+
+
+def _prepare(source, destination, profile):
+    """Make the asset :destination from the figure :source. Runs in
+    a worker process."""
+    from PIL import Image
+
+    tmp_file = "{}.{}.tmp".format(destination, os.getpid())
+    with Image.open(source) as image:
+        source_format = image.format
+        image_format = profile.get("format", source_format)
+        max_width = profile.get("max_width")
+        resized = max_width is not None and image.width > max_width
+        if resized:
+            height = max(1, round(image.height * max_width / image.width))
+            image = image.resize((max_width, height), Image.LANCZOS)
+        if image_format.upper() == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        options = {}
+        if "quality" in profile:
+            options["quality"] = profile["quality"]
+        if profile.get("optimize"):
+            options["optimize"] = True
+        image.save(tmp_file, format = image_format, **options)
+
+    if (not resized and image_format == source_format and
+            os.path.getsize(tmp_file) >= os.path.getsize(source)):
+        # recompressing did not help, so we keep the original
+        shutil.copyfile(source, tmp_file)
+    os.replace(tmp_file, destination)
+
+
+class FigureAssets:
+    """The prepared figures for a project, kept in its cache directory
+    and named by the hash of the figure's content and how it was
+    prepared, so each is only made once."""
+
+    def __init__(self, root_dir, jobs = None):
+        self.directory = os.path.join(manifest.cache_dir(root_dir), FIGURES_DIR)
+        self.jobs = jobs
+
+    def _asset(self, figure, profile):
+        key = json.dumps([manifest.file_hash(figure), profile], sort_keys=True)
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        extension = _EXTENSIONS.get(
+            str(profile.get("format", "")).upper(),
+            os.path.splitext(figure)[1]
+        )
+        return os.path.join(self.directory, digest + extension)
+
+    def prepare(self, figures, profiles):
+        """Make the assets for each of the :figures for each of the
+        :profiles that are not made already. Returns a dictionary
+        from a figure and the index of a profile to the asset."""
+        assets = {}
+        missing = {}
+        for figure in figures:
+            for index, profile in enumerate(profiles):
+                asset = self._asset(figure, profile)
+                assets[figure, index] = asset
+                if not os.path.exists(asset):
+                    missing[asset] = (figure, profile)
+        if missing:
+            os.makedirs(self.directory, exist_ok=True)
+            with concurrent.futures.ProcessPoolExecutor(self.jobs) as pool:
+                futures = [
+                    pool.submit(_prepare, figure, asset, profile)
+                    for asset, (figure, profile) in missing.items()
+                ]
+            for future in futures:
+                future.result() # raise what went wrong, if anything
+        return assets
+
+
+def _rewrite(text, links):
+    def replace(match):
+        asset = links.get(match.group(2))
+        if asset is None:
+            return match.group()
+        return match.group(1) + asset + match.group(3)
+    return FIGURE_LINK_RE.sub(replace, text)
+
+
+def target_texts(config, targets, text, root_dir, jobs = None):
+    """The processed :text for each of the :targets, with its figure
+    links pointing at figures prepared for the target."""
+    profiles = []
+    target_profiles = {}
+    for target in targets:
+        profile = target_profile(config, target)
+        if profile is not None and profile not in profiles:
+            profiles.append(profile)
+        target_profiles[target] = profile
+
+    figures = figure_links(text) if profiles else set()
+    if not figures:
+        return {target: text for target in targets}
+
+    assets = FigureAssets(root_dir, jobs).prepare(figures, profiles)
+    rewritten = [
+        _rewrite(text, {
+            figure: os.path.relpath(assets[figure, index])
+            for figure in figures
+        })
+        for index in range(len(profiles))
+    ]
+    return {
+        target: text if profile is None
+                else rewritten[profiles.index(profile)]
+        for target, profile in target_profiles.items()
+    }
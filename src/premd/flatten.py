@@ -1,12 +1,41 @@
 
 import os.path
 import contextlib
+import collections
+import concurrent.futures
+import itertools
+import locale
+import codecs
+import mmap
+import time
 import re
 
 from .plugin import plugins
+from . import timing
+from . import offload
 
 FIGURE_RE = re.compile(r"!\[([^\]]*)\]\(([^\)]*)\)(.*)")
 
+# For scanning whole files at a time: the lines that may need
+# processing, at the start of the file and after a newline.
+FIRST_DIRECTIVE_RE = re.compile(r"((?:%%|/|!\[)[^\n]*)")
+DIRECTIVE_RE = re.compile(r"\n((?:%%|/|!\[)[^\n]*)")
+FIRST_DIRECTIVE_BYTES_RE = re.compile(rb"((?:%%|/|!\[)[^\n]*)")
+DIRECTIVE_BYTES_RE = re.compile(rb"\n((?:%%|/|!\[)[^\n]*)")
+LONE_CR_BYTES_RE = re.compile(rb"\r(?!\n)")
+# What str.rstrip() would remove from the end of a line, in UTF-8
+TRAILING_SPACE_BYTES_RE = re.compile(
+	rb"(?:[ \t\x0b\x0c\r\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80"
+	rb"|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80)+$",
+	re.MULTILINE
+)
+_ASCII_SPACE = b" \t\x0b\x0c\r\x1c\x1d\x1e\x1f"
+# The bytes that may end such space marked as \x01, and newlines kept
+_SPACE_MARKS = bytes(
+	10 if byte == 10 else 1 if byte in _ASCII_SPACE or byte >= 0x80 else 0
+	for byte in range(256)
+)
+
 class CircularInclusionError(Exception):
 	def __init__(self, filename, stack):
 		msg = "Circular inclusion when importing {filename}.".format(
@@ -16,79 +45,665 @@ class CircularInclusionError(Exception):
 		self.filename = filename
 		self.stack = stack
 
+	def __reduce__(self):
+		# so the error can be sent back from a worker process
+		return CircularInclusionError, (self.filename, self.stack)
+
+class IncludeStack:
+	"""The files being included, the innermost last. We also keep
+	them in a set, so checking for circular inclusions takes constant
+	time however deep the includes go."""
+
+	def __init__(self):
+		self._files = []
+		self._members = set()
+
+	def __contains__(self, filename):
+		return filename in self._members
+
+	def __iter__(self):
+		return iter(self._files)
+
+	def __len__(self):
+		return len(self._files)
+
+	def append(self, filename):
+		self._files.append(filename)
+		self._members.add(filename)
+
+	def pop(self):
+		filename = self._files.pop()
+		self._members.discard(filename)
+		return filename
+
 @contextlib.contextmanager
 def _add_to_stack(stack, filename):
 	if filename in stack:
-		raise CircularInclusionError(filename, stack)
+		raise CircularInclusionError(filename, list(stack))
 	stack.append(filename)
 	yield stack
 	stack.pop()
 
-def flatten(filename, run_plugins = True, stack = None):
+# What a line turned out to be
+_COMMENT, _INCLUDE, _LINE, _TAG = range(4)
+
+def _parse_tag(line):
+	"""Split a comment line into its tag and the rest of the line."""
+	tag, *rest = line[2:].split(':', maxsplit = 1)
+	tag = tag.strip()
+	rest = "" if rest == [] else rest[0].strip()
+	return tag, rest
+
+def _include_candidates(filename, line):
+	"""The files an include line may refer to, in the order we try them."""
+	if line.startswith('//'): # A full path
+		yield line[1:].strip()
+
+	# A relative path
+	this_dir = os.path.dirname(filename)
+	subfile = line[1:].strip()
+	yield os.path.join(this_dir, subfile)
+
+def _resolve_include(filename, line, dependencies = None):
+	"""The file an include line refers to, or None if there is none."""
+	for subfile_full in _include_candidates(filename, line):
+		if os.path.isfile(subfile_full):
+			return subfile_full
+		if dependencies is not None:
+			dependencies.add(subfile_full)
+	return None
+
+def _figure_file(filename, figfile):
+	"""The path of the figure :figfile referred to in :filename."""
+	if figfile.startswith('/'):
+		return figfile # global path
+	# local filename, relative to the input file
+	return os.path.join(os.path.dirname(filename), figfile)
+
+def _process_line(filename, lineno, line, observers, dependencies):
+	"""
+	Handle a single (right-stripped) line, sending tags to the
+	:observers if we run plugins. Returns _COMMENT and None
+	for comment lines, _INCLUDE and the file name for lines that
+	include another file, and _LINE with the (possibly rewritten)
+	line for everything else.
+	"""
+	if line.startswith('%%'): # comments
+		# Handle plugins, if we have a tag we can handle...
+		if observers is not None:
+			observers.comment(filename, lineno, line)
+		
+		# Whether we handled a tag or not, we do not
+		# yield a comment line.
+		return _COMMENT, None
+
+	if line.startswith('/'): # A full or relative path
+		subfile_full = _resolve_include(filename, line, dependencies)
+		if subfile_full is not None:
+			return _INCLUDE, subfile_full
+
+	if line.startswith('!['): # A figure
+		match = FIGURE_RE.match(line)
+		if match is not None:
+			figlabel = match.group(1)
+			figfile = match.group(2)
+			trailing = match.group(3)
+			if not figfile.startswith('/'):
+				# local filename, adjust to input file
+				figfile = _figure_file(filename, figfile)
+				line = "![{figlabel}]({figfile}){trailing}".format(
+						figlabel=figlabel,
+						figfile=figfile,
+						trailing=trailing
+				)						
+			if dependencies is not None:
+				dependencies.add(figfile)
+			# we still want the figure text to be
+			# included in the summaries
+
+	return _LINE, line
+
+class _Observers:
+	"""
+	Sends lines to the observer plugins: one line at a time to
+	ObserverPlugins, and in blocks of consecutive lines from the same
+	file to BatchObserverPlugins. Blocks still being collected are sent
+	before any tag is handled, so plugins see events in document order.
+	With :offloading, the plugins that allow it get their blocks in
+	worker processes, and what they collected once we finish().
+	"""
+
+	block_size = 4096
+
+	def __init__(self, offloading = True):
+		self._line_observers = list(plugins.observer_plugins)
+		self._batch_observers = list(plugins.batch_observer_plugins)
+		self._offloaded = None
+		names = offload.offloaded_names() if offloading else []
+		if names:
+			offloaded = {plugins.summary_plugins[name] for name in names}
+			self._line_observers = [
+				o for o in self._line_observers if o not in offloaded
+			]
+			self._batch_observers = [
+				o for o in self._batch_observers if o not in offloaded
+			]
+			self._offloaded = offload.OffloadedObservers(names)
+			self._batch_observers.append(self._offloaded)
+		self._tag_matcher = plugins.tag_matcher
+		self._filename = None
+		self._lineno = 0
+		self._block = []
+
+	def line(self, filename, lineno, line):
+		for observer in self._line_observers:
+			observer.observe_line(filename, lineno, line)
+		if self._batch_observers:
+			block = self._block
+			if block and (filename != self._filename or
+			              lineno != self._lineno + len(block)):
+				self.flush()
+				block = self._block
+			if not block:
+				self._filename, self._lineno = filename, lineno
+			block.append(line)
+			if len(block) >= self.block_size:
+				self.flush()
+
+	def lines(self, filename, lineno, lines):
+		for observer in self._line_observers:
+			for offset, line in enumerate(lines):
+				observer.observe_line(filename, lineno + offset, line)
+		if self._batch_observers and lines:
+			self.flush()
+			for observer in self._batch_observers:
+				observer.observe_lines(filename, lineno, lines)
+
+	def comment(self, filename, lineno, line):
+		matched = self._tag_matcher.match_line(line)
+		if matched is not None:
+			plugin, tag, rest = matched
+			self.flush()
+			plugin.handle_tag(filename, lineno, tag, rest)
+
+	def tag(self, filename, lineno, tag, rest):
+		matched = self._tag_matcher.match_tag(tag)
+		if matched is not None:
+			plugin, tag = matched
+			self.flush()
+			plugin.handle_tag(filename, lineno, tag, rest)
+
+	def flush(self):
+		if self._block:
+			for observer in self._batch_observers:
+				observer.observe_lines(self._filename, self._lineno, self._block)
+			self._block = []
+
+	def finish(self):
+		"""Send what is left. What the offloaded plugins collected is
+		merged by offload.collect()."""
+		self.flush()
+		if self._offloaded is not None:
+			offloaded, self._offloaded = self._offloaded, None
+			offloaded.finish()
+
+	def close(self):
+		"""Stop the offloaded plugins without waiting for them."""
+		if self._offloaded is not None:
+			offloaded, self._offloaded = self._offloaded, None
+			offloaded.close()
+
+@contextlib.contextmanager
+def _observing(run_plugins, observers):
+	"""The observers to send plugin events to: None if we do not run
+	plugins, the ones we were given, or new ones we finish when done."""
+	if not run_plugins:
+		yield None
+	elif observers is not None:
+		yield observers
+	else:
+		observers = _Observers()
+		try:
+			yield observers
+		except BaseException:
+			# the scan did not finish, so nothing is summarized
+			observers.close()
+			raise
+		observers.finish()
+
+def flatten(filename, run_plugins = True, stack = None, dependencies = None,
+            observers = None, source_map = None):
 	"""
 	Recursively scan through files and yield all lines, 
 	essentially pretending that the recursive sequence of files
 	are a single sequence of lines.
+
+	If :dependencies is a set, every file the output depends on is
+	added to it: the files read, the figures referenced, and include
+	lines naming files that do not exist (yet). If :source_map is a
+	SourceMap, where each line came from is added to it.
 	"""
 	if stack is None:
-		stack = []
+		stack = IncludeStack()
+	if dependencies is not None:
+		dependencies.add(filename)
 	
-	with _add_to_stack(stack, filename) as stack, open(filename) as stream:
-		for lineno, line in enumerate(stream):
+	with _observing(run_plugins, observers) as observers, \
+			_add_to_stack(stack, filename) as stack, \
+			open(filename) as stream:
+		for lineno, line in enumerate(timing.timed_reads(filename, stream)):
 			# always get rid of trailing space (including newline)
 			line = line.rstrip()
 
-			if line.startswith('%%'): # comments
-				# See if we have a tag we can handle...
-				tag, *rest = line[2:].split(':', maxsplit = 1)
-				tag = tag.strip()
-				rest = "" if rest == [] else rest[0].strip()
+			kind, line = _process_line(
+				filename, lineno, line, observers, dependencies
+			)
+			if kind is _INCLUDE:
+				yield from flatten(
+					line, run_plugins, stack, dependencies, observers,
+					source_map
+				)
+				continue
+			if kind is _COMMENT:
+				continue
 
-				# Handle plugins
-				if run_plugins and tag in plugins.tag_plugins:
-					plugins.tag_plugins[tag].handle_tag(filename, lineno, tag, rest)
+			if observers is not None:
+				observers.line(filename, lineno, line)
+			if source_map is not None:
+				source_map.add(filename, lineno)
 				
-				# Whether we handled a tag or not, we do not
-				# yield a comment line.
-				continue
+			yield line
 
-			if line.startswith('//'): # A full path
-				subfile_full = line[1:].strip()
-				if os.path.isfile(subfile_full):
-					yield from flatten(subfile_full, stack)
-					continue
+def _rstrip_lines(prose):
+	return "\n".join([line.rstrip() for line in prose.split("\n")])
+
+def _segments(text, first_re, directive_re, decode):
+	"""
+	Split :text, the content of a file, into prose and directive
+	lines. Yields (lineno, text, is_directive) where prose segments
+	are runs of whole lines, newlines included and trailing space
+	removed, and directives are single lines without the newline.
+	"""
+	newline = b"\n" if isinstance(text[:0], bytes) else "\n"
+	first = first_re.match(text)
+	matches = directive_re.finditer(text)
+	if first is not None:
+		matches = itertools.chain([first], matches)
+
+	lineno = 0
+	pos = 0
+	for match in matches:
+		start = match.start(1)
+		if start > pos:
+			prose = text[pos:start]
+			yield lineno, _rstrip_lines(decode(prose)), False
+			lineno += prose.count(newline)
+		yield lineno, decode(match.group(1)).rstrip(), True
+		lineno += 1
+		pos = match.end(1) + 1 # skip the newline
+	if pos < len(text):
+		prose = _rstrip_lines(decode(text[pos:]))
+		if not prose.endswith("\n"):
+			prose += "\n"
+		yield lineno, prose, False
+
+def _utf8_locale():
+	encoding = locale.getpreferredencoding(False)
+	return codecs.lookup(encoding).name == "utf-8"
+
+@contextlib.contextmanager
+def _mapped_text(filename):
+	"""
+	The memory-mapped bytes of :filename and its file descriptor, if
+	the bytes are its text as we would read it: UTF-8 in a UTF-8
+	locale, without a lone carriage return, which text mode reads as
+	a newline. Otherwise None.
+	"""
+	with open(filename, "rb") as stream:
+		size = os.fstat(stream.fileno()).st_size
+		if size == 0 or not _utf8_locale():
+			yield None
+			return
+		with mmap.mmap(stream.fileno(), 0, access = mmap.ACCESS_READ) as buf:
+			if LONE_CR_BYTES_RE.search(buf) is None:
+				yield buf, stream.fileno()
+			else:
+				yield None
+
+@contextlib.contextmanager
+def _file_segments(filename):
+	"""
+	The segments of :filename. We scan the memory-mapped bytes when
+	we can, and otherwise the decoded text.
+	"""
+	with _mapped_text(filename) as mapped:
+		if mapped is not None:
+			buf, _ = mapped
+			segments = _segments(
+				buf, FIRST_DIRECTIVE_BYTES_RE, DIRECTIVE_BYTES_RE,
+				lambda data: data.decode("utf-8")
+			)
+			try:
+				yield segments
+			finally:
+				# release the regex scanner's hold on the buffer
+				# before the map is closed
+				segments.close()
+			return
+
+	with open(filename) as stream:
+		yield _segments(
+			stream.read(), FIRST_DIRECTIVE_RE, DIRECTIVE_RE, lambda data: data
+		)
+
+def flatten_chunks(filename, run_plugins = True, stack = None,
+                   dependencies = None, observers = None, source_map = None):
+	"""
+	The same as flatten, but yields chunks of text, each ending in a
+	newline, instead of lines. Each file is memory mapped and scanned
+	as a whole for the lines that need processing, and the prose
+	between them is passed on as a single chunk.
+	"""
+	if stack is None:
+		stack = IncludeStack()
+	if dependencies is not None:
+		dependencies.add(filename)
 
-			if line.startswith('/'): # A relative path
-				this_dir = os.path.dirname(filename)
-				subfile = line[1:].strip()
-				subfile_full = os.path.join(this_dir, subfile)
-				if os.path.isfile(subfile_full):
-					yield from flatten(subfile_full, stack)
+	with _observing(run_plugins, observers) as observers, \
+			_add_to_stack(stack, filename) as stack, \
+			_file_segments(filename) as segments:
+		segments = timing.timed_reads(filename, segments)
+		for lineno, text, is_directive in segments:
+			if is_directive:
+				kind, text = _process_line(
+					filename, lineno, text, observers, dependencies
+				)
+				if kind is _INCLUDE:
+					yield from flatten_chunks(
+						text, run_plugins, stack, dependencies, observers,
+						source_map
+					)
 					continue
+				if kind is _COMMENT:
+					continue
+				text += "\n"
 
-			if line.startswith('!['): # A figure
-				match = FIGURE_RE.match(line)
-				if match is not None:
-					figlabel = match.group(1)
-					figfile = match.group(2)
-					trailing = match.group(3)
-					if figfile.startswith('/'):
-						# global path, do nothing
-						pass
-					else:
-						# local filename, adjust to input file
-						filedir = os.path.dirname(filename)
-						figfile = os.path.join(filedir, figfile)
-						line = "![{figlabel}]({figfile}){trailing}".format(
-								figlabel=figlabel,
-								figfile=figfile,
-								trailing=trailing
-						)						
-				# do not continue, we want the figure text to be
-				# included in the summaries
-
-			if run_plugins:
-				for observer in plugins.observer_plugins:
-					observer.observe_line(filename, lineno, line)
-				
-			yield line
+			if observers is not None:
+				lines = text.split("\n")
+				lines.pop() # the empty string after the last newline
+				observers.lines(filename, lineno, lines)
+			if source_map is not None:
+				source_map.add(filename, lineno, text.count("\n"))
+
+			yield text
+
+# Bytes start to end of a file, memory mapped as buffer and open as
+# the descriptor fileno, to be passed on as they are. Both are only
+# open until we move on to the next chunk.
+MappedRange = collections.namedtuple(
+	"MappedRange", ["buffer", "fileno", "start", "end"]
+)
+
+def _trailing_space(buf, line, end):
+	"""Where the trailing space of the line from :line to :end in
+	:buf starts."""
+	stop = line + len(buf[line:end].rstrip(_ASCII_SPACE))
+	if stop > line and buf[stop - 1] >= 0x80:
+		match = TRAILING_SPACE_BYTES_RE.search(buf, line, stop)
+		if match is not None:
+			stop = match.start()
+	return stop
+
+def _prose_ranges(buf, start, end):
+	"""
+	The ranges of the prose from :start to :end in :buf that are left
+	when the trailing space of each line is removed. We only look
+	closer at lines that end in a byte that may be space.
+	"""
+	base = start
+	marks = buf[start:end].translate(_SPACE_MARKS)
+	ends = []
+	candidate = marks.find(b"\x01\n")
+	while candidate >= 0:
+		ends.append(candidate + 1)
+		candidate = marks.find(b"\x01\n", candidate + 2)
+	if marks.endswith(b"\x01"):
+		ends.append(len(marks))
+
+	ranges = []
+	for line_end in ends:
+		line = marks.rfind(b"\n", 0, line_end) + 1
+		stop = _trailing_space(buf, base + line, base + line_end)
+		if stop < base + line_end:
+			ranges.append((start, stop))
+			start = base + line_end
+	ranges.append((start, end))
+	return ranges
+
+def _mapped_chunks(filename, buf, fileno, stack, dependencies):
+	"""flatten_bytes, without plugins, for a file we could map."""
+	first = FIRST_DIRECTIVE_BYTES_RE.match(buf)
+	matches = DIRECTIVE_BYTES_RE.finditer(buf)
+	if first is not None:
+		matches = itertools.chain([first], matches)
+	matches = timing.timed_reads(filename, matches)
+
+	pos = 0
+	try:
+		for match in itertools.chain(matches, [None]):
+			end = len(buf) if match is None else match.start(1)
+			if end > pos:
+				ranges = _prose_ranges(buf, pos, end)
+				if len(ranges) == 1:
+					yield MappedRange(buf, fileno, pos, end)
+					ends_line = buf[end - 1] == ord("\n")
+				else:
+					# a copy, with the trailing space left out
+					prose = b"".join([
+						buf[start:stop] for start, stop in ranges
+					])
+					yield prose
+					ends_line = prose.endswith(b"\n")
+				if match is None and not ends_line:
+					yield b"\n" # for the last line
+			if match is None:
+				break
+
+			line = match.group(1).decode("utf-8").rstrip()
+			pos = match.end(1) + 1 # skip the newline
+			# without observers, the line number is not used
+			kind, line = _process_line(
+				filename, None, line, None, dependencies
+			)
+			if kind is _INCLUDE:
+				yield from flatten_bytes(line, False, stack, dependencies)
+			elif kind is _LINE:
+				yield (line + "\n").encode("utf-8")
+	finally:
+		# release the regex scanner's hold on the buffer before the
+		# map is closed
+		matches = None
+
+def _encoded(chunks):
+	"""The text :chunks as a text stream would write them."""
+	encoding = locale.getpreferredencoding(False)
+	for chunk in chunks:
+		yield chunk.replace("\n", os.linesep).encode(encoding)
+
+def flatten_bytes(filename, run_plugins = True, stack = None,
+                  dependencies = None, observers = None, source_map = None):
+	"""
+	The same as flatten_chunks, but yields the output as a text stream
+	would write it to a command's stdin: chunks of bytes in the
+	locale's encoding. Without plugins or a source map, which need the
+	text, the prose of the files we can map is never decoded. It is
+	yielded as MappedRanges, which can be sent on without copying,
+	unless we remove trailing space from it, and only the lines we
+	rewrite are encoded.
+	"""
+	if stack is None:
+		stack = IncludeStack()
+
+	if not run_plugins and source_map is None and os.linesep == "\n":
+		with _mapped_text(filename) as mapped:
+			if mapped is not None:
+				if dependencies is not None:
+					dependencies.add(filename)
+				with _add_to_stack(stack, filename) as stack:
+					yield from _mapped_chunks(
+						filename, *mapped, stack, dependencies
+					)
+				return
+
+	yield from _encoded(flatten_chunks(
+		filename, run_plugins, stack, dependencies, observers, source_map
+	))
+
+ParsedFile = collections.namedtuple(
+	"ParsedFile", ["filename", "tokens", "dependencies", "include_lines"]
+)
+
+def parse_file(filename):
+	"""
+	Read and tokenize a single file without following its includes
+	or running plugins. The tokens are (_LINE, lineno, lines) for runs
+	of consecutive output lines, (_TAG, lineno, tag, rest) for comments
+	and (_INCLUDE, lineno, filename) for included files. We also keep
+	every line that looks like an include, and what it resolved to,
+	so we can tell if that changes.
+	"""
+	tokens = []
+	dependencies = set()
+	include_lines = []
+	block = None
+	with open(filename) as stream:
+		for lineno, line in enumerate(stream):
+			line = line.rstrip()
+			if line.startswith('%%'):
+				tokens.append((_TAG, lineno) + _parse_tag(line))
+				block = None
+				continue
+
+			kind, processed = _process_line(
+				filename, lineno, line, None, dependencies
+			)
+			if kind is _INCLUDE:
+				include_lines.append((line, processed))
+				tokens.append((_INCLUDE, lineno, processed))
+				block = None
+				continue
+
+			if line.startswith('/'):
+				include_lines.append((line, None))
+			if block is not None:
+				block.append(processed)
+			else:
+				block = [processed]
+				tokens.append((_LINE, lineno, block))
+	return ParsedFile(filename, tokens, sorted(dependencies), include_lines)
+
+def _parse_file_timed(filename):
+	start = time.perf_counter()
+	parsed_file = parse_file(filename)
+	return parsed_file, time.perf_counter() - start
+
+def includes_unchanged(parsed_file):
+	"""Check that the include lines in :parsed_file still refer to
+	the files they did when it was parsed."""
+	return all(
+		_resolve_include(parsed_file.filename, line) == subfile
+		for line, subfile in parsed_file.include_lines
+	)
+
+def parse_include_graph(filename, jobs = None, cache = None):
+	"""
+	Parse :filename and all the files it includes, directly or
+	indirectly, in a pool of :jobs processes. Files are sent to the
+	pool as soon as an already parsed file is found to include them.
+	Files the :cache has are taken from there, and newly parsed files
+	are added to it. Returns a dictionary from file names to ParsedFile.
+	"""
+	parsed = {}
+	submitted = set()
+	pending = set()
+
+	def add(parsed_file):
+		parsed[parsed_file.filename] = parsed_file
+		for token in parsed_file.tokens:
+			if token[0] == _INCLUDE:
+				visit(token[2])
+
+	def visit(name):
+		if name in submitted:
+			return
+		submitted.add(name)
+		parsed_file = None if cache is None else cache.get(name)
+		if parsed_file is None:
+			pending.add(pool.submit(_parse_file_timed, name))
+		else:
+			add(parsed_file)
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as pool:
+		visit(filename)
+		while pending:
+			done, _ = concurrent.futures.wait(
+				pending, return_when = concurrent.futures.FIRST_COMPLETED
+			)
+			for future in done:
+				pending.remove(future)
+				parsed_file, seconds = future.result()
+				if timing.current is not None:
+					timing.current.add_file_read(parsed_file.filename, seconds)
+				if cache is not None:
+					cache.put(parsed_file)
+				add(parsed_file)
+	return parsed
+
+def flatten_parsed(filename, parsed, run_plugins = True, stack = None,
+                   dependencies = None, observers = None, source_map = None):
+	"""
+	The same as flatten, but working from the parsed files we get
+	from looking up file names in :parsed. Plugins see the events
+	in document order.
+	"""
+	if stack is None:
+		stack = IncludeStack()
+
+	start = time.perf_counter()
+	parsed_file = parsed[filename]
+	if timing.current is not None:
+		timing.current.add_file_read(filename, time.perf_counter() - start)
+	if dependencies is not None:
+		dependencies.add(filename)
+		dependencies.update(parsed_file.dependencies)
+
+	with _observing(run_plugins, observers) as observers, \
+			_add_to_stack(stack, filename) as stack:
+		for token in parsed_file.tokens:
+			kind, lineno = token[0], token[1]
+			if kind == _LINE:
+				if observers is not None:
+					observers.lines(filename, lineno, token[2])
+				if source_map is not None:
+					source_map.add(filename, lineno, len(token[2]))
+				yield from token[2]
+			elif kind == _INCLUDE:
+				yield from flatten_parsed(
+					token[2], parsed, run_plugins, stack, dependencies,
+					observers, source_map
+				)
+			elif observers is not None: # _TAG
+				observers.tag(filename, lineno, token[2], token[3])
+
+def flatten_parallel(filename, jobs = None, run_plugins = True,
+                     dependencies = None, cache = None, observers = None,
+                     source_map = None):
+	"""
+	The same as flatten, but the files are read and tokenized in
+	parallel, in a pool of :jobs processes, before we yield any lines.
+	"""
+	parsed = parse_include_graph(filename, jobs, cache)
+	return flatten_parsed(
+		filename, parsed, run_plugins, dependencies = dependencies,
+		observers = observers, source_map = source_map
+	)
@@ -0,0 +1,123 @@
+"""
+The include graph of a document: the files each file includes and
+the figures it refers to, found without flattening the document.
+"""
+
+import os
+import re
+import json
+import collections
+
+from . import artifact
+from . import flatten
+
+# The only lines that can include a file or refer to a figure
+INDEXED_RE = re.compile(r"^(?:/|!\[)[^\n]*", re.MULTILINE)
+
+FileIndex = collections.namedtuple(
+    "FileIndex", ["includes", "figures", "missing"]
+)
+
+
+def index_file(filename):
+    """The files :filename includes, the figures it refers to, and
+    the include candidates that do not exist (yet), in the order they
+    appear. Only the lines that can include a file or show a figure
+    are looked at."""
+    includes, figures, missing = [], [], []
+    with open(filename) as stream:
+        text = stream.read()
+    for match in INDEXED_RE.finditer(text):
+        line = match.group().rstrip()
+        if line.startswith('/'):
+            tried = set()
+            subfile = flatten._resolve_include(filename, line, tried)
+            missing.extend(sorted(tried))
+            if subfile is not None:
+                includes.append(subfile)
+            continue
+        figure = flatten.FIGURE_RE.match(line)
+        if figure is not None:
+            figures.append(flatten._figure_file(filename, figure.group(2)))
+    return FileIndex(includes, figures, missing)
+
+
+class IncludeGraph:
+    """The files included from :root, directly or indirectly, in the
+    order flatten reads them, each with its FileIndex."""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+
+    def dependencies(self):
+        """Every file the flattened document depends on: the files
+        read, the figures, and include candidates that do not exist
+        (yet). The same files flatten collects while it runs."""
+        dependencies = set(self.files)
+        for index in self.files.values():
+            dependencies.update(index.figures)
+            dependencies.update(index.missing)
+        return dependencies
+
+    def as_dict(self):
+        return {
+            "root": self.root,
+            "dependencies": sorted(self.dependencies()),
+            "files": {
+                filename: index._asdict()
+                for filename, index in self.files.items()
+            },
+        }
+
+
+def build_graph(root):
+    """Index :root and every file it includes. Raises a
+    CircularInclusionError if a file ends up including itself."""
+    graph = IncludeGraph(root)
+    if artifact.is_artifact(root):
+        # what is built from an artifact only depends on the artifact
+        graph.files[root] = FileIndex([], [], [])
+        return graph
+
+    def visit(filename, stack):
+        with flatten._add_to_stack(stack, filename):
+            if filename in graph.files:
+                # already explored, and no cycles below it
+                return
+            graph.files[filename] = index = index_file(filename)
+            for subfile in index.includes:
+                visit(subfile, stack)
+
+    visit(root, flatten.IncludeStack())
+    return graph
+
+
+def _make_escape(filename):
+    return (filename.replace("$", "$$").replace("#", "\\#")
+            .replace(" ", "\\ "))
+
+
+def write_make(graph, targets, outfile, phony = False):
+    """Write a Makefile rule making :targets depend on everything in
+    :graph that exists. Ninja reads this format as well. Include
+    candidates and figures that do not exist are left out, as make has
+    no rule to make them. With :phony, every dependency also gets an
+    empty rule of its own, so make does not fail when one of them is
+    removed."""
+    dependencies = sorted(
+        d for d in graph.dependencies() if os.path.exists(d)
+    )
+    lines = ["{}:".format(" ".join(_make_escape(t) for t in targets))]
+    lines.extend(" " + _make_escape(d) for d in dependencies)
+    outfile.write(" \\\n".join(lines) + "\n")
+    if phony:
+        for dependency in dependencies:
+            outfile.write("\n{}:\n".format(_make_escape(dependency)))
+
+
+def write_json(graph, targets, outfile):
+    report = graph.as_dict()
+    report["targets"] = list(targets)
+    json.dump(report, outfile, indent=2)
+    print(file=outfile)
@@ -0,0 +1,85 @@
+"""
+Build manifests: recording what went into building a target so
+targets that are already up to date can be skipped.
+"""
+
+import os
+import json
+import hashlib
+
+CACHE_DIR = ".premd-cache"
+MANIFEST_FILE = "manifest.json"
+
+
+def cache_dir(root_dir):
+    """The directory where premd keeps cached data for a project."""
+    return os.path.join(root_dir, CACHE_DIR)
+
+
+def file_hash(filename):
+    """Hash of the content of :filename, or None if it cannot be read."""
+    try:
+        with open(filename, 'rb') as stream:
+            return hashlib.sha256(stream.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def config_hash(config):
+    """Hash of a (possibly nested) configuration dictionary."""
+    dump = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+class BuildManifest:
+    """The files, command line and configuration each target was
+    last built from."""
+
+    def __init__(self, root_dir):
+        self.filename = os.path.join(cache_dir(root_dir), MANIFEST_FILE)
+        try:
+            with open(self.filename) as stream:
+                self.targets = json.load(stream)
+        except (OSError, ValueError):
+            self.targets = {}
+
+    def is_current(self, target, cmdline, config, figures = None):
+        """Check if :target exists and was built by :cmdline with
+        :config and figures prepared as :figures says, from files
+        that have not changed since."""
+        entry = self.targets.get(os.path.abspath(target))
+        if entry is None or not os.path.exists(target):
+            return False
+        if entry["cmdline"] != cmdline or entry["config"] != config_hash(config):
+            return False
+        if entry.get("figures") != figures:
+            return False
+        return all(
+            file_hash(filename) == digest
+            for filename, digest in entry["files"].items()
+        )
+
+    def record(self, target, cmdline, config, dependencies, figures = None):
+        """Remember that :target was built from :dependencies."""
+        self.targets[os.path.abspath(target)] = {
+            "cmdline": cmdline,
+            "config": config_hash(config),
+            "figures": figures,
+            "files": {
+                os.path.abspath(filename): file_hash(filename)
+                for filename in sorted(dependencies)
+            }
+        }
+
+    def forget(self, target):
+        self.targets.pop(os.path.abspath(target), None)
+
+    def save(self):
+        """Write the manifest, if we can. Without it the targets are
+        just built again next time."""
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(self.filename, 'w') as stream:
+                json.dump(self.targets, stream, indent=1, sort_keys=True)
+        except OSError:
+            pass
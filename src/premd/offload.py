@@ -0,0 +1,182 @@
+"""
+Running CPU-heavy observer plugins in worker processes. An observer
+plugin that sets offloadable = True, and can merge what it collects,
+gets the lines in blocks through a queue to a process of its own, so
+flattening and writing the output never wait for it. What it collected
+is merged into the plugin in this process by collect(), which we call
+before anything is summarized, once the output is written.
+"""
+
+import queue
+
+from . import plugin
+from . import records
+from .plugin import plugins
+
+_enabled = True
+# The offloaded plugins that have been sent all their lines, and what
+# they collected has not been merged yet
+_pending = []
+
+
+def enable(enabled = True):
+    """Offload the plugins that allow it, or run all of them in this
+    process if :enabled is False."""
+    global _enabled
+    _enabled = enabled
+
+
+def offloadable(p):
+    """Can the plugin :p run in a worker process? Tag plugins cannot,
+    since they are not sent the lines."""
+    return (getattr(p, "offloadable", False)
+            and isinstance(p, plugin.MergeableSummaryPlugin)
+            and isinstance(p, (plugin.ObserverPlugin,
+                               plugin.BatchObserverPlugin))
+            and not isinstance(p, plugin.TagPlugin))
+
+
+def offloaded_names():
+    """The names of the plugins we run in worker processes."""
+    if not _enabled:
+        return []
+    return [name for name, p in plugins.plugins.items() if offloadable(p)]
+
+
+class OffloadError(Exception):
+    def __init__(self, name, error):
+        super().__init__(
+            "The {} plugin failed in its worker process: {}".format(
+                name, error
+            )
+        )
+
+
+def _worker(name, low_memory, inbox, outbox):
+    """Run a fresh instance of the plugin :name on the blocks of lines
+    from :inbox until it sends None, then send what it collected back
+    through :outbox."""
+    try:
+        records.enable(low_memory)
+        plugins.reset()
+        observer = plugins.plugins[name]
+        if isinstance(observer, plugin.BatchObserverPlugin):
+            for filename, lineno, lines in iter(inbox.get, None):
+                observer.observe_lines(filename, lineno, lines)
+        else:
+            for filename, lineno, lines in iter(inbox.get, None):
+                for offset, line in enumerate(lines):
+                    observer.observe_line(filename, lineno + offset, line)
+        outbox.put((name, observer.partial_state(), None))
+    except Exception as ex:
+        outbox.put((name, None, repr(ex)))
+
+
+class OffloadedObservers:
+    """Stands in for the plugins :names as a batch observer: each of
+    them runs in a worker process and is sent the blocks of lines we
+    observe. The queues do not block, so we never wait for a worker
+    before collect()."""
+
+    def __init__(self, names):
+        import multiprocessing # slow to import, and only needed here
+        # what we merge into, even if the plugins are reset meanwhile
+        self._plugins = {
+            name: plugins.summary_plugins[name] for name in names
+        }
+        self._outbox = multiprocessing.Queue()
+        self._workers = []
+        for name in names:
+            inbox = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_worker, daemon=True,
+                args=(name, records.enabled(), inbox, self._outbox)
+            )
+            process.start()
+            self._workers.append((name, inbox, process))
+
+    def observe_lines(self, filename, lineno, lines):
+        for _, inbox, _ in self._workers:
+            inbox.put((filename, lineno, lines))
+
+    def finish(self):
+        """Tell the workers they have seen every line. We do not wait
+        for them; collect() does."""
+        for _, inbox, _ in self._workers:
+            inbox.put(None)
+        _pending.append(self)
+
+    def _collect(self):
+        """Wait for the workers, and merge what they collected into
+        the plugins. Raises an OffloadError if a worker failed."""
+        results = {}
+        while len(results) < len(self._workers):
+            try:
+                name, state, error = self._outbox.get(timeout=0.1)
+                results[name] = state, error
+                continue
+            except queue.Empty:
+                pass
+            dead = [
+                (name, process) for name, _, process in self._workers
+                if name not in results and not process.is_alive()
+            ]
+            # what a worker sent is in the queue before it exits
+            try:
+                while True:
+                    name, state, error = self._outbox.get_nowait()
+                    results[name] = state, error
+            except queue.Empty:
+                pass
+            for name, process in dead:
+                if name not in results:
+                    results[name] = None, "exit status {}".format(
+                        process.exitcode
+                    )
+        for name, inbox, process in self._workers:
+            if results[name][1] is not None:
+                # nobody reads what is left for the worker that failed
+                inbox.cancel_join_thread()
+            process.join()
+        self._workers = []
+
+        # merged in the order of the plugins, whichever finished first
+        for name in sorted(results, key=list(self._plugins).index):
+            state, error = results[name]
+            if error is not None:
+                raise OffloadError(name, error)
+            self._plugins[name].merge_state(state)
+
+    def close(self):
+        """Stop the workers, throwing away what they collected."""
+        if self in _pending:
+            _pending.remove(self)
+        for _, inbox, process in self._workers:
+            inbox.cancel_join_thread()
+            process.terminate()
+        for _, _, process in self._workers:
+            process.join()
+        self._workers = []
+
+
+def collect():
+    """Wait for the offloaded plugins that have seen all their lines,
+    and merge what they collected into the plugins. Call it before
+    summarizing, and after closing the output, so whatever reads the
+    output does not wait for the plugins. Raises an OffloadError if a
+    worker failed."""
+    while _pending:
+        offloaded = _pending.pop(0)
+        try:
+            offloaded._collect()
+        except BaseException:
+            for other in list(_pending):
+                other.close()
+            raise
+
+
+def discard():
+    """Stop the offloaded plugins still waiting to be collected, as
+    when their build failed."""
+    for offloaded in list(_pending):
+        offloaded.close()
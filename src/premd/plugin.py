@@ -2,10 +2,25 @@
 Defining plugin protocols
 """
 
+import os
+import sys
+import re
 import abc
+import json
+import importlib
 import collections
 
 class TagPlugin(abc.ABC):
+	"""Handles the tags in comment lines, "%% TAG: the rest". The tags
+	a plugin handles are the :supported_tags, or its name if it has
+	none, the :tag_aliases, which it sees as the tag they map to, and
+	the tags the regular expressions in :tag_patterns match. With
+	:tag_ignore_case, the case of the tags does not matter. A tag is
+	what comes before the first ':', so patterns should not match one."""
+	tag_ignore_case = False
+	tag_aliases = {}
+	tag_patterns = []
+
 	@abc.abstractmethod
 	def handle_tag(self, file, lineno, content):
 		pass
@@ -15,72 +30,283 @@ class SummaryPlugin(abc.ABC):
     def summarize(self, outfile):
         pass
 
+class MergeableSummaryPlugin(SummaryPlugin):
+    """A summary plugin that can summarize a document in parts. What
+    it collects from one part, as partial_state() returns it, can be
+    pickled and merged, in document order, into the state of the
+    plugin that saw the parts before it."""
+    @abc.abstractmethod
+    def partial_state(self):
+        pass
+
+    @abc.abstractmethod
+    def merge_state(self, state):
+        pass
+
 class ObserverPlugin(abc.ABC):
     @abc.abstractmethod
     def observe_line(self, filename, lineno, line):
         pass
 
+class BatchObserverPlugin(abc.ABC):
+    """Observes blocks of consecutive lines from the same file, the
+    first of them at :lineno, instead of one line at a time."""
+    @abc.abstractmethod
+    def observe_lines(self, filename, lineno, lines):
+        pass
+
+
+class TagMatcher:
+    """All the tags the tag plugins handle, compiled into a single
+    regular expression, so a comment line is classified in one pass
+    and comments without a tag we handle are dropped cheaply."""
+
+    def __init__(self, tag_plugins):
+        """:tag_plugins is a list of (tag plugin, its tags); when two
+        plugins handle a tag, the last one gets it."""
+        self._groups = []
+        alternatives = []
+        for index, (plugin, tags) in enumerate(reversed(tag_plugins)):
+            ignore_case = getattr(plugin, "tag_ignore_case", False)
+            aliases = dict(getattr(plugin, "tag_aliases", {}))
+            patterns = list(getattr(plugin, "tag_patterns", []))
+            names = sorted(set(tags) | set(aliases), key = len, reverse = True)
+            tag_re = "|".join([re.escape(name) for name in names] + patterns)
+            if not tag_re:
+                continue
+            if ignore_case:
+                tag_re = "(?i:{})".format(tag_re)
+                aliases = {
+                    alias.casefold(): tag for alias, tag in aliases.items()
+                }
+            group = "p{}".format(index)
+            alternatives.append("(?P<{}>{})".format(group, tag_re))
+            self._groups.append((group, plugin, ignore_case, aliases))
+        tags_re = "|".join(alternatives) or "(?!)"
+        self._tag_re = re.compile(r"\s*(?:{})\s*".format(tags_re))
+        self._line_re = re.compile(
+            r"%%\s*(?:{})\s*(?::(?P<rest>.*))?".format(tags_re)
+        )
+
+    def _classify(self, match):
+        for group, plugin, ignore_case, aliases in self._groups:
+            tag = match.group(group)
+            if tag is not None:
+                if aliases:
+                    tag = aliases.get(
+                        tag.casefold() if ignore_case else tag, tag
+                    )
+                return plugin, tag
+        return None, None
+
+    def match_line(self, line):
+        """The plugin handling the tag in the comment :line, the tag
+        and the rest of the line, or None if no plugin handles it."""
+        match = self._line_re.fullmatch(line)
+        if match is None:
+            return None
+        plugin, tag = self._classify(match)
+        rest = match.group("rest")
+        return plugin, tag, "" if rest is None else rest.strip()
+
+    def match_tag(self, tag):
+        """The plugin handling :tag, a tag already split from its
+        comment line, and the tag it sees, or None."""
+        match = self._tag_re.fullmatch(tag)
+        if match is None:
+            return None
+        return self._classify(match)
+
+
+ENTRY_POINT_GROUP = "premd.plugins"
+
+
+def _cache_file():
+    cache_home = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    return os.path.join(cache_home, "premd", "entry_points.json")
+
+
+def _path_key():
+    """Something that changes when packages are installed or removed:
+    the modification time of every directory on the path."""
+    key = [sys.executable]
+    for path in sys.path:
+        try:
+            key.append([path, os.stat(path or ".").st_mtime_ns])
+        except OSError:
+            pass
+    return key
+
+
+def _scan_entry_points():
+    from importlib import metadata
+    try:
+        entry_points = metadata.entry_points(group = ENTRY_POINT_GROUP)
+    except TypeError: # Python < 3.10
+        entry_points = metadata.entry_points().get(ENTRY_POINT_GROUP, [])
+    return [[entry_point.name, entry_point.value] for entry_point in entry_points]
+
+
+def _entry_points(use_cache = True):
+    """Get (name, "module:attribute") for all plugins, from the
+    on-disk cache when nothing was installed since we wrote it."""
+    cache_file = _cache_file()
+    key = _path_key()
+    if use_cache:
+        try:
+            with open(cache_file) as stream:
+                cache = json.load(stream)
+            if cache["key"] == key:
+                return cache["entry_points"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    entry_points = _scan_entry_points()
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok = True)
+        with open(cache_file, "w") as stream:
+            json.dump({"key": key, "entry_points": entry_points}, stream)
+    except OSError:
+        pass # we can live without a cache
+    return entry_points
+
+
+def _load_entry_point(value):
+    module_name, _, attributes = value.partition(":")
+    obj = importlib.import_module(module_name.strip())
+    for attribute in attributes.strip().split("."):
+        if attribute:
+            obj = getattr(obj, attribute)
+    return obj
+
 
 class _Plugins:
+    """The installed plugins. Nothing is imported or instantiated
+    until a command asks for the plugins."""
+
     def __init__(self):
-        self._collect_plugins()
+        self._plugin_classes = None
+        self._plugins = None
+        self._wrap = None
 
     def _load_plugins(self):
         """Method to guarantee that we only instanciate a plugin class once."""
-        
-        from pkg_resources import iter_entry_points
+        try:
+            self._plugin_classes = {
+                name : _load_entry_point(value)
+                for name, value in _entry_points()
+            }
+        except (ImportError, AttributeError):
+            # the cache refers to something that is gone; scan again
+            self._plugin_classes = {
+                name : _load_entry_point(value)
+                for name, value in _entry_points(use_cache = False)
+            }
+        self._instantiate_plugins()
+
+    def _instantiate_plugins(self):
         self._plugins = {
-            entry_point.name : entry_point.load()()
-            for entry_point in iter_entry_points(group = "premd.plugins")
+            name : plugin_class()
+            for name, plugin_class in self._plugin_classes.items()
         }
         
-    def _collect_tag_plugins(self):
+    def _handed_out(self):
+        """The plugins as we hand them out, wrapped if we were asked to."""
+        if self._wrap is None:
+            return self._plugins
+        return {
+            name: self._wrap(name, plugin)
+            for name, plugin in self._plugins.items()
+        }
+
+    def _collect_tag_plugins(self, handed_out):
         self._tag_plugins = {}
+        matched = []
         for name, plugin in self._plugins.items():
             if not isinstance(plugin, TagPlugin):
                 continue
             try:
-                for tag in plugin.supported_tags:
-                    self._tag_plugins[tag] = plugin   
+                tags = list(plugin.supported_tags)
             except:
-                self._tag_plugins[name] = plugin            
+                tags = [name]
+            for tag in tags + list(plugin.tag_aliases):
+                self._tag_plugins[tag] = handed_out[name]
+            matched.append((handed_out[name], tags))
+        self._tag_matcher = TagMatcher(matched)
 
-    def _collect_summary_plugins(self):
+    def _collect_summary_plugins(self, handed_out):
         self._summary_plugins = {
-            name: plugin 
+            name: handed_out[name]
             for name, plugin in self._plugins.items()
             if isinstance(plugin, SummaryPlugin)
         }
 
-    def _collect_observer_plugins(self):
+    def _collect_observer_plugins(self, handed_out):
         self._observer_plugins = {
-            plugin 
-            for plugin in self._plugins.values()
+            handed_out[name]
+            for name, plugin in self._plugins.items()
             if isinstance(plugin, ObserverPlugin)
+            and not isinstance(plugin, BatchObserverPlugin)
+        }
+        self._batch_observer_plugins = {
+            handed_out[name]
+            for name, plugin in self._plugins.items()
+            if isinstance(plugin, BatchObserverPlugin)
         }
 
     def _collect_plugins(self):
-        self._load_plugins()
-        self._collect_tag_plugins()
-        self._collect_observer_plugins()
-        self._collect_summary_plugins()
+        handed_out = self._handed_out()
+        self._collect_tag_plugins(handed_out)
+        self._collect_observer_plugins(handed_out)
+        self._collect_summary_plugins(handed_out)
+
+    def instrument(self, wrap):
+        """Hand out :wrap(name, plugin) instead of each plugin, or
+        the plugins themselves again if :wrap is None."""
+        self._wrap = wrap
+        if self._plugins is not None:
+            self._collect_plugins()
+
+    def _loaded(self):
+        if self._plugins is None:
+            self._load_plugins()
+            self._collect_plugins()
+        return self
+
+    def reset(self):
+        """Replace all plugins with fresh instances, discarding
+        what they have collected so far."""
+        if self._plugins is None:
+            return # nothing collected yet
+        self._instantiate_plugins()
+        self._collect_plugins()
 
     @property
     def plugins(self):
-        return self._plugins
+        return self._loaded()._plugins
     
    
     @property
     def tag_plugins(self):
-        return self._tag_plugins
+        return self._loaded()._tag_plugins
+
+    @property
+    def tag_matcher(self):
+        return self._loaded()._tag_matcher
 
     @property
     def observer_plugins(self):
-        return self._observer_plugins
+        return self._loaded()._observer_plugins
+
+    @property
+    def batch_observer_plugins(self):
+        return self._loaded()._batch_observer_plugins
     
 
     @property
     def summary_plugins(self):
-        return self._summary_plugins
+        return self._loaded()._summary_plugins
 
 plugins = _Plugins()
\ No newline at end of file
@@ -1,35 +1,112 @@
 
 import collections
 from .. import plugin
+from .. import records
 
 from termcolor import colored
 
-class FIXME(plugin.TagPlugin, plugin.SummaryPlugin):
+TAGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS tags (
+    file INTEGER, lineno INTEGER, tag TEXT, message TEXT,
+    PRIMARY KEY (file, lineno)
+);
+"""
+
+class TagRecords:
+    """The tags FIXME collects, kept in a record store instead of in
+    memory. As with the dictionaries, files come in the order we first
+    saw them, and a line we see again keeps its place."""
+    def __init__(self, filename = None):
+        self.store = records.RecordStore(TAGS_SCHEMA, filename)
+        self._filename = None
+        self._file_id = None
+
+    def _file_id_of(self, filename):
+        if filename != self._filename:
+            self.store.execute(
+                "INSERT OR IGNORE INTO files (name) VALUES (?)", (filename,)
+            )
+            self._file_id, = self.store.execute(
+                "SELECT id FROM files WHERE name = ?", (filename,)
+            )
+            self._filename = filename
+        return self._file_id
+
+    def add(self, filename, lineno, tag, message):
+        self.store.write(
+            """INSERT INTO tags VALUES (?, ?, ?, ?)
+               ON CONFLICT (file, lineno) DO UPDATE
+               SET tag = excluded.tag, message = excluded.message""",
+            (self._file_id_of(filename), lineno, tag, message)
+        )
+
+    def __iter__(self):
+        return iter(self.store.query(
+            """SELECT files.name, tags.lineno, tags.tag, tags.message
+               FROM tags JOIN files ON files.id = tags.file
+               ORDER BY tags.file, tags.rowid"""
+        ))
+
+
+class FIXME(plugin.TagPlugin, plugin.MergeableSummaryPlugin):
     """FIXMEs in document"""
-    supported_tags = [
-        "FIXME", "Fixme", "fixme",
-        "TODO", "Todo", "todo"
-    ]
+    supported_tags = ["FIXME", "TODO"]
+    tag_aliases = {
+        "Fixme": "FIXME", "fixme": "FIXME",
+        "Todo": "TODO", "todo": "TODO",
+    }
 
     def __init__(self):
         self.files = collections.OrderedDict()
+        self.tag_records = TagRecords() if records.enabled() else None
 
     def file_lines(self, filename):
         return self.files.setdefault(filename, collections.OrderedDict())
 
     def handle_tag(self, filename, lineno, tag, message):
-        self.file_lines(filename)[lineno] = tag, message
+        if self.tag_records is not None:
+            self.tag_records.add(filename, lineno, tag, message)
+        else:
+            self.file_lines(filename)[lineno] = tag, message
+
+    def tags(self):
+        """(filename, lineno, tag, message) for each tag, in order."""
+        if self.tag_records is not None:
+            return iter(self.tag_records)
+        return (
+            (filename, lineno, tag, message)
+            for filename, lines in self.files.items()
+            for lineno, (tag, message) in lines.items()
+        )
+
+    def partial_state(self):
+        if self.tag_records is not None:
+            # hand over the database instead of everything in it
+            return self.tag_records.store.detach()
+        return self.files
+
+    def merge_state(self, state):
+        if isinstance(state, str):
+            other = TagRecords(state)
+            try:
+                for tag in other:
+                    self.handle_tag(*tag)
+            finally:
+                other.store.close()
+            return
+        for filename, lines in state.items():
+            self.file_lines(filename).update(lines)
 
     def summarize(self, outfile):
-        for filename, lines in self.files.items():
-            for lineno, (tag, message) in lines.items():
-                    lineinfo = "{filename} ({lineno})".format(
-                        filename = filename, lineno = lineno
-                    )
-                    print(
-                        colored("▶", "red"),
-                        colored("{:6}:".format(tag.upper()), attrs = ["bold"]),
-                        colored(lineinfo, attrs = ["underline", "dark"]), ":",
-                        message,
-                        file = outfile
-                    )
+        for filename, lineno, tag, message in self.tags():
+            lineinfo = "{filename} ({lineno})".format(
+                filename = filename, lineno = lineno
+            )
+            print(
+                colored("▶", "red"),
+                colored("{:6}:".format(tag.upper()), attrs = ["bold"]),
+                colored(lineinfo, attrs = ["underline", "dark"]), ":",
+                message,
+                file = outfile
+            )
@@ -1,107 +1,212 @@
-import collections
+import re
+import array
 from .. import plugin
+from .. import records
 
-class Section:
-    def __init__(self, level, label):
-        self.level = level
-        self.label = label
-        self.parent = None
-        self.sibling = None
-        self.first_child = None
-        self.last_child = None
-        self._word_count = 0
-
-    @property
-    def word_count(self):
-        total_count = self._word_count
-        child = self.first_child
-        while child is not None:
-            total_count += child.word_count
-            child = child.sibling
-        return total_count
-
-    @word_count.setter
-    def word_count(self, count):
-        self._word_count = count
-
-    def __repr__(self):
-        fmt = 'Section(level={!r}, label={!r}'
-        return fmt.format(
-            self.level, self.label, 
-            self.sibling,
-            self.first_child, self.last_child
-        )
+HEADER_RE = re.compile(r'^#.*$', re.MULTILINE)
 
-    def __iter__(self):
-        yield self.level, self.label, self.word_count
-        child = self.first_child
-        while child is not None:
-            yield from child
-            child = child.sibling
-
-    def add_sibling(self, sibling):
-        assert self.sibling is None, \
-            "You shouldn't add a sibling to a node that already has one"
-        assert self.level == sibling.level, \
-            "Siblings must have the same level"
-        self.sibling = sibling
-        self.sibling.parent = self.parent
-
-    def add_child(self, child):
-        child.parent = self
-        if self.first_child is None:
-            self.first_child = child
+class SectionCollector:
+    """The document's sections, kept in parallel arrays in document
+    order, which is also the order we report them in. For each
+    section we store its level, its parent and the words in the
+    section itself; the totals for whole subtrees are computed in
+    one pass when we iterate."""
+    def __init__(self):
+        self.levels = array.array('l', [0])
+        self.parents = array.array('l', [-1])
+        self.word_counts = array.array('q', [0])
+        self.labels = ['<root>']
+        self.current = 0
+
+    def _append(self, level, label, parent):
+        self.levels.append(level)
+        self.parents.append(parent)
+        self.word_counts.append(0)
+        self.labels.append(label)
+        self.current = len(self.labels) - 1
+
+    def add_section(self, level, label):
+        parent = self.current
+        if self.levels[parent] >= level:
+            while self.levels[parent] >= level:
+                parent = self.parents[parent]
         else:
-            self.last_child.sibling = child
-        self.last_child = child
+            while self.levels[parent] < level - 1:
+                self._append(self.levels[parent] + 1, "", parent)
+                parent = self.current
+        self._append(level, label, parent)
+
+    def add_words(self, count):
+        self.word_counts[self.current] += count
+
+    def events(self):
+        """The words and headers that built the sections, in order:
+        ("words", count) and ("section", level, label). Replaying
+        them after other sections gives what we would have got from
+        seeing everything."""
+        events = [("words", self.word_counts[0])]
+        for index in range(1, len(self.labels)):
+            if self.labels[index] == "":
+                continue # filler for a skipped level; never has words
+            events.append(("section", self.levels[index], self.labels[index]))
+            events.append(("words", self.word_counts[index]))
+        return events
+
+    def replay(self, events):
+        for event in events:
+            if event[0] == "words":
+                self.add_words(event[1])
+            else:
+                self.add_section(event[1], event[2])
 
+    def totals(self):
+        """Word counts for each section including its subsections."""
+        totals = array.array('q', self.word_counts)
+        parents = self.parents
+        for index in range(len(totals) - 1, 0, -1):
+            totals[parents[index]] += totals[index]
+        return totals
 
-class SectionCollector:
+    def __iter__(self):
+        return zip(self.levels, self.labels, self.totals())
+
+    def __str__(self):
+        return 'Document:\n{}'.format(
+            '\n'.join('{} {} {}'.format(*section) for section in self)
+        )
+
+
+SECTIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (
+    idx INTEGER PRIMARY KEY, level INTEGER, label TEXT,
+    words INTEGER, total INTEGER
+);
+"""
+
+def _stored_events(store):
+    """The events() of the sections in :store."""
+    for level, label, words in store.query(
+            "SELECT level, label, words FROM sections ORDER BY idx"):
+        if level > 0:
+            if label == "":
+                continue # filler for a skipped level; never has words
+            yield ("section", level, label)
+        yield ("words", words)
+
+
+class SectionRecords:
+    """The same sections as a SectionCollector, for documents too big
+    to keep them in memory. Only the open sections, the current one
+    and the ones it is in, are kept; a section is written to a record
+    store, with its total, once the next header at its level or above
+    closes it."""
     def __init__(self):
-        self.root = Section(level = 0, label = '<root>')
-        self.current = self.root
+        self.store = records.RecordStore(SECTIONS_SCHEMA)
+        # index, level, label, words, and the totals of closed subsections
+        self.open = [[0, 0, '<root>', 0, 0]]
+        self.count = 1
+
+    def _push(self, level, label):
+        self.open.append([self.count, level, label, 0, 0])
+        self.count += 1
+
+    def _close(self):
+        index, level, label, words, total = self.open.pop()
+        total += words
+        if self.open:
+            self.open[-1][4] += total
+        self.store.write(
+            "INSERT INTO sections VALUES (?, ?, ?, ?, ?)",
+            (index, level, label, words, total)
+        )
 
     def add_section(self, level, label):
-        next_section = Section(level, label)
-        if self.current.level < level:
-            while self.current.level < level - 1:
-                filler = Section(self.current.level + 1, "")
-                self.current.add_child(filler)
-                self.current = filler
-            self.current.add_child(next_section)
-
-        elif self.current.level > level:
-            while self.current.level > level:
-                self.current = self.current.parent
-            self.current.add_sibling(next_section)
-
-        else: # self.current.level == level
-            self.current.add_sibling(next_section)
-        self.current = next_section
+        while self.open[-1][1] >= level:
+            self._close()
+        while self.open[-1][1] < level - 1:
+            self._push(self.open[-1][1] + 1, "")
+        self._push(level, label)
+
+    def add_words(self, count):
+        self.open[-1][3] += count
+
+    def finish(self):
+        """Close all sections; no more can be added after this."""
+        while self.open:
+            self._close()
+
+    def events(self):
+        self.finish()
+        return _stored_events(self.store)
+
+    def replay(self, events):
+        for event in events:
+            if event[0] == "words":
+                self.add_words(event[1])
+            else:
+                self.add_section(event[1], event[2])
 
     def __iter__(self):
-        return iter(self.root)
-        
+        self.finish()
+        return iter(self.store.query(
+            "SELECT level, label, total FROM sections ORDER BY idx"
+        ))
+
     def __str__(self):
-        return 'Document:\n{}'.format(self.root)
+        return 'Document:\n{}'.format(
+            '\n'.join('{} {} {}'.format(*section) for section in self)
+        )
 
 
-class WC(plugin.ObserverPlugin, plugin.SummaryPlugin):
+class WC(plugin.BatchObserverPlugin, plugin.MergeableSummaryPlugin):
     """Word count in document"""
     def __init__(self):
-        self.sections = SectionCollector()
+        if records.enabled():
+            self.sections = SectionRecords()
+        else:
+            self.sections = SectionCollector()
 
-    def observe_line(self, filename, lineno, line):
+    def observe_lines(self, filename, lineno, lines):
         # FIXME: better recognition of words id:7
         #   
         # ----
         # <https://github.com/mailund/premarkdown/issues/8>
         # Thomas Mailund
         # mailund@birc.au.dk
-        if line.startswith('#'):
-            header_opcode, header_label = line.split(maxsplit=1)
+        text = "\n".join(lines)
+        if "#" not in text:
+            # no headers, so all the words go to the current section
+            self.sections.add_words(len(text.split()))
+            return
+        start = 0
+        for header in HEADER_RE.finditer(text):
+            self.sections.add_words(
+                len(text[start:header.start()].split())
+            )
+            header_opcode, header_label = header.group().split(maxsplit=1)
             self.sections.add_section(len(header_opcode), header_label)
-        self.sections.current.word_count += len(line.split())
+            start = header.start()
+        self.sections.add_words(len(text[start:].split()))
+
+    def observe_line(self, filename, lineno, line):
+        self.observe_lines(filename, lineno, [line])
+
+    def partial_state(self):
+        if isinstance(self.sections, SectionRecords):
+            # hand over the database instead of everything in it
+            self.sections.finish()
+            return self.sections.store.detach()
+        return self.sections.events()
+
+    def merge_state(self, state):
+        if isinstance(state, str):
+            store = records.RecordStore(SECTIONS_SCHEMA, state)
+            try:
+                self.sections.replay(_stored_events(store))
+            finally:
+                store.close()
+        else:
+            self.sections.replay(state)
 
     def summarize(self, outfile):
         # FIXME: better formatting id:9
@@ -113,7 +218,8 @@ class WC(plugin.ObserverPlugin, plugin.SummaryPlugin):
         for level, header, wc in self.sections:
             if header == "<root>":
                 # Just a special case for the entire document...
-                print("Word count for the entire document:", wc)
+                print("Word count for the entire document:", wc,
+                      file=outfile)
             else:
-                print('#' * level, header, wc)
+                print('#' * level, header, wc, file=outfile)
 
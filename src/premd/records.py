@@ -0,0 +1,92 @@
+"""
+Bounded-memory storage for what summary plugins collect. In low-memory
+mode, plugins write compact records to a temporary SQLite database as
+they see the document, and stream them back when they summarize, so
+the memory they use does not grow with the size of the corpus.
+"""
+
+import os
+import tempfile
+import itertools
+import weakref
+
+_low_memory = False
+
+
+def enable(low_memory = True):
+    """Make plugins created from now on keep what they collect in
+    record stores, or in memory again if :low_memory is False."""
+    global _low_memory
+    _low_memory = low_memory
+
+
+def enabled():
+    return _low_memory
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class RecordStore:
+    """A temporary SQLite database with the tables in :schema, or the
+    one in :filename that another process handed over. Writes are sent
+    to the database in batches of :batch_size rows. The file is
+    removed when the store is closed or collected."""
+
+    batch_size = 1024
+
+    def __init__(self, schema, filename = None):
+        import sqlite3 # only needed in low-memory mode
+        if filename is None:
+            fd, filename = tempfile.mkstemp(prefix="premd-", suffix=".sqlite")
+            os.close(fd)
+        self.filename = filename
+        self._connection = sqlite3.connect(filename)
+        # the database only has to outlive this run, not a crash
+        self._connection.execute("PRAGMA journal_mode = OFF")
+        self._connection.execute("PRAGMA synchronous = OFF")
+        self._connection.executescript(schema)
+        self._pending = []
+        self._finalizer = weakref.finalize(self, _remove, filename)
+
+    def write(self, statement, row):
+        """Execute :statement with :row, some time before the next
+        read."""
+        self._pending.append((statement, row))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # consecutive writes with the same statement go together,
+        # and the order of the writes is kept
+        pending, self._pending = self._pending, []
+        for statement, writes in itertools.groupby(pending, lambda w: w[0]):
+            self._connection.executemany(statement, (row for _, row in writes))
+
+    def execute(self, statement, parameters = ()):
+        """Execute :statement and return its first row, if any."""
+        self.flush()
+        return self._connection.execute(statement, parameters).fetchone()
+
+    def query(self, statement, parameters = ()):
+        """The rows :statement selects, read from the database as we
+        iterate over them."""
+        self.flush()
+        return self._connection.execute(statement, parameters)
+
+    def detach(self):
+        """Write everything and close the database, but keep the file,
+        so another process can open it. Returns the file name."""
+        self.flush()
+        self._connection.commit()
+        self._connection.close()
+        self._finalizer.detach()
+        return self.filename
+
+    def close(self):
+        self._connection.close()
+        self._finalizer()
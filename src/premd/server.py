@@ -0,0 +1,172 @@
+"""
+Serving builds from a long-running process. The configuration, the
+plugins and the parsed files stay loaded between builds, the
+commands for all builds share a bounded pool, and converter servers,
+such as pandoc-server, are started once and reused.
+"""
+
+import os
+import json
+import stat
+import shlex
+import socket
+import tempfile
+import subprocess
+import time
+import urllib.parse
+
+
+def default_socket():
+    """The socket premd serve listens on unless told otherwise. It is
+    in $XDG_RUNTIME_DIR, or else in a directory of our own in the
+    temporary directory, which only we can use."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "premd-{}.sock".format(os.getuid()))
+    return os.path.join(
+        tempfile.gettempdir(), "premd-{}".format(os.getuid()), "premd.sock"
+    )
+
+
+class SocketOwnerError(Exception):
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return "{} can be changed by other users; not using it.".format(
+            self.path
+        )
+
+
+def _check_owner(path):
+    """Raise a SocketOwnerError unless :path is ours, or root's, and
+    nobody else can replace what is in it."""
+    st = os.lstat(path)
+    if st.st_uid not in (os.getuid(), 0):
+        raise SocketOwnerError(path)
+    if (stat.S_ISDIR(st.st_mode) and st.st_mode & 0o022
+            and not st.st_mode & stat.S_ISVTX):
+        raise SocketOwnerError(path)
+
+
+def request(socket_path, message):
+    """Send :message to the server at :socket_path and return its
+    reply. Both are JSON objects. Raises a SocketOwnerError if the
+    socket is not ours."""
+    _check_owner(os.path.dirname(os.path.abspath(socket_path)))
+    if os.path.exists(socket_path):
+        _check_owner(socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as stream:
+            return json.loads(stream.read())
+
+
+def _in_use(socket_path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+class ServerInUseError(Exception):
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+    def __str__(self):
+        return "A server is already listening on {}.".format(self.socket_path)
+
+
+class BuildServer:
+    """Answers requests on a Unix socket. Each connection sends one
+    JSON object on a line, and gets the JSON object the coroutine
+    :handler returns for it."""
+
+    def __init__(self, handler, socket_path):
+        self.handler = handler
+        self.socket_path = socket_path
+
+    async def _handle(self, reader, writer):
+        try:
+            message = json.loads(await reader.readline())
+            reply = await self.handler(message)
+            writer.write(json.dumps(reply).encode() + b"\n")
+            await writer.drain()
+        except (ValueError, ConnectionError):
+            pass # not a request we can answer
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Listen until cancelled. The socket is only usable by us,
+        and we refuse to use a directory, or to replace a socket, that
+        other users can change."""
+        import asyncio # build --server does not need it
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _check_owner(directory)
+        if os.path.lexists(self.socket_path):
+            _check_owner(self.socket_path)
+            if _in_use(self.socket_path):
+                raise ServerInUseError(self.socket_path)
+            os.remove(self.socket_path) # left behind by a server that died
+        server = await asyncio.start_unix_server(
+            self._handle, self.socket_path
+        )
+        os.chmod(self.socket_path, 0o600)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            os.remove(self.socket_path)
+
+
+def _wait_for_server(url, timeout = 10.0):
+    """Give a server we just started :timeout seconds to start
+    listening on :url."""
+    if url is None:
+        return
+    address = urllib.parse.urlsplit(url)
+    port = address.port or (443 if address.scheme == "https" else 80)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((address.hostname, port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+class ConverterServers:
+    """The converter server processes we started, stopped again when
+    we are done with them."""
+
+    def __init__(self):
+        self._processes = []
+
+    def start(self, config):
+        """Start the converter server in the "command" of the "server"
+        configuration, if there is one."""
+        server_command = config.get(("server", "command"))
+        if server_command:
+            self._processes.append(subprocess.Popen(
+                shlex.split(server_command)
+            ))
+            _wait_for_server(config.get(("server", "url")))
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.wait()
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *foo):
+        self.stop()
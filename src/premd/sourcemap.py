@@ -0,0 +1,65 @@
+"""
+Source maps: where each line of a flattened document came from, so
+line numbers that pandoc or a linter report for the output can be
+traced back to the file and line they were written in.
+"""
+
+import array
+import bisect
+
+
+class SourceMap:
+    """The lines of a flattened document as runs of consecutive output
+    lines that came from consecutive lines of one file. For each run,
+    three arrays hold its first output line, its file and its first
+    line in that file, so a run takes a few bytes however many lines
+    it covers, and a lookup is a binary search. Line numbers count
+    from 0, as flatten counts them."""
+
+    def __init__(self):
+        self.files = []
+        self._file_ids = {}
+        self.starts = array.array('q')
+        self.file_ids = array.array('l')
+        self.linenos = array.array('q')
+        self.length = 0
+        # where the last run would continue
+        self._next = (None, None)
+
+    def _file_id(self, filename):
+        file_id = self._file_ids.get(filename)
+        if file_id is None:
+            file_id = self._file_ids[filename] = len(self.files)
+            self.files.append(filename)
+        return file_id
+
+    def add(self, filename, lineno, count = 1):
+        """Add :count output lines, from line :lineno of :filename on."""
+        if count <= 0:
+            return
+        if self._next != (filename, lineno):
+            self.starts.append(self.length)
+            self.file_ids.append(self._file_id(filename))
+            self.linenos.append(lineno)
+        self.length += count
+        self._next = (filename, lineno + count)
+
+    def __len__(self):
+        return self.length
+
+    def locate(self, line):
+        """The file and line that output :line came from. Raises an
+        IndexError if the output has no such line."""
+        if not 0 <= line < self.length:
+            raise IndexError(line)
+        run = bisect.bisect_right(self.starts, line) - 1
+        return (self.files[self.file_ids[run]],
+                self.linenos[run] + line - self.starts[run])
+
+    def runs(self):
+        """(first output line, file, first line in the file, number of
+        lines) for each run."""
+        ends = self.starts[1:] + array.array('q', [self.length])
+        for start, file_id, lineno, end in zip(
+                self.starts, self.file_ids, self.linenos, ends):
+            yield start, self.files[file_id], lineno, end - start
@@ -0,0 +1,85 @@
+"""
+Summarizing a document in shards: the files the root file includes
+are analysed in parallel processes, and what the summary plugins
+collect there is merged, in document order, with what they collect
+from the root file itself.
+"""
+
+import concurrent.futures
+
+from . import cache
+from . import flatten
+from . import plugin
+from . import records
+from . import offload
+from .plugin import plugins
+
+
+def shardable():
+    """Can the plugins summarize a document in shards? Only if every
+    plugin that sees the document can merge what it collects."""
+    return all(
+        isinstance(p, plugin.MergeableSummaryPlugin)
+        for p in plugins.plugins.values()
+        if isinstance(p, (plugin.TagPlugin, plugin.ObserverPlugin,
+                          plugin.BatchObserverPlugin))
+    )
+
+
+def _partial_states():
+    return {
+        name: p.partial_state()
+        for name, p in plugins.summary_plugins.items()
+        if isinstance(p, plugin.MergeableSummaryPlugin)
+    }
+
+
+def _analyse_shard(filename, root, fast, use_cache, low_memory):
+    """Run fresh plugins over :filename, included from :root, and
+    return what they collected. Runs in a worker process."""
+    records.enable(low_memory)
+    offload.enable(False) # the shards already run in parallel
+    plugins.reset()
+    stack = flatten.IncludeStack()
+    stack.append(root)
+    if fast:
+        lines = flatten.flatten_chunks(filename, True, stack)
+    elif use_cache:
+        parse_cache = cache.ParseCache()
+        lines = flatten.flatten_parsed(filename, parse_cache, True, stack)
+    else:
+        lines = flatten.flatten(filename, True, stack)
+    for _ in lines:
+        pass
+    return _partial_states()
+
+
+def analyse_sharded(filename, jobs = None, fast = False, use_cache = False):
+    """Run the plugins over :filename as analysing it would, but with
+    each file it includes analysed in a pool of :jobs processes. The
+    plugins must be shardable()."""
+    parsed_file = flatten.parse_file(filename)
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as pool:
+        shards = [
+            pool.submit(
+                _analyse_shard, token[2], filename, fast, use_cache,
+                records.enabled()
+            )
+            for token in parsed_file.tokens if token[0] == flatten._INCLUDE
+        ]
+        shards.reverse() # so we can pop them in document order
+
+        # offloaded plugins would see the root's lines after the
+        # shards' states are merged, so they run here
+        observers = flatten._Observers(offloading = False)
+        for token in parsed_file.tokens:
+            kind, lineno = token[0], token[1]
+            if kind == flatten._LINE:
+                observers.lines(filename, lineno, token[2])
+            elif kind == flatten._TAG:
+                observers.tag(filename, lineno, token[2], token[3])
+            else: # _INCLUDE
+                observers.flush()
+                for name, state in shards.pop().result().items():
+                    plugins.summary_plugins[name].merge_state(state)
+        observers.flush()
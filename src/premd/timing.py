@@ -0,0 +1,220 @@
+"""
+Profiling the processing pipeline: how long we spend reading files,
+in plugins, and feeding and waiting for the commands building targets.
+
+Use it from Python as
+
+    with timing.profiling() as profile:
+        ...
+    profile.report(sys.stderr)
+"""
+
+import time
+import json
+import threading
+import contextlib
+import collections
+
+from .plugin import plugins
+
+# The profile we are currently collecting, if any
+current = None
+
+
+class Profile:
+    """Timings collected while processing a document."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.file_reads = collections.defaultdict(float)
+        self.plugin_calls = collections.defaultdict(int)
+        self.plugin_time = collections.defaultdict(float)
+        self.command_write = collections.defaultdict(float)
+        self.command_wait = collections.defaultdict(float)
+
+    def add_file_read(self, filename, seconds):
+        with self._lock:
+            self.file_reads[filename] += seconds
+
+    def add_plugin_call(self, name, seconds):
+        with self._lock:
+            self.plugin_calls[name] += 1
+            self.plugin_time[name] += seconds
+
+    def add_command_write(self, target, seconds):
+        with self._lock:
+            self.command_write[target] += seconds
+
+    def add_command_wait(self, target, seconds):
+        with self._lock:
+            self.command_wait[target] += seconds
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.start
+
+    def as_dict(self):
+        targets = sorted(set(self.command_write) | set(self.command_wait))
+        return {
+            "elapsed": self.elapsed,
+            "files": dict(self.file_reads),
+            "plugins": {
+                name: {"calls": self.plugin_calls[name],
+                       "seconds": self.plugin_time[name]}
+                for name in sorted(self.plugin_calls)
+            },
+            "commands": {
+                target: {"write": self.command_write[target],
+                         "wait": self.command_wait[target]}
+                for target in targets
+            },
+        }
+
+    def dump(self, outfile):
+        json.dump(self.as_dict(), outfile, indent=2)
+        print(file=outfile)
+
+    def report(self, outfile):
+        profile = self.as_dict()
+        width = max(
+            [len(name) for name in profile["files"]] +
+            [len(name) for name in profile["plugins"]] +
+            [len(name) for name in profile["commands"]] + [20]
+        )
+        row = "{:" + str(width) + "} {:>10} {:>10}"
+
+        print(row.format("File", "", "read (s)"), file=outfile)
+        for filename, seconds in profile["files"].items():
+            print(row.format(filename, "", "{:.4f}".format(seconds)),
+                  file=outfile)
+        print(row.format("Total", "", "{:.4f}".format(
+            sum(profile["files"].values()))), file=outfile)
+        print(file=outfile)
+
+        print(row.format("Plugin", "calls", "time (s)"), file=outfile)
+        for name, stats in profile["plugins"].items():
+            print(row.format(
+                name, stats["calls"], "{:.4f}".format(stats["seconds"])
+            ), file=outfile)
+        print(file=outfile)
+
+        print(row.format("Target", "write (s)", "wait (s)"), file=outfile)
+        for target, stats in profile["commands"].items():
+            print(row.format(
+                target, "{:.4f}".format(stats["write"]),
+                "{:.4f}".format(stats["wait"])
+            ), file=outfile)
+        print(file=outfile)
+
+        if self.elapsed is not None:
+            print("Total time: {:.4f}s".format(self.elapsed), file=outfile)
+
+
+class _TimedPlugin:
+    # Wraps a plugin and times the calls to its plugin methods. It
+    # passes for the plugin it wraps, so the plugin's class and doc
+    # string are still used for the summaries.
+
+    _methods = ("observe_line", "observe_lines", "handle_tag", "summarize")
+
+    __class__ = property(lambda self: self._plugin.__class__)
+    __doc__ = property(lambda self: self._plugin.__doc__)
+
+    def __init__(self, name, plugin, profile):
+        self._name = name
+        self._plugin = plugin
+        self._profile = profile
+
+    def __getattr__(self, attribute):
+        value = getattr(self._plugin, attribute)
+        if attribute not in self._methods:
+            return value
+        name = "{}.{}".format(self._name, attribute)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                self._profile.add_plugin_call(
+                    name, time.perf_counter() - start
+                )
+        return timed
+
+
+class TimedReader:
+    """Iterates over :stream and records the time spent reading it."""
+
+    def __init__(self, filename, stream, profile):
+        self._filename = filename
+        self._iterator = iter(stream)
+        self._profile = profile
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self._profile.add_file_read(
+                self._filename, time.perf_counter() - start
+            )
+
+
+class TimedWriter:
+    """Wraps an output stream and records the time spent writing to it."""
+
+    def __init__(self, target, stream, profile):
+        self._target = target
+        self._stream = stream
+        self._profile = profile
+
+    def __getattr__(self, attribute):
+        return getattr(self._stream, attribute)
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._profile.add_command_write(
+                self._target, time.perf_counter() - start
+            )
+
+    def write(self, text):
+        return self._timed(self._stream.write, text)
+
+    def close(self):
+        # closing flushes what is still buffered
+        return self._timed(self._stream.close)
+
+    def writelines(self, lines):
+        # time the writes, not producing the lines
+        for line in lines:
+            self.write(line)
+
+
+def timed_reads(filename, stream):
+    """:stream, timed if we are profiling."""
+    if current is None:
+        return stream
+    return TimedReader(filename, stream, current)
+
+
+@contextlib.contextmanager
+def profiling():
+    """Collect a Profile of everything processed in the block."""
+    global current
+    profile = Profile()
+    previous, current = current, profile
+    plugins.instrument(
+        lambda name, plugin: _TimedPlugin(name, plugin, profile)
+    )
+    try:
+        yield profile
+    finally:
+        plugins.instrument(None)
+        current = previous
+        profile.stop()
@@ -0,0 +1,153 @@
+"""
+Waiting for changes to the files a document depends on.
+"""
+
+import os
+import sys
+import time
+import errno
+import struct
+import select
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+               IN_CREATE | IN_DELETE | IN_ATTRIB)
+_EVENT = struct.Struct("iIII")
+
+
+def _changed(changed, filenames):
+    return {filenames[path] for path in changed if path in filenames}
+
+
+class InotifyWatcher:
+    """Waits for changes using Linux' inotify. We watch the directories
+    holding the files rather than the files themselves, so we also see
+    files that editors replace when saving, and files that do not
+    exist yet."""
+
+    def __init__(self, libc, settle = 0.1):
+        self._libc = libc
+        self._settle = settle
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            import ctypes
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._directories = {} # watch descriptor -> directory
+        self._filenames = {} # absolute path -> name as given
+
+    def _watch_directories(self, directories):
+        watched = set(self._directories.values())
+        for wd, directory in list(self._directories.items()):
+            if directory not in directories:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._directories[wd]
+        for directory in directories - watched:
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(directory), _WATCH_MASK
+            )
+            if wd >= 0:
+                self._directories[wd] = directory
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as ex:
+            if ex.errno == errno.EINTR:
+                return set()
+            raise
+        paths = set()
+        offset = 0
+        while offset < len(data):
+            wd, _mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            directory = self._directories.get(wd)
+            if directory is not None and name:
+                paths.add(os.path.join(directory, os.fsdecode(name)))
+        return paths
+
+    def watch(self, filenames):
+        """Start watching :filenames. Changes made from now on are
+        returned by the next wait()."""
+        self._filenames = {os.path.abspath(name): name for name in filenames}
+        self._watch_directories(
+            {os.path.dirname(path) for path in self._filenames}
+        )
+
+    def wait(self):
+        """Block until at least one of the watched files changes and
+        return the set of changed files."""
+        while True:
+            changed = _changed(self._read_events(), self._filenames)
+            if changed:
+                break
+        # Editors often touch a file several times when saving it,
+        # so collect what else happens before we return.
+        while select.select([self._fd], [], [], self._settle)[0]:
+            changed |= _changed(self._read_events(), self._filenames)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Waits for changes by polling modification times. Used where
+    inotify is not available."""
+
+    def __init__(self, interval = 0.5):
+        self._interval = interval
+        self._stamps = {}
+
+    @staticmethod
+    def _stamp(filename):
+        try:
+            stat = os.stat(filename)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def watch(self, filenames):
+        """Start watching :filenames. Changes made from now on are
+        returned by the next wait()."""
+        self._stamps = {name: self._stamp(name) for name in filenames}
+
+    def wait(self):
+        """Block until at least one of the watched files changes and
+        return the set of changed files."""
+        while True:
+            time.sleep(self._interval)
+            changed = {
+                name for name, stamp in self._stamps.items()
+                if self._stamp(name) != stamp
+            }
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+def watcher():
+    """Get the best watcher available on this platform."""
+    if sys.platform.startswith("linux"):
+        import ctypes.util # only needed to watch, and slow to import
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is not None:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            if hasattr(libc, "inotify_init1"):
+                try:
+                    return InotifyWatcher(libc)
+                except OSError:
+                    pass
+    return PollingWatcher()
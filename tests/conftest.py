@@ -0,0 +1,199 @@
+import os
+import re
+import sys
+import queue
+import signal
+import threading
+import subprocess
+import collections
+
+import pytest
+
+BOOK = {
+    "book.txt": (
+        "# The book\n"
+        "%% TODO: write the introduction\n"
+        "/chapters/one.txt\n"
+        "Some text with trailing space   \n"
+        "/chapters/two.txt\n"
+        "/chapters/missing.txt\n"
+        "The end, without a newline"
+    ),
+    "chapters/one.txt": (
+        "## One\n"
+        "\n"
+        "The first chapter. It has words, and more words.\n"
+        "%% FIXME: a comment between lines\n"
+        "The lines after the comment.\n"
+        "![A figure](figures/one.png){#fig:one}\n"
+        "/nested/deep.txt\n"
+        "Back in chapter one.  \n"
+    ),
+    "chapters/nested/deep.txt": (
+        "### Deep\n"
+        "%% Fixme: deep down\n"
+        "A nested file with a few words in it.\n"
+        "%% a comment no plugin handles\n"
+    ),
+    "chapters/two.txt": (
+        "## Two\n"
+        "\u00a0Text after a non-breaking space.\n"
+        "%% todo: finish chapter two\n"
+        "\n"
+        "\n"
+        "Last line of chapter two.\n"
+    ),
+}
+
+# A converter that writes what it reads to the file given with -o
+CAT = """\
+import sys, shutil
+with open(sys.argv[-1], "wb") as outfile:
+    shutil.copyfileobj(sys.stdin.buffer, outfile)
+"""
+
+# premd, with cat.py, the first argument, as the command building
+# targets. It is set before premd starts, so the configuration files
+# play no part.
+LAUNCH = """\
+import sys
+from premd import __main__ as main
+main.CONFIGS.data.update({
+    "command": sys.executable, "arguments": [sys.argv.pop(1)], "shared": {}
+})
+main.main()
+"""
+
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+
+Result = collections.namedtuple("Result", ["status", "stdout", "stderr"])
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path_factory, monkeypatch):
+    """Keep what premd caches for the user out of the user's cache."""
+    cache_home = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+    return cache_home
+
+
+@pytest.fixture
+def book(tmp_path):
+    """A small book with nested includes, tags, a figure, a missing
+    include and trailing space. Returns the directory it is in."""
+    directory = tmp_path / "book"
+    for filename, content in BOOK.items():
+        path = directory / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    return directory
+
+
+class Premd:
+    """Runs premd in the book's directory."""
+
+    def __init__(self, directory, cat):
+        self.directory = directory
+        self.cat = cat
+        self._running = []
+
+    def _command_line(self, args):
+        return [sys.executable, "-c", LAUNCH, str(self.cat)] + list(args)
+
+    def __call__(self, *args, status=0):
+        """Run premd with :args and check that it exits with :status.
+        Returns the exit status, what it wrote to stdout, as bytes,
+        and to stderr, as text without colours."""
+        process = subprocess.run(
+            self._command_line(args), cwd=self.directory,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stderr = ANSI_RE.sub("", process.stderr.decode())
+        assert process.returncode == status, stderr
+        return Result(process.returncode, process.stdout, stderr)
+
+    def start(self, *args):
+        """Start premd with :args, for commands that keep running."""
+        running = Running(subprocess.Popen(
+            self._command_line(args), cwd=self.directory,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            text=True
+        ))
+        self._running.append(running)
+        return running
+
+    def close(self):
+        """Kill what is still running."""
+        for running in self._running:
+            if running.process.poll() is None:
+                running.process.kill()
+                running.process.wait()
+
+
+class Running:
+    """A premd process we read stderr from while it runs."""
+
+    def __init__(self, process):
+        self.process = process
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        for line in self.process.stderr:
+            self._lines.put(ANSI_RE.sub("", line))
+        self._lines.put(None)
+
+    def wait_for(self, text, timeout=10):
+        """The lines written until one containing :text."""
+        lines = []
+        while True:
+            line = self._lines.get(timeout=timeout)
+            assert line is not None, "premd exited:\n" + "".join(lines)
+            lines.append(line)
+            if text in line:
+                return lines
+
+    def stop(self):
+        """Interrupt premd as ^C would and return its exit status."""
+        self.process.send_signal(signal.SIGINT)
+        try:
+            return self.process.wait(timeout=10)
+        finally:
+            if self.process.poll() is None:
+                self.process.kill()
+
+
+@pytest.fixture
+def premd(book, tmp_path):
+    cat = tmp_path / "cat.py"
+    cat.write_text(CAT)
+    runner = Premd(book, cat)
+    yield runner
+    runner.close()
+
+
+@pytest.fixture
+def install_plugins(tmp_path, monkeypatch):
+    """A function installing plugins from the module source it is given,
+    as premd plugins named in a distribution of their own. premd finds
+    them through their entry points, as it finds installed plugins."""
+    site = tmp_path / "site"
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(
+        [str(site)] + os.environ.get("PYTHONPATH", "").split(os.pathsep)
+    ))
+
+    def install(module, source, names):
+        dist_info = site / "{}-1.0.dist-info".format(module)
+        dist_info.mkdir(parents=True)
+        (dist_info / "METADATA").write_text(
+            "Metadata-Version: 2.1\nName: {}\nVersion: 1.0\n".format(module)
+        )
+        (dist_info / "entry_points.txt").write_text(
+            "[premd.plugins]\n" + "".join(
+                "{} = {}:{}\n".format(name, module, name) for name in names
+            )
+        )
+        (site / "{}.py".format(module)).write_text(source)
+    return install
+
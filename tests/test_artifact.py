@@ -0,0 +1,78 @@
+"""
+Saving a flattened document as an artifact and using it in place of
+the document.
+"""
+
+import gzip
+
+import pytest
+
+from premd import flatten
+from premd import __main__ as main
+
+
+@pytest.mark.parametrize("options", [[], ["--fast"], ["--parse-jobs", "2"]])
+def test_artifact_gives_the_output(premd, book, options):
+    output = premd("transform", "book.txt").stdout
+    saved = premd("transform", "book.txt", "--artifact", "book.gz", *options)
+    assert saved.stdout == b""
+    assert premd("transform", "book.gz").stdout == output
+
+
+def test_artifact_gives_the_summaries(premd):
+    summaries = premd("summarize", "book.txt").stdout
+    premd("transform", "book.txt", "--artifact", "book.gz")
+    assert premd("summarize", "book.gz").stdout == summaries
+
+
+def test_targets_are_built_from_an_artifact(premd, book):
+    premd("transform", "book.txt", "--artifact", "book.gz")
+    premd("build", "book.gz", "-o", "out.md")
+    assert (book / "out.md").read_bytes() == \
+        premd("transform", "book.txt").stdout
+    # the artifact is all the build depends on
+    deps = premd("deps", "book.gz", "-o", "out.md").stdout
+    assert deps.replace(b"\\\n", b"").split() == \
+        [b"out.md:", b"book.gz"]
+
+
+def test_unreadable_artifact_is_reported(premd, book):
+    (book / "broken.gz").write_bytes(gzip.compress(b"not an artifact"))
+    result = premd("transform", "broken.gz", status=1)
+    assert "broken.gz" in result.stderr
+
+
+def test_artifact_is_summarized_without_warnings(premd):
+    summaries = premd("summarize", "book.txt").stdout
+    premd("transform", "book.txt", "--artifact", "book.gz")
+    result = premd("summarize", "--jobs", "2", "book.gz")
+    assert result.stdout == summaries
+    assert "Warning" not in result.stderr
+
+
+def test_changed_sources_are_warned_about(premd, book):
+    output = premd("transform", "book.txt").stdout
+    premd("transform", "book.txt", "--artifact", "book.gz")
+    assert "Warning" not in premd("transform", "book.gz").stderr
+    (book / "chapters" / "nested" / "deep.txt").write_text("Changed.\n")
+    result = premd("transform", "book.gz")
+    assert result.stdout == output
+    assert "book.gz is older than the files it was made from" in result.stderr
+    assert "chapters/nested/deep.txt" in result.stderr
+    assert "chapters/one.txt" not in result.stderr
+
+
+def test_failed_recording_closes_the_observers(book, monkeypatch):
+    closed = []
+    close = flatten._Observers.close
+
+    def closing(observers):
+        closed.append(observers)
+        close(observers)
+    monkeypatch.setattr(flatten._Observers, "close", closing)
+    monkeypatch.chdir(book)
+    (book / "chapters" / "nested" / "deep.txt").write_bytes(b"\xff\n")
+    with pytest.raises(UnicodeDecodeError):
+        main.transform_command(["book.txt", "--artifact", "book.gz"])
+    assert len(closed) == 1
+    assert not (book / "book.gz").exists()
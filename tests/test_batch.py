@@ -0,0 +1,101 @@
+"""
+Building many projects in one process with premd batch.
+"""
+
+import sys
+import json
+import shutil
+
+
+def project(premd, book, name, root = "book.txt"):
+    """A copy of the book as a project of its own, building out.md
+    with cat.py."""
+    directory = book.parent / "projects" / name
+    shutil.copytree(book, directory)
+    (directory / "premd.yml").write_text(json.dumps({
+        "root": root,
+        "targets": ["out.md"],
+        "command": sys.executable,
+        "arguments": [str(premd.cat)],
+    }))
+    return directory
+
+
+def test_projects_are_built(premd, book):
+    first = project(premd, book, "first")
+    second = project(premd, book, "second")
+    (second / "chapters" / "two.txt").write_text("Another chapter two.\n")
+    premd("batch", str(first), str(second))
+    assert (first / "out.md").read_bytes() == \
+        premd("transform", "book.txt").stdout
+    assert b"Another chapter two.\n" in (second / "out.md").read_bytes()
+
+
+def test_projects_are_found_by_glob(premd, book):
+    project(premd, book, "first")
+    project(premd, book, "second")
+    result = premd("batch", "../projects/*/premd.yml")
+    assert "Built 2 projects: 0 failed." in result.stderr
+
+
+def test_report_has_every_project_and_target(premd, book):
+    project(premd, book, "first")
+    project(premd, book, "broken", root="nothing.txt")
+    result = premd(
+        "batch", "--report", "report.json", "../projects/first",
+        "../projects/broken", status=1
+    )
+    assert "Built 2 projects: 1 failed." in result.stderr
+    report = json.loads((book / "report.json").read_text())
+    assert report["failed"] == 1
+    first, broken = report["projects"]
+    assert first["project"] == "../projects/first"
+    assert first["status"] == 0
+    assert [target["target"] for target in first["targets"]] == ["out.md"]
+    assert first["targets"][0]["returncode"] == 0
+    assert broken["status"] == 1
+    assert broken["targets"] == []
+    assert "nothing.txt" in broken["stderr"]
+
+
+# An observer logging where it reads input, and a converter logging
+# where it runs, both to $ORDER_FILE.
+READS = '''\
+import os
+from premd import plugin
+
+class Reads(plugin.ObserverPlugin):
+    def observe_line(self, filename, lineno, line):
+        with open(os.environ["ORDER_FILE"], "a") as stream:
+            stream.write("read {}\\n".format(os.path.basename(os.getcwd())))
+'''
+
+RUNS = """\
+import os, sys, shutil
+with open(os.environ["ORDER_FILE"], "a") as stream:
+    stream.write("run {}\\n".format(os.path.basename(os.getcwd())))
+with open(sys.argv[-1], "wb") as outfile:
+    shutil.copyfileobj(sys.stdin.buffer, outfile)
+"""
+
+
+def test_projects_wait_for_a_slot_before_reading(premd, book, tmp_path,
+                                                 install_plugins, monkeypatch):
+    install_plugins("test_reads", READS, ["Reads"])
+    order_file = tmp_path / "order.txt"
+    monkeypatch.setenv("ORDER_FILE", str(order_file))
+    premd.cat = tmp_path / "runs.py"
+    premd.cat.write_text(RUNS)
+    names = ["first", "second", "third"]
+    for name in names:
+        project(premd, book, name)
+    premd("batch", "-j", "1", *["../projects/" + name for name in names])
+    steps = []
+    for step in order_file.read_text().splitlines():
+        if not steps or steps[-1] != step:
+            steps.append(step)
+    # each project is read only once the one before has been built
+    assert steps == [
+        "{} {}".format(step, name)
+        for name in names for step in ["read", "run"]
+    ]
@@ -0,0 +1,90 @@
+"""
+Writing --fast builds to commands as bytes from the mapped files.
+"""
+
+import pytest
+
+from premd import artifact
+from premd import flatten
+from premd import __main__ as main
+
+
+def flattened(filename):
+    return "".join(line + "\n" for line in flatten.flatten(filename)).encode()
+
+
+def flattened_bytes(filename, run_plugins):
+    chunks = []
+    for chunk in flatten.flatten_bytes(filename, run_plugins):
+        # ranges are only mapped while we flatten
+        if isinstance(chunk, flatten.MappedRange):
+            chunk = bytes(chunk.buffer[chunk.start:chunk.end])
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@pytest.mark.parametrize("run_plugins", [False, True])
+def test_bytes_match_lines(book, monkeypatch, run_plugins):
+    monkeypatch.chdir(book)
+    # long enough to be sent with sendfile, with trailing space in
+    # places and a line the locale may not encode as it is
+    with open(book / "chapters" / "two.txt", "a") as stream:
+        for number in range(5000):
+            stream.write("Line {} of a long chapter.{}\n".format(
+                number, "  " if number % 100 == 0 else ""
+            ))
+        stream.write("![Another](figures/two.png)\nDone: æøå\n")
+    assert flattened_bytes("book.txt", run_plugins) == flattened("book.txt")
+
+
+def test_line_endings_match_lines(book, monkeypatch):
+    monkeypatch.chdir(book)
+    (book / "endings.txt").write_bytes(
+        b"Windows\r\nline endings  \r\n%% TODO: here too\r\n"
+        b"a lone\rcarriage return\n"
+        b"/chapters/nested/deep.txt\r\n"
+        b"no final newline  "
+    )
+    assert flattened_bytes("endings.txt", False) == flattened("endings.txt")
+
+
+def test_fast_targets_match_default(premd, book):
+    # the first target runs the plugins, the others get the bytes
+    premd("build", "--fast", "book.txt", "-o", "a.md", "b.md", "c.md")
+    default = premd("transform", "book.txt").stdout
+    for target in ("a.md", "b.md", "c.md"):
+        assert (book / target).read_bytes() == default
+
+
+def test_command_that_stops_reading_is_reported(premd, book):
+    # more than a pipe holds, so writing to the command fails
+    (book / "chapters" / "two.txt").write_text("Some text.\n" * 200000)
+    premd.cat.write_text("import sys\nsys.exit(2)\n")
+    result = premd("build", "--fast", "book.txt", "-o", "a.md", "b.md",
+                   status=1)
+    assert "a.md: failed (exit status 2)" in result.stderr
+    assert "b.md: failed (exit status 2)" in result.stderr
+    assert "Traceback" not in result.stderr
+
+
+class Command:
+    """Collects what command_processed writes, as a RunCommand gets it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write_chunks(self, chunks):
+        for chunk in chunks:
+            if isinstance(chunk, flatten.MappedRange):
+                chunk = bytes(chunk.buffer[chunk.start:chunk.end])
+            self.chunks.append(chunk)
+
+
+def test_fast_command_input_is_observed(book, monkeypatch):
+    monkeypatch.chdir(book)
+    recorder = artifact.Recorder(flatten._Observers())
+    cmd = Command()
+    main.command_processed("book.txt", cmd, fast=True, observers=recorder)
+    recorder.finish()
+    assert b"".join(cmd.chunks) == flattened("book.txt")
+    assert recorder.output_lines == list(flatten.flatten("book.txt"))
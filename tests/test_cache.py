@@ -0,0 +1,51 @@
+"""
+Reading parsed files from the cache should not change the output.
+"""
+
+import json
+import collections
+
+from premd import cache
+from premd import flatten
+
+
+def test_cached_output_matches_uncached(premd):
+    uncached = premd("transform", "--no-cache", "book.txt").stdout
+    # the first run fills the cache, the second reads from it
+    assert premd("transform", "book.txt").stdout == uncached
+    assert premd("transform", "book.txt").stdout == uncached
+
+
+def test_cached_summary_matches_uncached(premd):
+    uncached = premd("summarize", "--no-cache", "book.txt").stdout
+    assert premd("summarize", "book.txt").stdout == uncached
+    assert premd("summarize", "book.txt").stdout == uncached
+
+
+def test_changed_files_are_parsed_again(premd, book):
+    premd("transform", "book.txt")
+    (book / "chapters" / "nested" / "deep.txt").write_text("Changed.\n")
+    assert b"Changed.\n" in premd("transform", "book.txt").stdout
+
+
+def test_cache_is_kept_as_json_in_the_user_cache(premd, book, cache_home):
+    premd("transform", "book.txt")
+    entries = list((cache_home / "premd" / "parsed").iterdir())
+    assert len(entries) == 4
+    for entry in entries:
+        assert entry.suffix == ".json"
+        json.loads(entry.read_text())
+    assert not (book / ".premd-cache").exists()
+
+
+def test_entries_kept_in_memory_are_bounded(book, monkeypatch):
+    monkeypatch.chdir(book)
+    monkeypatch.setattr(cache, "MAX_ENTRIES", 2)
+    monkeypatch.setattr(cache, "_entries", collections.OrderedDict())
+    parse_cache = cache.ParseCache()
+    uncached = list(flatten.flatten("book.txt"))
+    assert list(flatten.flatten_parsed("book.txt", parse_cache)) == uncached
+    assert len(cache._entries) == 2
+    # the entries dropped from memory are read back from disk
+    assert list(flatten.flatten_parsed("book.txt", parse_cache)) == uncached
+    assert len(cache._entries) == 2
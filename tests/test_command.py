@@ -0,0 +1,121 @@
+"""
+Building targets through the asyncio pipeline.
+"""
+
+import sys
+import time
+
+import pytest
+
+from premd import command
+from premd import configuration
+
+CAT = """\
+import sys, shutil
+with open(sys.argv[-1], "wb") as outfile:
+    shutil.copyfileobj(sys.stdin.buffer, outfile)
+"""
+
+# A converter that starts a child which outlives it unless its whole
+# process group is killed, and then hangs. It writes the child's pid
+# to the file given as its first argument.
+HANG = """\
+import sys, subprocess, time
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+with open(sys.argv[1], "w") as stream:
+    stream.write(str(child.pid))
+time.sleep(60)
+"""
+
+# A converter that fails after writing to stdout and stderr.
+FAIL = """\
+import sys
+sys.stdin.read()
+print("to stdout")
+print("to stderr", file=sys.stderr)
+sys.exit(3)
+"""
+
+
+def configurations(*arguments):
+    config = configuration.Configurations()
+    config.data.update({
+        "command": sys.executable, "arguments": list(arguments), "shared": {}
+    })
+    return config
+
+
+def is_running(pid):
+    """Whether :pid is a process that has not exited."""
+    try:
+        with open("/proc/{}/stat".format(pid)) as stream:
+            state = stream.read().rsplit(")", 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != "Z"
+
+
+def test_targets_get_every_chunk(tmp_path):
+    (tmp_path / "cat.py").write_text(CAT)
+    config = configurations(str(tmp_path / "cat.py"))
+    chunks = ("chunk {}\n".format(number) for number in range(100))
+    targets = [str(tmp_path / "{}.md".format(name)) for name in "abc"]
+    results = command.run_targets(config, targets, chunks, jobs=2)
+    assert [result.target for result in results] == targets
+    assert [result.returncode for result in results] == [0, 0, 0]
+    expected = "".join("chunk {}\n".format(number) for number in range(100))
+    for target in targets:
+        with open(target) as stream:
+            assert stream.read() == expected
+
+
+def test_chunks_are_dropped_once_every_target_has_them():
+    shared = command._SharedChunks("chunk {}".format(n) for n in range(100))
+    first, second, done = shared.reader(), shared.reader(), shared.reader()
+    done.close()
+    read = []
+    for chunk, same in zip(first, second):
+        assert chunk == same
+        assert len(shared._produced) <= 1
+        read.append(chunk)
+    assert read == ["chunk {}".format(n) for n in range(100)]
+
+
+def test_slow_target_gets_every_chunk():
+    shared = command._SharedChunks("chunk {}".format(n) for n in range(100))
+    fast, slow = shared.reader(), shared.reader()
+    assert list(fast) == ["chunk {}".format(n) for n in range(100)]
+    fast.close()
+    assert len(shared._produced) == 100
+    assert list(slow) == ["chunk {}".format(n) for n in range(100)]
+    assert len(shared._produced) == 0
+
+
+def test_failed_command_output_is_kept(tmp_path):
+    (tmp_path / "fail.py").write_text(FAIL)
+    config = configurations(str(tmp_path / "fail.py"))
+    result, = command.run_targets(
+        config, [str(tmp_path / "out.md")], ["some text\n"]
+    )
+    assert result.returncode == 3
+    assert result.stdout.strip() == b"to stdout"
+    assert result.stderr.strip() == b"to stderr"
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="looks for processes in /proc")
+def test_timeout_kills_the_process_group(tmp_path):
+    (tmp_path / "hang.py").write_text(HANG)
+    pid_file = tmp_path / "child.pid"
+    config = configurations(str(tmp_path / "hang.py"), str(pid_file))
+    start = time.perf_counter()
+    result, = command.run_targets(
+        config, [str(tmp_path / "out.md")], ["some text\n"], timeout=1
+    )
+    assert time.perf_counter() - start < 30
+    assert result.returncode is None
+    child = int(pid_file.read_text())
+    deadline = time.monotonic() + 5
+    while is_running(child) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not is_running(child)
@@ -0,0 +1,112 @@
+"""
+Caching the merged and compiled configuration.
+"""
+
+import os
+import json
+
+import pytest
+
+from premd import configuration
+
+
+@pytest.fixture(autouse=True)
+def no_global_configs(monkeypatch):
+    """Only the project configurations, read afresh in every test."""
+    monkeypatch.setattr(configuration, "GLOBAL_CONFIGS", [])
+    monkeypatch.setattr(configuration, "_config_files", {})
+
+
+def project(directory, text):
+    directory.mkdir(exist_ok=True)
+    (directory / "premd.yml").write_text(text)
+    return directory
+
+
+def configurations(directory):
+    configs = configuration.Configurations()
+    configs.push_config(str(directory))
+    return configs
+
+
+def compiled(configs):
+    """The compiled value for a key, and whether it was compiled now."""
+    calls = []
+
+    def compile():
+        calls.append(True)
+        return configs["command"].upper()
+    return configs.compiled(("test",), compile), bool(calls)
+
+
+def replace(path, text):
+    """Replace :path by a new file holding :text, with the old file's
+    modification time."""
+    stat = os.stat(path)
+    path.with_suffix(".new").write_text(text)
+    os.replace(path.with_suffix(".new"), path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def test_compiled_values_are_cached(tmp_path):
+    directory = project(tmp_path / "a", "command: pandoc\n")
+    configs = configurations(directory)
+    assert compiled(configs) == ("PANDOC", True)
+    configs.save()
+    cached = json.loads(
+        (directory / ".premd-cache" / "config.json").read_text()
+    )
+    assert cached["data"]["command"] == "pandoc"
+    assert compiled(configurations(directory)) == ("PANDOC", False)
+
+
+def test_changed_configuration_is_compiled_again(tmp_path):
+    directory = project(tmp_path / "a", "command: pandoc\n")
+    configs = configurations(directory)
+    compiled(configs)
+    configs.save()
+    (directory / "premd.yml").write_text("command: other-converter\n")
+    assert compiled(configurations(directory)) == ("OTHER-CONVERTER", True)
+
+
+def test_replaced_file_with_the_same_time_is_read_again(tmp_path):
+    directory = project(tmp_path / "a", "command: pandoc\n")
+    assert configurations(directory)["command"] == "pandoc"
+    replace(directory / "premd.yml", "command: nodnap\n")
+    configs = configurations(directory)
+    assert configs["command"] == "nodnap"
+    assert compiled(configs) == ("NODNAP", True)
+
+
+def test_compiled_values_are_saved_together(tmp_path, monkeypatch):
+    directory = project(tmp_path / "a", "command: pandoc\n")
+    configs = configurations(directory)
+    configs.data
+    writes = []
+    save = configs._save
+    monkeypatch.setattr(configs, "_save", lambda: writes.append(save()))
+    for target in ["a.html", "b.pdf", "c.epub"]:
+        configs.compiled(("test", target), lambda: target.upper())
+    assert writes == []
+    configs.save()
+    configs.save()
+    assert len(writes) == 1
+    cached = json.loads(
+        (directory / ".premd-cache" / "config.json").read_text()
+    )
+    assert len(cached["table"]) == 3
+    assert configurations(directory).compiled(
+        ("test", "b.pdf"), lambda: pytest.fail("compiled again")
+    ) == "B.PDF"
+
+
+def test_projects_do_not_share_configurations(tmp_path, monkeypatch):
+    first = project(tmp_path / "a", "command: pandoc\n")
+    second = project(tmp_path / "b", "command: nodnap\n")
+    stat = os.stat(first / "premd.yml")
+    os.utime(second / "premd.yml", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    # both as premd.yml relative to the working directory
+    monkeypatch.chdir(first)
+    assert configurations(".")["command"] == "pandoc"
+    monkeypatch.chdir(second)
+    assert configurations(".")["command"] == "nodnap"
@@ -0,0 +1,41 @@
+"""
+The memory-mapped fast path should produce exactly what the line by
+line path does.
+"""
+
+from premd import flatten
+
+
+def flattened(filename):
+    return "".join(line + "\n" for line in flatten.flatten(filename))
+
+
+def test_chunks_match_lines(book, monkeypatch):
+    monkeypatch.chdir(book)
+    assert "".join(flatten.flatten_chunks("book.txt")) == flattened("book.txt")
+
+
+def test_line_endings_match_lines(book, monkeypatch):
+    monkeypatch.chdir(book)
+    (book / "endings.txt").write_bytes(
+        b"Windows\r\nline endings\r\n%% TODO: here too\r\n"
+        b"a lone\rcarriage return\n"
+        b"/chapters/nested/deep.txt\r\n"
+        b"no final newline  "
+    )
+    chunks = "".join(flatten.flatten_chunks("endings.txt"))
+    assert chunks == flattened("endings.txt")
+
+
+def test_fast_output_matches_default(premd):
+    default = premd("transform", "book.txt").stdout
+    assert b"trailing space\n" in default
+    assert premd("transform", "--fast", "book.txt").stdout == default
+
+
+def test_fast_build_matches_default(premd, book):
+    premd("build", "book.txt", "-o", "default.md")
+    premd("build", "--fast", "book.txt", "-o", "fast.md")
+    default = (book / "default.md").read_bytes()
+    assert default == premd("transform", "book.txt").stdout
+    assert (book / "fast.md").read_bytes() == default
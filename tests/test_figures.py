@@ -0,0 +1,83 @@
+"""
+Preparing figures for each target with build --figures.
+"""
+
+import pytest
+
+from premd import configuration
+from premd import figures
+
+
+def configurations(data):
+    configs = configuration.Configurations()
+    configs.data = dict({"command": None, "arguments": []}, **data)
+    return configs
+
+
+def test_screen_targets_get_smaller_figures():
+    configs = configurations({})
+    assert figures.target_profile(configs, "book.html") == {
+        "max_width": 1600, "optimize": True
+    }
+    assert figures.target_profile(configs, "book.epub") == {
+        "max_width": 1600, "optimize": True
+    }
+    assert figures.target_profile(configs, "book.pdf") is None
+
+
+def test_configuration_changes_the_profile():
+    configs = configurations({
+        "figures": {"html": {"max_width": 800}, "pdf": {"format": "JPEG"}},
+        "targets": {
+            "small.html": {"figures": {"quality": 60}},
+            "plain.html": {"figures": None},
+        },
+    })
+    assert figures.target_profile(configs, "book.html") == {
+        "max_width": 800, "optimize": True
+    }
+    assert figures.target_profile(configs, "small.html") == {
+        "max_width": 800, "optimize": True, "quality": 60
+    }
+    assert figures.target_profile(configs, "plain.html") is None
+    assert figures.target_profile(configs, "book.pdf") == {"format": "JPEG"}
+
+
+def test_figures_are_kept_for_targets_without_a_profile(book, monkeypatch):
+    monkeypatch.chdir(book)
+    (book / "chapters" / "figures").mkdir()
+    (book / "chapters" / "figures" / "one.png").write_bytes(b"not read")
+    text = "![A figure](chapters/figures/one.png){#fig:one}\n"
+    assert figures.figure_links(text) == {"chapters/figures/one.png"}
+    texts = figures.target_texts(
+        configurations({}), ["a.pdf", "b.md"], text, str(book)
+    )
+    assert texts == {"a.pdf": text, "b.md": text}
+
+
+def test_figures_are_prepared_per_profile(book, monkeypatch):
+    image = pytest.importorskip("PIL.Image")
+    monkeypatch.chdir(book)
+    (book / "chapters" / "figures").mkdir()
+    image.new("RGB", (3000, 1500), "white").save(
+        book / "chapters" / "figures" / "one.png"
+    )
+    text = "![A figure](chapters/figures/one.png){#fig:one}\n"
+    texts = figures.target_texts(
+        configurations({}), ["a.html", "b.epub", "c.pdf"], text, str(book)
+    )
+    assert texts["c.pdf"] == text
+    assert texts["a.html"] == texts["b.epub"] != text
+    asset = texts["a.html"].split("(")[1].split(")")[0]
+    with image.open(book / asset) as prepared:
+        assert prepared.size == (1600, 800)
+
+
+def test_build_without_pillow_uses_the_figures(premd, book):
+    if figures.available():
+        pytest.skip("Pillow is installed")
+    result = premd("build", "book.txt", "-o", "out.html", "--figures")
+    assert "Pillow is not installed" in result.stderr
+    assert (book / "out.html").read_bytes() == premd(
+        "transform", "book.txt"
+    ).stdout
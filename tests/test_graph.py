@@ -0,0 +1,72 @@
+"""
+Indexing the include graph and listing dependencies with premd deps.
+"""
+
+import json
+
+from premd import flatten
+from premd import graph
+
+DEPENDENCIES = [
+    "book.txt", "chapters/figures/one.png", "chapters/missing.txt",
+    "chapters/nested/deep.txt", "chapters/one.txt", "chapters/two.txt"
+]
+# make would stop at prerequisites it has no rule for
+EXISTING = [
+    "book.txt", "chapters/nested/deep.txt", "chapters/one.txt",
+    "chapters/two.txt"
+]
+
+
+def make_rules(text):
+    """The rules in a Makefile, as a list of targets and prerequisites."""
+    rules = []
+    for rule in text.replace("\\\n", " ").split("\n\n"):
+        targets, prerequisites = rule.split(":")
+        rules.append((targets.split(), prerequisites.split()))
+    return rules
+
+
+def test_graph_has_the_dependencies_flatten_reads(book, monkeypatch):
+    monkeypatch.chdir(book)
+    dependencies = set()
+    for _line in flatten.flatten("book.txt", False, dependencies=dependencies):
+        pass
+    assert graph.build_graph("book.txt").dependencies() == dependencies
+    assert sorted(dependencies) == DEPENDENCIES
+
+
+def test_deps_writes_a_make_rule(premd):
+    rules = make_rules(premd("deps", "book.txt", "-o", "a.md", "b.md")
+                       .stdout.decode())
+    assert rules == [(["a.md", "b.md"], EXISTING)]
+
+
+def test_phony_adds_a_rule_per_dependency(premd):
+    rules = make_rules(premd("deps", "book.txt", "-o", "a.md", "--phony")
+                       .stdout.decode())
+    assert rules == [(["a.md"], EXISTING)] + [
+        ([dependency], []) for dependency in EXISTING
+    ]
+
+
+def test_dependencies_that_appear_are_listed(premd, book):
+    (book / "chapters" / "missing.txt").write_text("Not missing now.\n")
+    rules = make_rules(premd("deps", "book.txt", "-o", "a.md").stdout.decode())
+    assert rules == [(["a.md"], sorted(EXISTING + ["chapters/missing.txt"]))]
+
+
+def test_deps_writes_json(premd):
+    report = json.loads(premd("deps", "book.txt", "--format", "json").stdout)
+    assert report["dependencies"] == DEPENDENCIES
+    assert report["files"]["book.txt"] == {
+        "includes": ["chapters/one.txt", "chapters/two.txt"],
+        "figures": [],
+        "missing": ["chapters/missing.txt"],
+    }
+
+
+def test_circular_inclusion_is_reported(premd, book):
+    (book / "chapters" / "nested" / "deep.txt").write_text("/deep.txt\n")
+    result = premd("deps", "book.txt", "-o", "a.md", status=1)
+    assert "chapters/nested/deep.txt" in result.stderr
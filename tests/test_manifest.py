@@ -0,0 +1,78 @@
+"""
+Skipping the targets that are already built from the current input.
+"""
+
+import pytest
+
+from premd import manifest
+
+
+def build(premd, *args):
+    return premd("build", "book.txt", "-o", "out.md", *args).stderr
+
+
+def test_targets_are_built_from_the_document(premd, book):
+    assert "out.md: ok" in build(premd)
+    assert (book / "out.md").read_bytes() == premd("transform", "book.txt").stdout
+
+
+def test_up_to_date_targets_are_skipped(premd):
+    build(premd)
+    assert "out.md: up to date" in build(premd)
+
+
+def test_force_rebuilds_up_to_date_targets(premd):
+    build(premd)
+    assert "out.md: ok" in build(premd, "--force")
+
+
+def test_changed_include_is_rebuilt(premd, book):
+    build(premd)
+    (book / "chapters" / "nested" / "deep.txt").write_text("Changed.\n")
+    assert "out.md: ok" in build(premd)
+    assert b"Changed.\n" in (book / "out.md").read_bytes()
+
+
+def test_missing_include_that_appears_is_rebuilt(premd, book):
+    build(premd)
+    (book / "chapters" / "missing.txt").write_text("Found.\n")
+    assert "out.md: ok" in build(premd)
+    assert b"Found.\n" in (book / "out.md").read_bytes()
+
+
+def test_removed_target_is_rebuilt(premd, book):
+    build(premd)
+    (book / "out.md").unlink()
+    assert "out.md: ok" in build(premd)
+    assert (book / "out.md").exists()
+
+
+def test_build_works_without_a_manifest(premd, book):
+    # the cache directory cannot be made, so neither can the manifest
+    (book / ".premd-cache").write_text("not a directory")
+    assert "out.md: ok" in build(premd)
+    assert "out.md: ok" in build(premd)
+
+
+def test_figure_profile_is_part_of_the_manifest(book, monkeypatch):
+    monkeypatch.chdir(book)
+    (book / "out.html").write_text("built")
+    build_manifest = manifest.BuildManifest(str(book))
+    profile = {"max_width": 1600, "optimize": True}
+    build_manifest.record("out.html", ["cat"], {}, {"book.txt"}, profile)
+    assert build_manifest.is_current("out.html", ["cat"], {}, profile)
+    assert not build_manifest.is_current("out.html", ["cat"], {})
+    assert not build_manifest.is_current(
+        "out.html", ["cat"], {}, dict(profile, max_width=800)
+    )
+
+
+def test_figures_option_rebuilds_screen_targets(premd, book):
+    pytest.importorskip("PIL")
+    premd("build", "book.txt", "-o", "out.html")
+    result = premd("build", "book.txt", "-o", "out.html", "--figures")
+    assert "out.html: ok" in result.stderr
+    result = premd("build", "book.txt", "-o", "out.html", "--figures")
+    assert "out.html: up to date" in result.stderr
+    result = premd("build", "book.txt", "-o", "out.html")
+    assert "out.html: ok" in result.stderr
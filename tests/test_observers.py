@@ -0,0 +1,78 @@
+"""
+Sending lines to batch observers in blocks of consecutive lines.
+"""
+
+import json
+
+import pytest
+
+# A plugin that writes the blocks it was sent to $BLOCKS_FILE.
+BLOCKS = '''\
+import os, json
+from premd import plugin
+
+class Blocks(plugin.BatchObserverPlugin, plugin.SummaryPlugin):
+    """Blocks sent"""
+    def __init__(self):
+        self.blocks = []
+
+    def observe_lines(self, filename, lineno, lines):
+        self.blocks.append([filename, lineno, list(lines)])
+
+    def summarize(self, outfile):
+        with open(os.environ["BLOCKS_FILE"], "w") as stream:
+            json.dump(self.blocks, stream)
+'''
+
+
+@pytest.fixture
+def blocks(install_plugins, tmp_path, monkeypatch):
+    """Install the Blocks plugin and return a function giving the blocks
+    it was sent."""
+    install_plugins("test_blocks", BLOCKS, ["Blocks"])
+    blocks_file = tmp_path / "blocks.json"
+    monkeypatch.setenv("BLOCKS_FILE", str(blocks_file))
+    return lambda: json.loads(blocks_file.read_text())
+
+
+def observed_lines(blocks):
+    """The lines in :blocks, checking that each block holds consecutive
+    lines from one file and is no longer than a full block."""
+    lines = []
+    for _filename, _lineno, block in blocks:
+        assert 0 < len(block) <= 4096
+        lines.extend(block)
+    return lines
+
+
+@pytest.mark.parametrize("option", ["--no-cache", "--fast"])
+def test_blocks_hold_every_line(premd, book, blocks, option):
+    premd("summarize", option, "book.txt")
+    output = premd("transform", "book.txt").stdout.decode()
+    assert observed_lines(blocks()) == output.splitlines()
+
+
+def test_blocks_break_at_files_and_gaps(premd, blocks):
+    premd("summarize", "--no-cache", "book.txt")
+    sent = [(filename, lineno) for filename, lineno, _block in blocks()]
+    # chapter one is split by its comment and the include after it
+    assert sent[:5] == [
+        ("book.txt", 0),
+        ("chapters/one.txt", 0),
+        ("chapters/one.txt", 4),
+        ("chapters/nested/deep.txt", 0),
+        ("chapters/nested/deep.txt", 2),
+    ]
+
+
+def test_long_files_are_sent_in_full_blocks(premd, book, blocks):
+    (book / "long.txt").write_text("".join(
+        "line {}\n".format(lineno) for lineno in range(10000)
+    ))
+    premd("summarize", "--no-cache", "long.txt")
+    assert [(lineno, len(block)) for _filename, lineno, block in blocks()] == [
+        (0, 4096), (4096, 4096), (8192, 1808)
+    ]
+    assert observed_lines(blocks()) == [
+        "line {}".format(lineno) for lineno in range(10000)
+    ]
@@ -0,0 +1,81 @@
+"""
+Running offloadable observer plugins in worker processes.
+"""
+
+import os
+
+# Plugins that count lines in a worker process and note in $MERGE_LOG
+# when what they counted is merged back. The first is slow, so it
+# finishes last.
+COUNTERS = '''\
+import os, time
+from premd import plugin
+
+class Counter(plugin.BatchObserverPlugin, plugin.MergeableSummaryPlugin):
+    """Lines counted"""
+    offloadable = True
+    delay = 0
+
+    def __init__(self):
+        self.lines = 0
+        self.pid = None
+
+    def observe_lines(self, filename, lineno, lines):
+        time.sleep(self.delay)
+        self.lines += len(lines)
+        self.pid = os.getpid()
+
+    def partial_state(self):
+        return self.lines, self.pid
+
+    def merge_state(self, state):
+        lines, pid = state
+        self.lines += lines
+        with open(os.environ["MERGE_LOG"], "a") as stream:
+            stream.write("{} {}\\n".format(type(self).__name__, pid))
+
+    def summarize(self, outfile):
+        print("{}: {}".format(type(self).__name__, self.lines), file=outfile)
+
+class Slow(Counter):
+    """Lines counted slowly"""
+    delay = 0.5
+
+class Fast(Counter):
+    """Lines counted quickly"""
+
+class Failing(Counter):
+    """Lines not counted"""
+    def observe_lines(self, filename, lineno, lines):
+        raise ValueError("cannot count")
+'''
+
+
+def install(install_plugins, tmp_path, monkeypatch, names):
+    install_plugins("test_counters", COUNTERS, names)
+    merge_log = tmp_path / "merges.log"
+    monkeypatch.setenv("MERGE_LOG", str(merge_log))
+    return merge_log
+
+
+def test_offloaded_plugins_merge_in_plugin_order(
+        premd, install_plugins, tmp_path, monkeypatch):
+    merge_log = install(install_plugins, tmp_path, monkeypatch,
+                        ["Slow", "Fast"])
+    summaries = premd("summarize", "book.txt").stdout.decode()
+    merges = [line.split() for line in merge_log.read_text().splitlines()]
+    lines = len(premd("transform", "book.txt").stdout.splitlines())
+    assert "Slow: {}".format(lines) in summaries
+    assert "Fast: {}".format(lines) in summaries
+    assert [name for name, _pid in merges] == ["Slow", "Fast"]
+    # each counted in a process of its own
+    pids = {pid for _name, pid in merges}
+    assert len(pids) == 2 and str(os.getpid()) not in pids
+
+
+def test_failing_worker_is_reported(premd, install_plugins, tmp_path,
+                                    monkeypatch):
+    install(install_plugins, tmp_path, monkeypatch, ["Fast", "Failing"])
+    result = premd("summarize", "book.txt", status=1)
+    assert "The Failing plugin failed in its worker process" in result.stderr
+    assert "cannot count" in result.stderr
@@ -0,0 +1,25 @@
+"""
+Parsing the include graph in a process pool should not change the
+output.
+"""
+
+
+def test_pooled_output_matches_serial(premd):
+    serial = premd("transform", "book.txt").stdout
+    assert premd("transform", "--parse-jobs", "2", "book.txt").stdout == serial
+
+
+def test_pooled_summary_matches_serial(premd):
+    serial = premd("summarize", "book.txt").stdout
+    assert b"write the introduction" in serial
+    assert premd("summarize", "--parse-jobs", "2", "book.txt").stdout == serial
+
+
+def test_fast_refuses_parse_jobs(premd):
+    for command in ["transform", "summarize"]:
+        refused = premd(command, "--fast", "--parse-jobs", "2", "book.txt",
+                        status=1)
+        assert "cannot be used with --parse-jobs" in refused.stderr
+    refused = premd("build", "--fast", "--parse-jobs", "2", "book.txt",
+                    "-o", "out.md", status=1)
+    assert "cannot be used with --parse-jobs" in refused.stderr
@@ -0,0 +1,50 @@
+"""
+Keeping summaries in a temporary database with --low-memory.
+"""
+
+import os
+
+import pytest
+
+from premd import records
+
+
+@pytest.mark.parametrize("options", [[], ["--fast"], ["--jobs", "2"]])
+def test_low_memory_summary_matches_default(premd, book, options):
+    # a tag seen again keeps its place
+    with open(book / "chapters" / "two.txt", "a") as stream:
+        stream.write("## Three\n%% todo: finish chapter two\nThe end.\n")
+    default = premd("summarize", "book.txt", *options).stdout
+    assert b"finish chapter two" in default
+    assert b"## Three" in default
+    low_memory = premd("summarize", "--low-memory", "book.txt", *options)
+    assert low_memory.stdout == default
+
+
+def test_low_memory_refuses_parse_jobs(premd):
+    result = premd(
+        "summarize", "--low-memory", "--parse-jobs", "2", "book.txt", status=1
+    )
+    assert "--low-memory" in result.stderr
+
+
+def test_stores_keep_the_order_of_writes():
+    store = records.RecordStore("CREATE TABLE rows (value INTEGER);")
+    store.batch_size = 10
+    for value in range(25):
+        store.write("INSERT INTO rows VALUES (?)", (value,))
+    assert [value for value, in store.query("SELECT value FROM rows")] == \
+        list(range(25))
+    assert os.path.exists(store.filename)
+    store.close()
+    assert not os.path.exists(store.filename)
+
+
+def test_detached_stores_are_handed_over():
+    store = records.RecordStore("CREATE TABLE rows (value INTEGER);")
+    store.write("INSERT INTO rows VALUES (?)", (1,))
+    filename = store.detach()
+    store = records.RecordStore("", filename)
+    assert store.execute("SELECT value FROM rows") == (1,)
+    store.close()
+    assert not os.path.exists(filename)
@@ -0,0 +1,94 @@
+"""
+Serving builds from a long-running premd serve.
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+
+import pytest
+
+
+@pytest.fixture
+def serving(premd, tmp_path):
+    """A running premd serve and the socket it listens on."""
+    socket_path = tmp_path / "run" / "premd.sock"
+    running = premd.start("serve", "--socket", str(socket_path))
+    running.wait_for("Serving builds")
+    # it says so just before it starts listening
+    deadline = time.monotonic() + 10
+    while not socket_path.exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    yield running, socket_path
+    assert running.stop() == 0
+    assert not socket_path.exists()
+
+
+def test_socket_is_private(serving):
+    _running, socket_path = serving
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(socket_path.parent).st_mode) == 0o700
+
+
+def test_build_through_server(premd, book, serving):
+    running, socket_path = serving
+    project = book / "project"
+    project.mkdir()
+    (project / "doc.txt").write_text("# Doc\n/../chapters/two.txt\n")
+    (project / "premd.yml").write_text(json.dumps({
+        "targets": ["out.md"],
+        "command": sys.executable,
+        "arguments": [str(premd.cat)],
+    }))
+    expected = "# Doc\n" + premd("transform", "chapters/two.txt").stdout.decode()
+    premd.directory = project
+    result = premd("build", "doc.txt", "--server", str(socket_path))
+    assert "out.md: ok" in result.stderr
+    assert (project / "out.md").read_text() == expected
+    # the server reads the input where the client is, and goes back
+    assert os.readlink("/proc/{}/cwd".format(running.process.pid)) == \
+        str(book)
+
+
+@pytest.mark.parametrize("option", [["--jobs", "2"], ["--profile"]])
+def test_server_refuses_jobs_and_profile(premd, serving, option):
+    _running, socket_path = serving
+    result = premd(
+        "build", "book.txt", "-o", "out.md", "--server", str(socket_path),
+        *option, status=1
+    )
+    assert "--jobs and --profile cannot be used" in result.stderr
+
+
+def test_errors_are_sent_back(premd, serving):
+    _running, socket_path = serving
+    result = premd(
+        "build", "nothing.txt", "-o", "out.md", "--server", str(socket_path),
+        status=1
+    )
+    assert "nothing.txt" in result.stderr
+
+
+def test_second_server_is_refused(premd, serving):
+    _running, socket_path = serving
+    result = premd("serve", "--socket", str(socket_path), status=1)
+    assert "already listening" in result.stderr
+
+
+def test_missing_server_is_reported(premd, tmp_path):
+    socket_path = tmp_path / "premd.sock"
+    result = premd(
+        "build", "book.txt", "-o", "out.md", "--server", str(socket_path),
+        status=1
+    )
+    assert "Couldn't reach the server" in result.stderr
+
+
+def test_shared_directory_is_refused(premd, tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    result = premd("serve", "--socket", str(shared / "premd.sock"), status=1)
+    assert "can be changed by other users" in result.stderr
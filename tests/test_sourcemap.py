@@ -0,0 +1,68 @@
+"""
+Finding where lines of the output came from.
+"""
+
+import pytest
+
+from premd import flatten
+from premd import sourcemap
+
+
+def test_runs_are_merged():
+    source_map = sourcemap.SourceMap()
+    source_map.add("a.txt", 0, 2)
+    source_map.add("a.txt", 2)
+    source_map.add("b.txt", 0, 3)
+    source_map.add("a.txt", 5, 0) # no lines, so no run
+    source_map.add("a.txt", 10)
+    assert list(source_map.runs()) == [
+        (0, "a.txt", 0, 3), (3, "b.txt", 0, 3), (6, "a.txt", 10, 1)
+    ]
+    assert len(source_map) == 7
+    assert source_map.locate(0) == ("a.txt", 0)
+    assert source_map.locate(4) == ("b.txt", 1)
+    assert source_map.locate(6) == ("a.txt", 10)
+    with pytest.raises(IndexError):
+        source_map.locate(7)
+
+
+def test_lines_are_located_in_their_files(book, monkeypatch):
+    monkeypatch.chdir(book)
+    source_map = sourcemap.SourceMap()
+    output = list(flatten.flatten("book.txt", False, source_map=source_map))
+    assert len(source_map) == len(output)
+    for line, text in enumerate(output):
+        filename, lineno = source_map.locate(line)
+        with open(filename) as stream:
+            source = stream.read().splitlines()[lineno]
+        if text.startswith("!["):
+            continue # the figure path is rewritten
+        assert text == source.rstrip()
+
+
+def locate(premd, *args):
+    lines = [str(line) for line in range(1, 18)]
+    return premd("locate", *args, *lines).stdout
+
+
+@pytest.mark.parametrize("options", [
+    ["--no-cache"], ["--fast"], ["--parse-jobs", "2"]
+])
+def test_input_modes_locate_the_same_lines(premd, options):
+    located = locate(premd, "--infile", "book.txt")
+    assert located.splitlines()[:3] == [
+        b"1: book.txt:1", b"2: chapters/one.txt:1", b"3: chapters/one.txt:2"
+    ]
+    assert locate(premd, "--infile", "book.txt", *options) == located
+
+
+def test_artifacts_locate_the_same_lines(premd):
+    located = locate(premd, "--infile", "book.txt")
+    premd("transform", "book.txt", "--artifact", "book.gz")
+    assert locate(premd, "--infile", "book.gz") == located
+
+
+def test_lines_past_the_end_are_reported(premd):
+    lines = len(premd("transform", "book.txt").stdout.splitlines())
+    result = premd("locate", "--infile", "book.txt", str(lines + 1), status=1)
+    assert "The output has no line {}".format(lines + 1) in result.stderr
@@ -0,0 +1,60 @@
+"""
+Summarizing in parallel shards should give what a serial run gives.
+"""
+
+import io
+
+import pytest
+
+from premd import flatten
+from premd import summary
+from premd.plugin import plugins
+
+
+def summaries():
+    """What the summary plugins have collected, as they report it."""
+    outfile = io.StringIO()
+    for name, plugin in sorted(plugins.summary_plugins.items()):
+        print(name, file=outfile)
+        plugin.summarize(outfile)
+    return outfile.getvalue()
+
+
+@pytest.fixture
+def fresh_plugins():
+    plugins.reset()
+    yield
+    plugins.reset()
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_sharded_analysis_matches_serial(book, monkeypatch, fresh_plugins,
+                                         fast):
+    monkeypatch.chdir(book)
+    for _line in flatten.flatten("book.txt"):
+        pass
+    serial = summaries()
+    assert "write the introduction" in serial
+    assert "### Deep 20" in serial
+    plugins.reset()
+    assert summary.shardable()
+    summary.analyse_sharded("book.txt", 2, fast)
+    assert summaries() == serial
+
+
+def test_sharded_summary_matches_serial(premd):
+    serial = premd("summarize", "book.txt").stdout
+    assert premd("summarize", "--jobs", "2", "book.txt").stdout == serial
+
+
+def test_summaries_go_to_the_output_file(premd, book):
+    assert premd("summarize", "book.txt", "summary.txt").stdout == b""
+    summary = (book / "summary.txt").read_text()
+    assert "Word count for the entire document:" in summary
+    assert "write the introduction" in summary
+
+
+def test_build_summaries_stay_out_of_stdout(premd):
+    built = premd("build", "book.txt", "-o", "out.md", "--info", "wc")
+    assert built.stdout == b""
+    assert "Word count for the entire document:" in built.stderr
@@ -0,0 +1,58 @@
+"""
+Classifying comment lines by their tag, as the tag plugins handle them.
+"""
+
+import pytest
+
+from premd.plugin import plugins
+from premd.plugins.fixme import FIXME
+
+SPELLINGS = ["FIXME", "Fixme", "fixme", "TODO", "Todo", "todo"]
+
+
+def baseline(line):
+    """The tag and rest of a comment line, and whether FIXME handles
+    it, split as premd always split them."""
+    tag, *rest = line[2:].split(':', maxsplit = 1)
+    tag = tag.strip()
+    rest = "" if rest == [] else rest[0].strip()
+    return tag in SPELLINGS, tag, rest
+
+
+LINES = [
+    "%%{}{}{}{}".format(before, tag, after, rest)
+    for tag in SPELLINGS + ["FiXmE", "tOdO", "FIXMES", "XTODO", "", "other"]
+    for before in ["", " ", "  \t"]
+    for after in ["", " ", "\t "]
+    for rest in ["", ":", ": a message", ":  spaced : out  ", "::", " more"]
+]
+
+
+@pytest.fixture
+def fresh_plugins():
+    plugins.reset()
+    yield
+    plugins.reset()
+
+
+def test_matcher_agrees_with_split_lookup(fresh_plugins):
+    matcher = plugins.tag_matcher
+    for line in LINES:
+        handled, tag, rest = baseline(line)
+        matched = matcher.match_line(line)
+        if not handled:
+            assert matched is None, line
+            continue
+        assert matched is not None, line
+        plugin, seen, matched_rest = matched
+        assert isinstance(plugin, FIXME), line
+        assert seen == tag.upper(), line
+        assert matched_rest == rest, line
+
+
+def test_split_tags_agree_with_lookup(fresh_plugins):
+    matcher = plugins.tag_matcher
+    for line in LINES:
+        handled, tag, _rest = baseline(line)
+        assert (matcher.match_tag(tag) is not None) == handled, line
+        assert (tag in plugins.tag_plugins) == handled, line
@@ -0,0 +1,27 @@
+"""
+Profiling where the time goes with --profile.
+"""
+
+import json
+
+
+def test_profile_is_written_as_json(premd, book):
+    premd("build", "book.txt", "-o", "out.md", "--profile", "profile.json")
+    profile = json.loads((book / "profile.json").read_text())
+    assert set(profile["files"]) == {
+        "book.txt", "chapters/one.txt", "chapters/nested/deep.txt",
+        "chapters/two.txt"
+    }
+    assert any(name.endswith(".handle_tag") for name in profile["plugins"])
+    assert all(stats["calls"] > 0 for stats in profile["plugins"].values())
+    assert set(profile["commands"]["out.md"]) == {"write", "wait"}
+    assert profile["elapsed"] > 0
+
+
+def test_profile_is_reported(premd):
+    default = premd("transform", "book.txt").stdout
+    profiled = premd("transform", "book.txt", "--profile")
+    assert profiled.stdout == default
+    assert "read (s)" in profiled.stderr
+    assert "chapters/nested/deep.txt" in profiled.stderr
+    assert "Total time:" in profiled.stderr
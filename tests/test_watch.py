@@ -0,0 +1,54 @@
+"""
+Rebuilding the targets when a file the document depends on changes.
+"""
+
+import pytest
+
+from premd import watch
+
+
+def test_changed_include_is_rebuilt(premd, book):
+    watching = premd.start("watch", "book.txt", "-o", "out.md")
+    assert any("out.md: ok" in line for line in watching.wait_for("Watching"))
+    (book / "chapters" / "nested" / "deep.txt").write_text("Changed.\n")
+    lines = watching.wait_for("Watching")
+    assert any("Changed:" in line and "deep.txt" in line for line in lines)
+    assert any("out.md: ok" in line for line in lines)
+    assert b"Changed.\n" in (book / "out.md").read_bytes()
+    assert watching.stop() == 0
+
+
+def test_missing_include_is_watched(premd, book):
+    watching = premd.start("watch", "book.txt", "-o", "out.md")
+    watching.wait_for("Watching")
+    (book / "chapters" / "missing.txt").write_text("Not missing now.\n")
+    watching.wait_for("Watching")
+    assert b"Not missing now.\n" in (book / "out.md").read_bytes()
+    assert watching.stop() == 0
+
+
+def test_watch_goes_on_after_a_failed_build(premd, book):
+    watching = premd.start("watch", "book.txt", "-o", "out.md")
+    watching.wait_for("Watching")
+    deep = book / "chapters" / "nested" / "deep.txt"
+    deep.write_bytes(b"Not UTF-8: \xff\n")
+    lines = watching.wait_for("Watching")
+    assert any("Build failed" in line for line in lines)
+    deep.write_text("Fixed.\n")
+    lines = watching.wait_for("Watching")
+    assert any("out.md: ok" in line for line in lines)
+    assert b"Fixed.\n" in (book / "out.md").read_bytes()
+    assert watching.stop() == 0
+
+
+@pytest.mark.parametrize("make_watcher", [watch.watcher, watch.PollingWatcher])
+def test_changes_right_after_watch_are_seen(tmp_path, make_watcher):
+    watched = tmp_path / "watched.txt"
+    watched.write_text("Before.\n")
+    watcher = make_watcher()
+    try:
+        watcher.watch([str(watched)])
+        watched.write_text("After, and longer.\n")
+        assert watcher.wait() == {str(watched)}
+    finally:
+        watcher.close()